@@ -0,0 +1,140 @@
+"""barrier.py
+Superellipse control barrier functions, broadcasting over any batch shape.
+
+For the relative position r = [r_x, r_y] of a robot w.r.t. an obstacle
+
+    h(r) = |r_x / a|^n + |r_y / b|^n - safety_dist
+
+is positive outside the safety region. Relative positions and velocities are
+(..., 2) arrays, so one call evaluates a single pair, the obstacles of one
+robot (n_obs, 2) or all robots x obstacles pairs (N, n_obs, 2).
+"""
+
+import numpy as np
+
+
+class Superellipse():
+    """Superellipse barrier with semi-axes a, b and exponent n (even n >= 2
+    keeps h twice differentiable). The default is the quartic barrier
+    r_x^4 / a^4 + r_y^4 / b^4 - safety_dist used by ecbf_control.
+
+    Parameters
+    ----------
+    a, b : float
+        semi-axes along x and y
+    exponent : float
+    """
+    def __init__(self, a=1, b=1, exponent=4):
+        self.a = a
+        self.b = b
+        self.exponent = exponent
+        self.scale = np.array([np.power(a, exponent), np.power(b, exponent)], dtype=np.double)
+
+    def h_xy(self, r_x, r_y, safety_dist=1):
+        """h from separate (broadcastable) x and y relative positions, e.g. for grids."""
+        n = self.exponent
+        return np.power(np.abs(r_x), n) / self.scale[0] + np.power(np.abs(r_y), n) / self.scale[1] - safety_dist
+
+    def h(self, rel_r, safety_dist=1):
+        """Barrier value (...) at relative positions rel_r (..., 2)."""
+        return self.h_xy(rel_r[..., 0], rel_r[..., 1], safety_dist)
+
+    def grad(self, rel_r):
+        """Gradient dh/dr (..., 2)."""
+        n = self.exponent
+        return n * np.sign(rel_r) * np.power(np.abs(rel_r), n - 1) / self.scale
+
+    def hessian_diag(self, rel_r):
+        """Diagonal (..., 2) of the Hessian d2h/dr2, which has no cross terms."""
+        n = self.exponent
+        return n * (n - 1) * np.power(np.abs(rel_r), n - 2) / self.scale
+
+    def hessian(self, rel_r):
+        """Hessian d2h/dr2 (..., 2, 2)."""
+        diag = self.hessian_diag(rel_r)
+        hess = np.zeros(diag.shape + (2,))
+        hess[..., 0, 0] = diag[..., 0]
+        hess[..., 1, 1] = diag[..., 1]
+        return hess
+
+    def hd(self, rel_r, rd):
+        """Time derivative of h (...) given relative velocities rd (..., 2)."""
+        return np.sum(self.grad(rel_r) * rd, axis=-1)
+
+    def constraints(self, rel_r, rd, K, safety_dist=1, out=None):
+        """Exponential CBF constraints A u <= b on the robot acceleration u.
+
+        hdd = grad . u + rd' H rd, and h is kept positive by
+        hdd + K[0] h + K[1] hd >= 0.
+
+        Parameters
+        ----------
+        rel_r, rd : (..., 2) np.ndarray
+            relative positions and velocities
+        K : (2, ) or (..., 2) np.ndarray
+            [Kp, Kd] gains, per pair or broadcast over leading dims with
+            shape (N, 1, 2) for per-robot gains of (N, n_obs) pairs
+        safety_dist : float or np.ndarray
+        out : dict, optional
+            constraint_buffers of the shape of rel_r; the results are
+            written into (and returned as) its arrays, with the same values
+
+        Returns
+        -------
+        constraints : dict
+            "h", "hd", "b" : (...) np.ndarray, "A" : (..., 2) np.ndarray
+        """
+        n = self.exponent
+        K = np.asarray(K, dtype=np.double)
+        if out is not None:
+            return self._constraints_into(rel_r, rd, K, safety_dist, out)
+        dh_dr = self.grad(rel_r)
+        h = np.sum(np.power(np.abs(rel_r), n) / self.scale, axis=-1) - safety_dist
+        hd = np.sum(dh_dr * rd, axis=-1)
+        extra = -np.sum(n * (n - 1) * np.power(np.abs(rel_r), n - 2) * np.square(rd) / self.scale, axis=-1)
+        b_ineq = -(extra - (K[..., 0] * h + K[..., 1] * hd))
+        return {"h": h, "hd": hd, "A": -dh_dr, "b": b_ineq}
+
+    def constraint_buffers(self, shape):
+        """Arrays for constraints(..., out=) of pairs of batch shape (...)."""
+        shape = tuple(shape)
+        buf = {key: np.empty(shape) for key in ("h", "hd", "b", "_extra", "_kd")}
+        buf.update({key: np.empty(shape + (2,)) for key in ("A", "_abs", "_pow", "_sq")})
+        return buf
+
+    def _constraints_into(self, rel_r, rd, K, safety_dist, out):
+        """constraints written into out, in the same order of operations."""
+        n = self.exponent
+        r_abs, pw, sq, A = out["_abs"], out["_pow"], out["_sq"], out["A"]
+        h, hd, extra, b_ineq = out["h"], out["hd"], out["_extra"], out["b"]
+        np.abs(rel_r, out=r_abs)
+        # A holds dh/dr until hd is computed
+        np.sign(rel_r, out=A)
+        np.multiply(n, A, out=A)
+        np.multiply(A, np.power(r_abs, n - 1, out=pw), out=A)
+        np.divide(A, self.scale, out=A)
+        np.divide(np.power(r_abs, n, out=pw), self.scale, out=pw)
+        np.subtract(np.sum(pw, axis=-1, out=h), safety_dist, out=h)
+        np.sum(np.multiply(A, rd, out=sq), axis=-1, out=hd)
+        np.multiply(n * (n - 1), np.power(r_abs, n - 2, out=pw), out=pw)
+        np.multiply(pw, np.square(rd, out=sq), out=pw)
+        np.divide(pw, self.scale, out=pw)
+        np.negative(np.sum(pw, axis=-1, out=extra), out=extra)
+        np.multiply(K[..., 0], h, out=b_ineq)
+        np.add(b_ineq, np.multiply(K[..., 1], hd, out=out["_kd"]), out=b_ineq)
+        np.negative(np.subtract(extra, b_ineq, out=b_ineq), out=b_ineq)
+        np.negative(A, out=A)
+        return {"h": h, "hd": hd, "A": A, "b": b_ineq}
+
+    def pairwise_constraints(self, pos, vel, obs, obs_v, K, safety_dist=1):
+        """constraints for every robot (N, 2) against every obstacle (M, 2), as (N, M) arrays.
+        Per-robot gains K are given as (N, 2)."""
+        K = np.asarray(K, dtype=np.double)
+        if K.ndim == 2:
+            K = K[:, np.newaxis, :]
+        return self.constraints(pairwise(pos, obs), pairwise(vel, obs_v), K, safety_dist)
+
+
+def pairwise(a, b):
+    """Differences a[i] - b[j] (N, M, 2) of points a (N, 2) and b (M, 2)."""
+    return np.asarray(a, dtype=np.double)[:, np.newaxis, :] - np.asarray(b, dtype=np.double)[np.newaxis, :, :]
@@ -0,0 +1,408 @@
+"""benchmarks.py
+Reproducible benchmarks for the dynamics, controller, ECBF and lidar hot paths,
+and end-to-end swarm throughput.
+
+Each benchmark sets up its inputs once (seeded) and returns a function that
+does one unit of work; it is timed with timeit over several repeats. Results
+are written as JSON so runs can be compared between releases.
+
+`python benchmarks.py --out bench.json`                 run all, save results
+`python benchmarks.py --filter ecbf`                    only names containing "ecbf"
+`python benchmarks.py --compare old.json --out new.json`  flag regressions
+`python benchmarks.py --no-timing --integrators`         only integrator accuracy vs cost
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import timeit
+
+import numpy as np
+
+BENCHMARKS = {}
+SWARM_SIZES = [2, 10, 100, 1000]
+
+
+def benchmark(name, unit="call", n_items=1):
+    """Register a benchmark. The decorated function does setup and returns a
+    zero-argument function timed as one call processing n_items units."""
+    def register(setup):
+        BENCHMARKS[name] = {"setup": setup, "unit": unit, "n_items": n_items}
+        return setup
+    return register
+
+
+def swarm_robots(n, seed=0, spacing=3.0):
+    """Starts and goals of n robots in a square arena with constant density."""
+    rng = np.random.default_rng(seed)
+    half = spacing * np.sqrt(n) / 2
+    grid = int(np.ceil(np.sqrt(n)))
+    cells = rng.permutation(grid * grid)[:n]
+    starts = (np.stack((cells % grid, cells // grid), axis=1) + 0.5) * (2 * half / grid) - half
+    goals = -starts + rng.uniform(-0.5, 0.5, starts.shape)
+    return starts, goals
+
+
+@benchmark("dynamics.step_dynamics")
+def bench_step_dynamics():
+    from dynamics import QuadDynamics, init_state, basic_input
+    dyn, state, u = QuadDynamics(), init_state(), basic_input()
+    return lambda: dyn.step_dynamics(dict(state), u)
+
+
+@benchmark("dynamics.batch_step[1000]", unit="robot-step", n_items=1000)
+def bench_batch_step():
+    from dynamics import BatchQuadDynamics
+    dyn = BatchQuadDynamics(1000)
+    dyn.states[:, 2] = 10
+    u = np.full((1000, 4), 408750.0)
+    return lambda: dyn.step_states(dyn.states, u)
+
+
+@benchmark("dynamics.step_dynamics[quaternion]")
+def bench_step_dynamics_quaternion():
+    from dynamics import QuadDynamics, QuadState, init_state
+    dyn, state = QuadDynamics("quaternion"), QuadState.from_dict(init_state())
+    u = np.full(4, 408750.0)
+    return lambda: dyn.step_dynamics(state, u)
+
+
+@benchmark("dynamics.batch_step[1000,quaternion]", unit="robot-step", n_items=1000)
+def bench_batch_step_quaternion():
+    from dynamics import BatchQuadDynamics
+    dyn = BatchQuadDynamics(1000, integrator="quaternion")
+    dyn.states[:, 2] = 10
+    u = np.full((1000, 4), 408750.0)
+    return lambda: dyn.step(u)
+
+
+@benchmark("controller.go_to_acceleration")
+def bench_go_to_acceleration():
+    from dynamics import init_state, param_dict
+    from controller import go_to_acceleration
+    state = init_state()
+    des_acc = np.array([0.03, -0.02, 0])
+    return lambda: go_to_acceleration(state, des_acc, param_dict)
+
+
+@benchmark("controller.go_to_acceleration_batch[1000]", unit="robot-step", n_items=1000)
+def bench_go_to_acceleration_batch():
+    from dynamics import init_state, state_to_array, param_dict
+    from controller import go_to_acceleration_batch
+    states = np.tile(state_to_array(init_state()), (1000, 1))
+    des_acc = np.tile([0.03, -0.02, 0], (1000, 1))
+    return lambda: go_to_acceleration_batch(states, des_acc, param_dict)
+
+
+@benchmark("controller.angerr2u")
+def bench_angerr2u():
+    from dynamics import param_dict
+    from controller import angerr2u
+    error, theta = np.array([0.1, -0.2, 0.05]), np.zeros(3)
+    return lambda: angerr2u(error, theta, 1635000.0, param_dict)
+
+
+@benchmark("controller.cascaded[1000]", unit="robot-step", n_items=1000)
+def bench_cascaded_controller():
+    from dynamics import init_state, state_to_array, param_dict
+    from controller import CascadedController
+    ctrl = CascadedController(param_dict, 1000)
+    states = np.tile(state_to_array(init_state()), (1000, 1))
+    des_pos = np.tile([3.0, -3.0, 9.0], (1000, 1))
+    return lambda: ctrl.go_to_position(states, des_pos)
+
+
+def _ecbf_setup(n_obs, seed=0):
+    from ecbf_control import ECBF_control
+    rng = np.random.default_rng(seed)
+    state = {"x": np.array([0.0, 0.0, 10.0]), "xdot": np.array([0.3, 0.2, 0.0]),
+             "theta": np.zeros(3), "thetadot": np.zeros(3)}
+    ecbf = ECBF_control(state, np.array([[5.0], [5.0]]))
+    angle = rng.uniform(0, 2 * np.pi, n_obs)
+    dist = rng.uniform(1.2, 4, n_obs)
+    obs = np.stack((dist * np.cos(angle), dist * np.sin(angle)))
+    obs_v = rng.uniform(-0.2, 0.2, (2, n_obs))
+    return ecbf, obs, obs_v
+
+
+def _register_safe_control(n_obs, spread=1):
+    """compute_safe_control against n_obs obstacles, spread times further out,
+    warm started from the active set of the previous (same) call, and cold
+    with the warm start cleared before every call."""
+    def setup(cold):
+        ecbf, obs, obs_v = _ecbf_setup(n_obs)
+        obs *= spread
+        if not cold:
+            return lambda: ecbf.compute_safe_control(obs, obs_v, 0)
+
+        def solve():
+            ecbf.qp_active = []
+            return ecbf.compute_safe_control(obs, obs_v, 0)
+        return solve
+
+    benchmark("ecbf.compute_safe_control[%d,warm]" % n_obs)(lambda: setup(cold=False))
+    benchmark("ecbf.compute_safe_control[%d,cold]" % n_obs)(lambda: setup(cold=True))
+
+
+_register_safe_control(4)
+_register_safe_control(50)
+_register_safe_control(200, spread=4)  # spread out, most constraints can be pruned
+
+
+@benchmark("barrier.pairwise_constraints[100x100]", unit="pair", n_items=10000)
+def bench_pairwise_constraints():
+    from ecbf_control import barrier
+    rng = np.random.default_rng(0)
+    pos, vel = rng.uniform(-30, 30, (100, 2)), rng.normal(0, 1, (100, 2))
+    return lambda: barrier.pairwise_constraints(pos, vel, pos, vel, [6, 8])
+
+
+@benchmark("ecbf.compute_plot_z")
+def bench_compute_plot_z():
+    from ecbf_control import compute_plot_z
+    _, obs, _ = _ecbf_setup(5)
+    return lambda: compute_plot_z(obs)
+
+
+@benchmark("ecbf.safety_field[10]", unit="frame")
+def bench_safety_field():
+    from ecbf_control import SafetyField
+    rng = np.random.default_rng(0)
+    field = SafetyField(rng.uniform(-6, 6, (3, 2)))
+    pos = rng.uniform(-7, 7, (10, 2))
+
+    def frame():
+        pos[:] += 0.01
+        field.update(pos)
+        return field.z
+    return frame
+
+
+@benchmark("simulator.lidar_update_reading")
+def bench_lidar_update_reading():
+    from simulator import Map, LidarSimulator
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_obs.dat")
+    lidar = LidarSimulator(Map(path))
+    return lambda: lidar.update_reading((50, 10), 0.0)
+
+
+@benchmark("simulator.lidar_cast_rays[360]", unit="beam", n_items=360)
+def bench_lidar_cast_rays():
+    from simulator import Map, LidarSimulator
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_obs.dat")
+    lidar = LidarSimulator(Map(path))
+    angles = np.radians(np.arange(360))
+    return lambda: lidar.cast_rays((50, 10), angles)
+
+
+@benchmark("simulator.map_sphere_trace[360]", unit="beam", n_items=360)
+def bench_map_sphere_trace():
+    from simulator import Map
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_obs.dat")
+    map1 = Map(path)
+    angles = np.radians(np.arange(360))
+    return lambda: map1.sphere_trace((50, 10), angles)
+
+
+@benchmark("simulator.map_nearest_obstacle")
+def bench_map_nearest_obstacle():
+    from simulator import Map
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "three_obs.dat")
+    map1 = Map(path)
+    return lambda: map1.nearest_obstacle((50.3, 10.2))
+
+
+def _register_swarm(n):
+    @benchmark("swarm.step[%d]" % n, unit="robot-step", n_items=n)
+    def bench_swarm_step():
+        from ecbf_control import Swarm_Sim
+        starts, goals = swarm_robots(n)
+        swarm = Swarm_Sim(np.hstack((starts, np.full((n, 1), 10.0))), goals, sensing_radius=5.0)
+        return lambda: swarm.step()
+
+
+for _n in SWARM_SIZES:
+    _register_swarm(_n)
+
+
+INTEGRATOR_DTS = [0.02, 0.05, 0.1, 0.2, 0.4]
+
+
+def _open_loop_inputs(n):
+    """Near-hover input with small per-vehicle torque offsets, and slightly tilted, rotating initial states."""
+    rng = np.random.default_rng(0)
+    u = 408750.0 + rng.uniform(-100, 100, (n, 4))
+    states = np.zeros((n, 12))
+    states[:, 2] = 10
+    states[:, 6:9] = rng.uniform(-0.05, 0.05, (n, 3))
+    states[:, 9:12] = rng.uniform(-0.05, 0.05, (n, 3))
+    return states, u
+
+
+def _open_loop(integrator, dt, states, u, duration):
+    from dynamics import BatchQuadDynamics, param_dict
+    dyn = BatchQuadDynamics(param_dict=dict(param_dict, dt=dt), integrator=integrator)
+    for _ in range(int(round(duration / dt))):
+        states = dyn.step_states(states, u)
+    return states
+
+
+def _crossing_min_h(integrator, dt, duration=30.0, n=4, radius=3.0):
+    """Closed loop ECBF run of n robots swapping places across a circle.
+    Returns the smallest true barrier value between any two robots, NaN if
+    the closed loop diverged."""
+    import ecbf_control
+    from barrier import pairwise
+    from dynamics import param_dict
+    angle = np.arange(n) * 2 * np.pi / n
+    starts = radius * np.stack((np.cos(angle), np.sin(angle)), axis=1)
+    swarm = ecbf_control.Swarm_Sim(np.hstack((starts, np.full((n, 1), 10.0))), -starts,
+                                   param_dict=dict(param_dict, dt=dt), integrator=integrator)
+    min_h = np.inf
+    for _ in range(int(round(duration / dt))):
+        try:
+            swarm.step()
+        except RuntimeError:  # rk45 step size collapsed
+            return np.nan
+        pos = swarm.positions[:, :2]
+        if not np.all(np.isfinite(pos)):
+            return np.nan
+        h = swarm.barrier.h(pairwise(pos, pos), swarm.safety_dist)
+        min_h = min(min_h, np.min(h[~np.eye(n, dtype=bool)]))
+    return float(min_h)
+
+
+def integrator_tradeoff(dts=INTEGRATOR_DTS, duration=2.0, n_robots=100):
+    """Accuracy against cost for each integrator and step size.
+
+    Returns one dict per (integrator, dt):
+    pos_error : max open loop position error (m) after duration, against
+        rk45 at dt 0.01 with tight tolerances
+    cost_s : wall time per simulated second for n_robots vehicles
+    min_h : smallest barrier value in a closed loop ECBF crossing scenario,
+        negative means the safety constraint was violated, NaN that the
+        closed loop diverged
+    """
+    from dynamics import BatchQuadDynamics, INTEGRATORS, param_dict
+    states, u = _open_loop_inputs(n_robots)
+    ref_dyn = BatchQuadDynamics(param_dict=dict(param_dict, dt=0.01), integrator="rk45", rtol=1e-10, atol=1e-12)
+    ref = states
+    for _ in range(int(round(duration / 0.01))):
+        ref = ref_dyn.step_states(ref, u)
+
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()), np.errstate(all="ignore"):
+        for integrator in INTEGRATORS:
+            for dt in dts:
+                start = time.perf_counter()
+                end_states = _open_loop(integrator, dt, states, u, duration)
+                cost = (time.perf_counter() - start) / duration
+                rows.append({
+                    "integrator": integrator,
+                    "dt": dt,
+                    "pos_error": float(np.max(np.abs(end_states[:, :3] - ref[:, :3]))),
+                    "cost_s": cost,
+                    "min_h": _crossing_min_h(integrator, dt),
+                })
+    return rows
+
+
+def run_benchmark(name, repeat=5, min_time=0.2):
+    """Time one benchmark. Returns dict of seconds per call and units per second."""
+    spec = BENCHMARKS[name]
+    with contextlib.redirect_stdout(io.StringIO()):  # setup and crash/QP messages
+        func = spec["setup"]()
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        number = max(1, int(np.ceil(number * min_time / 0.2)))
+        times = np.array(timer.repeat(repeat=repeat, number=number)) / number
+    return {
+        "name": name,
+        "unit": spec["unit"],
+        "n_items": spec["n_items"],
+        "number": number,
+        "repeat": repeat,
+        "best_s": float(np.min(times)),
+        "median_s": float(np.median(times)),
+        "stdev_s": float(np.std(times)),
+        "per_second": float(spec["n_items"] / np.min(times)),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def compare(results, baseline, threshold=1.2):
+    """Print speed ratio vs baseline results. Returns names slower than threshold."""
+    old = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        if r["name"] not in old:
+            continue
+        ratio = r["best_s"] / old[r["name"]]["best_s"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(r["name"])
+        print("%-40s %8.2fx%s" % (r["name"], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite.")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="approx. seconds per repeat")
+    parser.add_argument("--out", default=None, help="write results json")
+    parser.add_argument("--compare", default=None, help="baseline results json")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as regression")
+    parser.add_argument("--no-timing", action="store_true", help="skip the timing benchmarks")
+    parser.add_argument("--integrators", action="store_true",
+                        help="also report integrator accuracy against cost (see integrator_tradeoff)")
+    args = parser.parse_args()
+
+    results = []
+    for name in BENCHMARKS:
+        if args.no_timing or args.filter not in name:
+            continue
+        r = run_benchmark(name, args.repeat, args.min_time)
+        results.append(r)
+        print("%-40s %12.1f us/call %14.1f %s/s" % (name, r["best_s"] * 1e6, r["per_second"], r["unit"]))
+
+    report = {"environment": environment(), "results": results}
+    if args.integrators:
+        report["integrators"] = integrator_tradeoff()
+        print("%-14s %6s %12s %14s %10s" % ("integrator", "dt", "pos_error", "s/sim s", "min_h"))
+        for row in report["integrators"]:
+            print("%-14s %6.2f %12.2e %14.4f %10.3f" % (row["integrator"], row["dt"], row["pos_error"],
+                                                        row["cost_s"], row["min_h"]))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""checkpoint.py
+Save and load simulation checkpoints.
+
+A checkpoint is the nested dict returned by Simulation.checkpoint() (robot
+states, ECBF internals, integrator state, RNG state, obstacles, tick), built
+from the checkpoint() methods of the simulated objects. Restoring it with
+Simulation.restore continues the run bit for bit.
+
+save_checkpoint writes it to a compressed .npz: arrays are stored as they
+are, everything else (floats, ints, lists, strings, None) as one JSON entry.
+Floats are written with their shortest round-trip repr, so nothing is lost.
+
+    sim.start_checkpoints("ckpt", every=1000)  # writes ckpt/tick_00001000.npz, ...
+    sim.run(20000)
+    sim.restore(load_checkpoint(find_checkpoint("ckpt", 14000)))
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_EVERY = 1000  # ticks between checkpoints written by Simulation
+CHECKPOINT_NAME = "tick_%08d.npz"
+
+
+def _pack(obj, arrays):
+    """JSON-able copy of obj with every np.ndarray moved into arrays."""
+    if isinstance(obj, np.ndarray):
+        key = "a%d" % len(arrays)
+        arrays[key] = obj
+        return {"__array__": key}
+    if isinstance(obj, dict):
+        return {str(k): _pack(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_pack(v, arrays) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _unpack(obj, arrays):
+    if isinstance(obj, dict):
+        if "__array__" in obj:
+            return arrays[obj["__array__"]]
+        return {k: _unpack(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_unpack(v, arrays) for v in obj]
+    return obj
+
+
+def save_checkpoint(path, ckpt):
+    """Write checkpoint dict ckpt to path (.npz)."""
+    arrays = {}
+    tree = _pack(ckpt, arrays)
+    np.savez_compressed(path, __tree__=np.array(json.dumps(tree)), **arrays)
+
+
+def load_checkpoint(path):
+    """Checkpoint dict saved by save_checkpoint."""
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {key: data[key] for key in data.files if key != "__tree__"}
+        tree = json.loads(str(data["__tree__"]))
+    ckpt = _unpack(tree, arrays)
+    if ckpt.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("%s: checkpoint version %s, expected %d" % (path, ckpt.get("version"), CHECKPOINT_VERSION))
+    return ckpt
+
+
+def list_checkpoints(directory):
+    """(tick, path) of the checkpoints in directory, by tick."""
+    found = []
+    for name in os.listdir(directory):
+        match = re.fullmatch(r"tick_(\d+)\.npz", name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def find_checkpoint(directory, tick=None):
+    """Path of the last checkpoint in directory at or before tick (default: the last one)."""
+    found = [path for t, path in list_checkpoints(directory) if tick is None or t <= tick]
+    if not found:
+        raise FileNotFoundError("no checkpoint in %s%s" % (directory, "" if tick is None else " before tick %d" % tick))
+    return found[-1]
+
+
+def rng_state(rng):
+    """State of a np.random.Generator, or of the global np.random state if rng is np.random."""
+    if rng is np.random:
+        return np.random.get_state(legacy=False)
+    return rng.bit_generator.state
+
+
+def set_rng_state(rng, state):
+    if rng is np.random:
+        np.random.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+
+def rng_from_state(state):
+    """New np.random.Generator with the bit generator and state of a Generator's rng_state."""
+    rng = np.random.Generator(getattr(np.random, state["bit_generator"])())
+    rng.bit_generator.state = state
+    return rng
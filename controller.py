@@ -1,6 +1,23 @@
+import functools
 import numpy as np
 import math 
 
+# Cascaded PID constants shared by the free functions and CascadedController
+HOVER_TOT_U = 408750 * 4  # hover, for four motors
+MAX_TOT_U = 400000000.0
+MAX_TILT = np.radians(30)  # roll / pitch command limit
+
+# Default gains of CascadedController, per axis [x, y, z] (attitude: [roll, pitch, yaw]).
+# Same values as hard-coded in pi_position_control / pi_velocity_control / pi_attitude_control
+DEFAULT_GAINS = {
+    "P_pos": [-0.5, -0.5, -1],
+    "I_pos": [0, 0, 0],
+    "P_vel": [-0.12, -0.12, -0.001],
+    "I_vel": [-0.005, -0.005, 0],
+    "Kp_att": [30, 30, 30],
+    "Kd_att": [10, 10, 10],
+}
+
 
 def go_to_acceleration(state, des_acc, param_dict):
     # pass
@@ -10,6 +27,15 @@ def go_to_acceleration(state, des_acc, param_dict):
     return u
 
 
+def go_to_acceleration_batch(states, des_acc, param_dict, Kp=30, Kd=10):
+    """Batched go_to_acceleration: motor inputs (N, 4) given states (N, 12)
+    and desired accelerations (N, 3). Kp, Kd as in pi_attitude_control."""
+    states = np.asarray(states, dtype=np.double)
+    des_theta, des_thrust_pc = dynamic_inversion_batch(des_acc, states[:, 8], param_dict)
+    e = Kd * states[:, 9:12] + Kp * (states[:, 6:9] - des_theta)
+    return angerr2u(e, states[:, 6:9], des_thrust_pc * MAX_TOT_U, param_dict)
+
+
 def dynamic_inversion(des_acc, state, param_dict):
     """Invert dynamics. For outer loop, given v_tot, compute attitude.
     Similar to control allocator.
@@ -54,6 +80,42 @@ def dynamic_inversion(des_acc, state, param_dict):
 
     return des_theta, des_thrust_pc
 
+
+def dynamic_inversion_batch(des_acc, yaw, param_dict):
+    """Batched dynamic_inversion for N vehicles.
+
+    Parameters
+    ----------
+    des_acc : (N, 3) np.ndarray
+        desired accelerations
+    yaw : (N, ) np.ndarray
+        current yaw angles (rad)
+
+    Returns
+    -------
+    des_theta : (N, 3) np.ndarray
+        desired roll, pitch, yaw angles (rad), roll / pitch clipped to MAX_TILT
+    des_thrust_pc : (N, ) np.ndarray
+        desired thrust as a fraction of MAX_TOT_U
+    """
+    des_acc = np.asarray(des_acc, dtype=np.double)
+    acc_z = des_acc[:, 2] - param_dict["g"]
+    U1 = np.sqrt(des_acc[:, 0]**2 + des_acc[:, 1]**2 + acc_z**2)
+    sin_pitch = des_acc[:, 0] / U1
+    pitch_noyaw = np.arcsin(sin_pitch)
+    # cos(arcsin(s)) = sqrt(1 - s^2)
+    roll_noyaw = np.arcsin(des_acc[:, 1] / (U1 * np.sqrt(1 - sin_pitch**2)))
+
+    cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+    des_theta = np.empty_like(des_acc)
+    des_theta[:, 0] = pitch_noyaw * sin_yaw - roll_noyaw * cos_yaw
+    des_theta[:, 1] = pitch_noyaw * cos_yaw + roll_noyaw * sin_yaw
+    np.clip(des_theta[:, :2], -MAX_TILT, MAX_TILT, out=des_theta[:, :2])
+    des_theta[:, 2] = yaw  # TODO: currently, set yaw as constant
+
+    des_thrust_pc = param_dict["m"] * acc_z / (param_dict["k"] * MAX_TOT_U)  # T=ma/k
+    return des_theta, des_thrust_pc
+
 def go_to_position(state, des_pos, param_dict, integral_p_err=None, integral_v_err=None):
 
     des_vel, integral_p_err = pi_position_control(state,des_pos, integral_p_err)
@@ -224,36 +286,146 @@ def wrap2pi(ang_diff):
     return ang_diff
 def angerr2u(error, theta, tot_thrust, param_dict):
     """Compute control input given angular error. Closed form specification
-    with dynamics inversion.
+    with dynamics inversion, applied as one product with the mixer of
+    allocation_matrix.
 
     Parameters
     ----------
-    error
+    error : (3, ) or (N, 3) np.ndarray
+        angular error [e0, e1, e2]
+    theta
+        unused, kept for the call signature
+    tot_thrust : float or (N, ) np.ndarray
+        total motor input
+
+    Returns
+    -------
+    u : (4, ) or (N, 4) np.ndarray
+        control input - (angular velocity)^squared of motors (rad^2/s^2)
     """
-    # TODO: make into class, have param_dict as class member
-    g = param_dict["g"]
-    m = param_dict["m"]
-    L = param_dict["L"]
-    k = param_dict["k"]
-    b = param_dict["b"]
+    error = np.asarray(error, dtype=np.double)
+    cmd = np.empty(error.shape[:-1] + (4,))
+    cmd[..., 0] = tot_thrust
+    cmd[..., 1:] = error
+    return cmd @ allocation_matrix(param_dict)
+
+
+def allocation_matrix(param_dict):
+    """(4, 4) mixer M with motor inputs = [tot_thrust, e0, e1, e2] @ M.
+    Depends only on b, k, L and I, and is cached per parameter set (read-only)."""
     I = param_dict["I"]
-    kd = param_dict["kd"]
-    dt = param_dict["dt"]
-    
-    e0 = error[0]
-    e1 = error[1]
-    e2 = error[2]
-    Ixx = I[0, 0]
-    Iyy = I[1, 1]
-    Izz = I[2, 2]
+    return _allocation_matrix(param_dict["b"], param_dict["k"], param_dict["L"], I[0, 0], I[1, 1], I[2, 2])
+
+
+@functools.lru_cache(maxsize=None)
+def _allocation_matrix(b, k, L, Ixx, Iyy, Izz):
+    roll = Ixx / (2 * k * L)
+    pitch = Iyy / (2 * k * L)
+    yaw = Izz / (4 * b)
+    mixer = np.array([[0.25, 0.25, 0.25, 0.25],
+                      [-roll, 0, roll, 0],
+                      [0, -pitch, 0, pitch],
+                      [-yaw, yaw, -yaw, yaw]])
+    mixer.flags.writeable = False
+    return mixer
+
 
-    # TODO: make more readable
-    r0 = tot_thrust/4 - (2*b*e0*Ixx + e2*Izz*k*L)/(4*b*k*L)
+def saturate_motors(u, param_dict, out=None):
+    """Clip motor inputs (..., 4) to [0, maxRPM^2], for a whole batch at once."""
+    return np.clip(u, 0, param_dict["maxRPM"]**2, out=out)
 
-    r1 = tot_thrust/4 + (e2*Izz)/(4*b) - (e1*Iyy)/(2*k*L)
 
-    r2 = tot_thrust/4 + (2*b*e0*Ixx - e2*Izz*k*L)/(4*b*k*L)
+class CascadedController():
+    """Cascaded position -> velocity -> attitude PID controller for N vehicles.
 
-    r3 = tot_thrust/4 + (e2*Izz)/(4*b) + (e1*Iyy)/(2*k*L)
+    Vectorized version of go_to_position: each loop runs for all vehicles in
+    one call, with per-vehicle gains and the position / velocity error
+    integrals kept in the controller. States are (N, 12) arrays laid out as
+    [x, xdot, theta, thetadot] (dynamics.STATE_SLICES).
 
-    return np.array([r0, r1, r2, r3])
+    Parameters
+    ----------
+    param_dict : dict
+        vehicle parameters (see dynamics.param_dict), the allocation constants
+        of angerr2u are precomputed from it
+    n_vehicles : int
+    **gains : array_like
+        overrides of DEFAULT_GAINS, broadcast to (n_vehicles, 3)
+
+    Attributes
+    ----------
+    gains : dict of (n_vehicles, 3) np.ndarray
+        per-vehicle gains, can be changed in place
+    integral_p_err, integral_v_err : (n_vehicles, 3) np.ndarray
+        accumulated position / velocity errors
+    """
+    def __init__(self, param_dict, n_vehicles=1, **gains):
+        unknown = set(gains) - set(DEFAULT_GAINS)
+        if unknown:
+            raise ValueError("unknown gains: " + ", ".join(sorted(unknown)))
+        self.param_dict = param_dict
+        self.n_vehicles = n_vehicles
+        self.gains = {name: np.array(np.broadcast_to(gains.get(name, default), (n_vehicles, 3)), dtype=np.double)
+                      for name, default in DEFAULT_GAINS.items()}
+        self.alloc = allocation_matrix(param_dict)  # cached mixer
+        self.integral_p_err = np.zeros((n_vehicles, 3))
+        self.integral_v_err = np.zeros((n_vehicles, 3))
+
+    def checkpoint(self):
+        """Gains and error integrals (see checkpoint.py)."""
+        return {"gains": {name: gain.copy() for name, gain in self.gains.items()},
+                "integral_p_err": self.integral_p_err.copy(), "integral_v_err": self.integral_v_err.copy()}
+
+    def restore(self, ckpt):
+        if ckpt["integral_p_err"].shape != self.integral_p_err.shape:
+            raise ValueError("checkpoint of %d vehicles, controller has %d" % (len(ckpt["integral_p_err"]),
+                                                                              self.n_vehicles))
+        self.gains = {name: np.array(gain, dtype=np.double) for name, gain in ckpt["gains"].items()}
+        self.integral_p_err = np.array(ckpt["integral_p_err"], dtype=np.double)
+        self.integral_v_err = np.array(ckpt["integral_v_err"], dtype=np.double)
+
+    def reset(self, idx=None):
+        """Zero the error integrals of vehicles idx (default: all)."""
+        idx = slice(None) if idx is None else idx
+        self.integral_p_err[idx] = 0
+        self.integral_v_err[idx] = 0
+
+    def position_control(self, states, des_pos):
+        """Desired velocities (N, 3) given states (N, 12) and desired positions (N, 3)."""
+        p_err = states[:, 0:3] - des_pos
+        self.integral_p_err += p_err
+        return self.gains["P_pos"] * p_err + self.gains["I_pos"] * self.integral_p_err
+
+    def velocity_control(self, states, des_vel):
+        """Desired thrust fraction (N, ) and attitude (N, 3) given states (N, 12)
+        and desired velocities (N, 3). Roll and pitch are clipped to MAX_TILT."""
+        v_err = states[:, 3:6] - des_vel
+        self.integral_v_err += v_err
+        pid_err = self.gains["P_vel"] * v_err + self.gains["I_vel"] * self.integral_v_err
+
+        yaw = states[:, 8]
+        cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+        des_theta = np.empty_like(pid_err)
+        des_theta[:, 0] = pid_err[:, 0] * sin_yaw - pid_err[:, 1] * cos_yaw
+        des_theta[:, 1] = pid_err[:, 0] * cos_yaw + pid_err[:, 1] * sin_yaw
+        np.clip(des_theta[:, :2], -MAX_TILT, MAX_TILT, out=des_theta[:, :2])
+        des_theta[:, 2] = yaw  # TODO: currently, set yaw as constant
+        return HOVER_TOT_U / MAX_TOT_U + pid_err[:, 2], des_theta
+
+    def attitude_control(self, states, des_theta, des_thrust_pc):
+        """Motor inputs (N, 4) given states (N, 12), desired attitude (N, 3)
+        and thrust fraction (N, ). PD on the angles, then dynamic inversion."""
+        cmd = np.empty((states.shape[0], 4))
+        cmd[:, 0] = des_thrust_pc
+        cmd[:, 0] *= MAX_TOT_U
+        cmd[:, 1:] = self.gains["Kd_att"] * states[:, 9:12] + self.gains["Kp_att"] * (states[:, 6:9] - des_theta)
+        return cmd @ self.alloc
+
+    def go_to_position(self, states, des_pos):
+        """Motor inputs (N, 4) driving vehicles in states (N, 12) to des_pos (N, 3).
+        Also returns desired velocities and attitudes, for logging."""
+        states = np.asarray(states, dtype=np.double).reshape(-1, 12)
+        des_vel = self.position_control(states, des_pos)
+        des_thrust_pc, des_theta = self.velocity_control(states, des_vel)
+        return {"u": self.attitude_control(states, des_theta, des_thrust_pc),
+                "des_vel": des_vel, "des_theta": des_theta}
@@ -26,6 +26,36 @@ maxrpm = 10000
 maxthrust = k*np.sum(np.array([maxrpm**2] * 4))
 param_dict = {"g": g, "m":m, "L":L, "k":k, "b":b, "I":I, "kd":kd, "dt":dt, "maxRPM":maxrpm, "maxthrust":maxthrust}
 
+# Layout of one row of a (N, 12) batched state array
+STATE_DIM = 12
+STATE_SLICES = {"x": slice(0, 3), "xdot": slice(3, 6), "theta": slice(6, 9), "thetadot": slice(9, 12)}
+
+# Integrators for BatchQuadDynamics / QuadDynamics
+# euler: explicit Euler as in QuadDynamics.step_dynamics (theta uses the old thetadot)
+# semi_implicit: velocities first, positions / angles from the new velocities
+# rk4: classic 4th order Runge-Kutta
+# rk45: adaptive Dormand-Prince 5(4), substeps within dt to meet RK45_RTOL / RK45_ATOL
+# quaternion: attitude as a unit quaternion, rotated in closed form by the mean body
+#   rate over the step, no trigonometry for the rotation matrix and no Euler rate
+#   matrix. Vehicles held by a BatchQuadDynamics keep their quaternion between steps,
+#   so attitude stays accurate through +-90 deg pitch; theta / thetadot are derived
+INTEGRATORS = ("euler", "semi_implicit", "rk4", "rk45", "quaternion")
+RK45_RTOL = 1e-6
+RK45_ATOL = 1e-9
+RK45_MAX_SUBSTEPS = 1000
+
+# Dormand-Prince 5(4) tableau
+_DP_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+_DP_A = [[],
+         [1/5],
+         [3/40, 9/40],
+         [44/45, -56/15, 32/9],
+         [19372/6561, -25360/2187, 64448/6561, -212/729],
+         [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+         [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+_DP_B5 = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+_DP_B4 = np.array([5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+
 
 
 def init_state():
@@ -37,17 +67,152 @@ def init_state():
                 }
     return state
 
+class QuadState:
+    """Quadrotor state in one contiguous float64 buffer [x, xdot, theta, thetadot].
+
+    x, xdot, theta and thetadot are (3, ) views into `data`; assigning to
+    them (or to state["x"] etc.) writes into the buffer instead of rebinding,
+    so the integrators can update the state in place without allocating.
+    The dict interface (state["x"], keys(), items(), ...) is kept for code
+    written against the state dictionary of init_state().
+
+    `data` can be a row of a BatchQuadDynamics.states array, see
+    BatchQuadDynamics.state_view. Views share memory: copy() a state (or the
+    arrays taken from it) to keep a snapshot.
+    """
+    __slots__ = ("data", "_x", "_xdot", "_theta", "_thetadot")
+
+    def __init__(self, x=(0, 0, 0), xdot=(0, 0, 0), theta=(0, 0, 0), thetadot=(0, 0, 0), data=None):
+        if data is None:
+            data = np.empty(STATE_DIM)
+            data[STATE_SLICES["x"]] = x
+            data[STATE_SLICES["xdot"]] = xdot
+            data[STATE_SLICES["theta"]] = theta
+            data[STATE_SLICES["thetadot"]] = thetadot
+        elif data.shape != (STATE_DIM,) or data.dtype != np.double:
+            raise ValueError("QuadState data must be a (%d, ) float64 array" % STATE_DIM)
+        self.data = data
+        self._x = data[STATE_SLICES["x"]]
+        self._xdot = data[STATE_SLICES["xdot"]]
+        self._theta = data[STATE_SLICES["theta"]]
+        self._thetadot = data[STATE_SLICES["thetadot"]]
+
+    @classmethod
+    def from_dict(cls, state):
+        """Copy a state dictionary (or QuadState) into a new QuadState."""
+        return cls(state["x"], state["xdot"], state["theta"], state["thetadot"])
+
+    def to_dict(self):
+        """State dictionary with copies of the arrays."""
+        return {key: self[key].copy() for key in STATE_SLICES}
+
+    def copy(self):
+        return QuadState(data=self.data.copy())
+
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x[:] = value
+
+    @property
+    def xdot(self):
+        return self._xdot
+
+    @xdot.setter
+    def xdot(self, value):
+        self._xdot[:] = value
+
+    @property
+    def theta(self):
+        return self._theta
+
+    @theta.setter
+    def theta(self, value):
+        self._theta[:] = value
+
+    @property
+    def thetadot(self):
+        return self._thetadot
+
+    @thetadot.setter
+    def thetadot(self, value):
+        self._thetadot[:] = value
+
+    # dict interface
+    def __getitem__(self, key):
+        if key not in STATE_SLICES:
+            raise KeyError(key)
+        return getattr(self, "_" + key)
+
+    def __setitem__(self, key, value):
+        self[key][:] = value
+
+    def __contains__(self, key):
+        return key in STATE_SLICES
+
+    def __iter__(self):
+        return iter(STATE_SLICES)
+
+    def __len__(self):
+        return len(STATE_SLICES)
+
+    def keys(self):
+        return STATE_SLICES.keys()
+
+    def values(self):
+        return [self[key] for key in STATE_SLICES]
+
+    def items(self):
+        return [(key, self[key]) for key in STATE_SLICES]
+
+    def get(self, key, default=None):
+        return self[key] if key in STATE_SLICES else default
+
+    def __repr__(self):
+        return "QuadState(x=%s, xdot=%s, theta=%s, thetadot=%s)" % (self._x, self._xdot, self._theta, self._thetadot)
+
+
 class QuadDynamics:
-    def __init__(self):
+    def __init__(self, integrator="euler"):
         self.param_dict = param_dict
-        
+        self.I_inv = np.linalg.inv(I)  # constant, invert once
+        # integrators other than explicit Euler run on a one-vehicle batch engine
+        if integrator not in INTEGRATORS:
+            raise ValueError("integrator must be one of " + ", ".join(INTEGRATORS))
+        self.integrator = integrator
+        self._batch = None if integrator == "euler" else BatchQuadDynamics(integrator=integrator)
+        # quaternion integrator: (1, 4) quaternion and (1, 3) body rate of the last
+        # stepped vehicle and the theta / thetadot it was reported as, re-read when they differ
+        self._quat = None
+        self._omega = None
+        self._attitude = None
+
+    def checkpoint(self):
+        """Integrator state carried between steps (see checkpoint.py)."""
+        return {"integrator": self.integrator, "quat": self._quat, "omega": self._omega,
+                "attitude": None if self._attitude is None else [float(v) for v in self._attitude],
+                "batch": None if self._batch is None else self._batch.checkpoint()}
+
+    def restore(self, ckpt):
+        if ckpt["integrator"] != self.integrator:
+            raise ValueError("checkpoint of a %s integrator, this one is %s" % (ckpt["integrator"], self.integrator))
+        self._quat = None if ckpt["quat"] is None else np.array(ckpt["quat"], dtype=np.double).reshape(1, 4)
+        self._omega = None if ckpt["omega"] is None else np.array(ckpt["omega"], dtype=np.double).reshape(1, 3)
+        self._attitude = None if ckpt["attitude"] is None else tuple(ckpt["attitude"])
+        if self._batch is not None:
+            self._batch.restore(ckpt["batch"])
+
     def step_dynamics(self,state, u):
         """Step dynamics given current state and input. Updates state dict.
         
         Parameters
         ----------
-        state : dict 
-            contains current x, xdot, theta, thetadot
+        state : dict or QuadState
+            contains current x, xdot, theta, thetadot. A QuadState is updated
+            in place, a dict gets new arrays
 
         u : (4, ) np.ndarray
             control input - (angular velocity)^squared of motors (rad^2/s^2)
@@ -57,6 +222,11 @@ class QuadDynamics:
         state : dict 
             updates with next x, xdot, theta, thetadot  
         """
+        if self.integrator == "quaternion":
+            return self._step_quaternion(state, u)
+        if self._batch is not None:
+            return self._batch.step_dynamics(state, u)
+
         # Compute angular velocity vector from angular velocities
         omega = self.thetadot2omega(state["thetadot"], state["theta"])
 
@@ -69,6 +239,13 @@ class QuadDynamics:
         # Compute next state
         omega = omega + dt * omegadot
         thetadot = self.omega2thetadot(omega, state["theta"])
+        if isinstance(state, QuadState):
+            # same update, written into the state buffer
+            state.theta += dt * state.thetadot
+            state.thetadot = thetadot
+            state.xdot += dt * a
+            state.x += dt * state.xdot
+            return state
         theta = state["theta"] + dt * state["thetadot"]
         xdot = state["xdot"] + dt * a
         x = state["x"] + dt * xdot
@@ -85,6 +262,22 @@ class QuadDynamics:
 
 
 
+    def _step_quaternion(self, state, u):
+        """Quaternion step of a single vehicle with the BatchQuadDynamics kernel
+        on a (1, 12) array, keeping its quaternion and body rate between steps
+        unless theta / thetadot were changed from outside."""
+        states = state_to_array(state)[np.newaxis, :]
+        if tuple(states[0, STATE_SLICES["theta"].start:]) != self._attitude:
+            self._quat, self._omega = self._batch.attitude_from_states(states)
+        self._quat, self._omega = self._batch._step_quaternion(states, self._quat, self._omega,
+                                                               np.asarray(u, dtype=np.double).reshape(1, 4),
+                                                               self._batch.param_dict["dt"], states)
+        self._attitude = tuple(states[0, STATE_SLICES["theta"].start:])
+        if isinstance(state, QuadState):
+            state.data[:] = states[0]
+            return state
+        return array_to_state(states[0], state)
+
     def compute_thrust(self, u,k):
         """Compute total thrust (in body frame) given control input and thrust coefficient. Used in calc_acc().
         Clips if above maximum rpm (10000).
@@ -105,7 +298,7 @@ class QuadDynamics:
             thrust in body frame
         """
         
-        u = np.clip(u, 0, self.param_dict["maxRPM"]**2)
+        u = saturate_motors(u, self.param_dict)
         T = np.array([0, 0, k*np.sum(u)])
         # print("u", u)
         # print("T", T)
@@ -204,8 +397,8 @@ class QuadDynamics:
         tau = self.calc_torque(u, L, b, k)
 
         # Calculate body frame angular acceleration using Euler's equation
-        omegaddot = np.dot(np.linalg.inv(
-            I), (tau - np.cross(omega, np.dot(I, omega))))
+        I_inv = self.I_inv if I is self.param_dict["I"] else np.linalg.inv(I)
+        omegaddot = np.dot(I_inv, (tau - np.cross(omega, np.dot(I, omega))))
 
         return omegaddot
 
@@ -278,47 +471,432 @@ class QuadDynamics:
 
         return w
 
+
+def state_to_array(state):
+    """Pack state dictionary into a (12, ) np.ndarray [x, xdot, theta, thetadot]."""
+    if isinstance(state, QuadState):
+        return state.data.copy()
+    return np.concatenate([np.asarray(state[key], dtype=np.double) for key in STATE_SLICES])
+
+
+def array_to_state(arr, state=None):
+    """Unpack (12, ) np.ndarray into state dictionary. Updates `state` if given."""
+    if state is None:
+        state = {}
+    for key, sl in STATE_SLICES.items():
+        state[key] = arr[sl].copy()
+    return state
+
+
+class BatchQuadDynamics:
+    """Steps N quadrotors at once. Same equations of motion as QuadDynamics.
+
+    States are held in a contiguous (N, 12) array, one row per vehicle, laid
+    out as [x, xdot, theta, thetadot] (see STATE_SLICES).
+
+    Use by adding vehicles with `idx = dyn.add_robot(state)` and calling
+    `dyn.step(u)` with a (N, 4) array of motor inputs to advance all of them.
+    `step_dynamics(state, u)` keeps the single-vehicle QuadDynamics interface.
+    """
+
+    def __init__(self, n_robots=0, param_dict=param_dict, integrator="euler", rtol=RK45_RTOL, atol=RK45_ATOL):
+        if integrator not in INTEGRATORS:
+            raise ValueError("integrator must be one of " + ", ".join(INTEGRATORS))
+        self.param_dict = param_dict
+        self.I = param_dict["I"]
+        self.I_inv = np.linalg.inv(self.I)  # constant, invert once
+        self.states = np.zeros((n_robots, STATE_DIM))
+        self.integrator = integrator
+        # rk45 error tolerances, last accepted substep and substeps taken in the last step
+        self.rtol = rtol
+        self.atol = atol
+        self.h = None
+        self.n_substeps = 0
+
+        # quaternion integrator: per-step constants, and the attitude of held
+        # vehicles with the theta / thetadot it was last reported as
+        p = param_dict
+        self._thrust_per_u = p["k"] / p["m"]
+        self._torque_gain = np.array([p["L"] * p["k"], p["L"] * p["k"], p["b"]])
+        self.quat = None
+        self.omega = None
+        self._attitude_rows = None
+
+    @property
+    def n_robots(self):
+        return self.states.shape[0]
+
+    def checkpoint(self):
+        """Held states and integrator state carried between steps (see checkpoint.py)."""
+        copy = lambda arr: None if arr is None else arr.copy()
+        return {"integrator": self.integrator, "states": self.states.copy(), "rtol": self.rtol, "atol": self.atol,
+                "h": self.h, "n_substeps": self.n_substeps, "quat": copy(self.quat), "omega": copy(self.omega),
+                "attitude_rows": copy(self._attitude_rows)}
+
+    def restore(self, ckpt):
+        if ckpt["integrator"] != self.integrator:
+            raise ValueError("checkpoint of a %s integrator, this one is %s" % (ckpt["integrator"], self.integrator))
+        copy = lambda arr: None if arr is None else np.array(arr, dtype=np.double)
+        self.states = copy(ckpt["states"])
+        self.rtol, self.atol = ckpt["rtol"], ckpt["atol"]
+        self.h = ckpt["h"]
+        self.n_substeps = ckpt["n_substeps"]
+        self.quat, self.omega = copy(ckpt["quat"]), copy(ckpt["omega"])
+        self._attitude_rows = copy(ckpt["attitude_rows"])
+
+    def add_robot(self, state):
+        """Append vehicle given state dict or (12, ) array. Returns its row index."""
+        if isinstance(state, (dict, QuadState)):
+            state = state_to_array(state)
+        self.states = np.vstack((self.states, np.asarray(state, dtype=np.double).reshape(1, STATE_DIM)))
+        return self.n_robots - 1
+
+    def state_view(self, idx):
+        """QuadState viewing row idx of self.states. Stepping updates it in
+        place; the view is detached when add_robot reallocates the array."""
+        return QuadState(data=self.states[idx])
+
+    def step(self, u):
+        """Advance all held vehicles by one time step, in place.
+
+        Parameters
+        ----------
+        u : (N, 4) np.ndarray
+            control input - (angular velocity)^squared of motors (rad^2/s^2)
+
+        Returns
+        -------
+        states : (N, 12) np.ndarray
+            next states
+        """
+        if self.integrator == "quaternion":
+            self._step_held_quaternion(np.asarray(u, dtype=np.double))
+        else:
+            self.states[:] = self.step_states(self.states, u)
+        return self.states
+
+    def step_dynamics(self, state, u):
+        """Step a single vehicle given state dict or QuadState, as QuadDynamics.step_dynamics."""
+        next_state = self.step_states(state_to_array(state)[np.newaxis, :], np.atleast_2d(u))
+        if isinstance(state, QuadState):
+            state.data[:] = next_state[0]
+            return state
+        return array_to_state(next_state[0], state)
+
+    def step_states(self, states, u):
+        """Compute next states (N, 12) given states (N, 12) and input (N, 4),
+        held constant over the step, with the selected integrator."""
+        states = np.asarray(states, dtype=np.double)
+        u = np.asarray(u, dtype=np.double)
+        dt = self.param_dict["dt"]
+        if self.integrator == "euler":
+            return self._step_euler(states, u, dt)
+        if self.integrator == "quaternion":
+            quat, omega = self.attitude_from_states(states)
+            next_states = np.empty_like(states)
+            self._step_quaternion(states, quat, omega, u, dt, next_states)
+            return next_states
+        y = self.to_body_rates(states)
+        if self.integrator == "semi_implicit":
+            y = self._step_semi_implicit(y, u, dt)
+        elif self.integrator == "rk4":
+            y = self._step_rk4(y, u, dt)
+        else:
+            y = self._step_rk45(y, u, dt)
+        return self.from_body_rates(y)
+
+    def attitude_from_states(self, states):
+        """Unit quaternions (N, 4) and body angular velocities (N, 3) of states (N, 12)."""
+        theta = states[:, STATE_SLICES["theta"]]
+        return euler_to_quat(theta), self.thetadot2omega(states[:, STATE_SLICES["thetadot"]], theta)
+
+    def _step_held_quaternion(self, u):
+        """Quaternion step of self.states, keeping each vehicle's quaternion and
+        body rate. Rows whose theta / thetadot were changed from outside (or
+        were added) are re-read from the Euler angles."""
+        att = self.states[:, STATE_SLICES["theta"].start:]
+        if self._attitude_rows is None or self._attitude_rows.shape != att.shape:
+            self.quat, self.omega = self.attitude_from_states(self.states)
+        else:
+            changed = np.flatnonzero(np.any(att != self._attitude_rows, axis=1))
+            if changed.size:
+                self.quat[changed], self.omega[changed] = self.attitude_from_states(self.states[changed])
+        self.quat, self.omega = self._step_quaternion(self.states, self.quat, self.omega, u,
+                                                      self.param_dict["dt"], self.states)
+        self._attitude_rows = att.copy()
+
+    def _step_quaternion(self, states, quat, omega, u, dt, out):
+        """Quaternion integrator, writes next states into out (may be states).
+        Returns next quaternions and body angular velocities."""
+        p = self.param_dict
+        xdot = states[:, STATE_SLICES["xdot"]]
+        w, qx, qy, qz = quat.T
+        thrust = self._thrust_per_u * saturate_motors(u, self.param_dict).sum(axis=1)
+        # thrust along the body z axis (last column of the rotation matrix), drag, gravity
+        a = -p["kd"] * xdot
+        a[:, 0] += 2 * (qx * qz + w * qy) * thrust
+        a[:, 1] += 2 * (qy * qz - w * qx) * thrust
+        a[:, 2] += (1 - 2 * (qx * qx + qy * qy)) * thrust + p["g"]
+
+        tau = np.empty_like(omega)
+        tau[:, 0] = u[:, 0] - u[:, 2]
+        tau[:, 1] = u[:, 1] - u[:, 3]
+        tau[:, 2] = u[:, 0] - u[:, 1] + u[:, 2] - u[:, 3]
+        tau *= self._torque_gain
+        # tau - omega x (I omega), cross product written out (np.cross is slow on small rows)
+        Iw = omega @ self.I.T
+        tau[:, 0] -= omega[:, 1] * Iw[:, 2] - omega[:, 2] * Iw[:, 1]
+        tau[:, 1] -= omega[:, 2] * Iw[:, 0] - omega[:, 0] * Iw[:, 2]
+        tau[:, 2] -= omega[:, 0] * Iw[:, 1] - omega[:, 1] * Iw[:, 0]
+        omegadot = tau @ self.I_inv.T
+        next_omega = omega + dt * omegadot
+
+        # rotate by the mean body rate: q <- q * [cos(|v|), v sin(|v|) / |v|], v = dt / 2 * omega_mid
+        v = (0.5 * dt) * (omega + (0.5 * dt) * omegadot)
+        angle = np.sqrt(np.einsum("ij,ij->i", v, v))
+        c = np.cos(angle)
+        sinc = np.divide(np.sin(angle), angle, out=np.ones_like(angle), where=angle > 0)
+        v *= sinc[:, np.newaxis]
+        qv = quat[:, 1:]
+        next_quat = np.empty_like(quat)
+        next_quat[:, 0] = w * c - np.einsum("ij,ij->i", qv, v)
+        next_quat[:, 1:] = c[:, np.newaxis] * qv + w[:, np.newaxis] * v
+        next_quat[:, 1] += qy * v[:, 2] - qz * v[:, 1]
+        next_quat[:, 2] += qz * v[:, 0] - qx * v[:, 2]
+        next_quat[:, 3] += qx * v[:, 1] - qy * v[:, 0]
+        next_quat /= np.sqrt(np.einsum("ij,ij->i", next_quat, next_quat))[:, np.newaxis]
+
+        next_xdot = xdot + dt * a
+        out[:, STATE_SLICES["x"]] = states[:, STATE_SLICES["x"]] + dt * next_xdot
+        out[:, STATE_SLICES["xdot"]] = next_xdot
+
+        # report Euler angles and rates, trig of roll / pitch taken from the rotation matrix
+        w, qx, qy, qz = next_quat.T
+        r20 = 2 * (qx * qz - w * qy)  # -sin(pitch)
+        r21 = 2 * (qy * qz + w * qx)  # cos(pitch) sin(roll)
+        r22 = 1 - 2 * (qx * qx + qy * qy)  # cos(pitch) cos(roll)
+        theta = out[:, STATE_SLICES["theta"]]
+        theta[:, 0] = np.arctan2(r21, r22)
+        theta[:, 1] = np.arcsin(np.clip(-r20, -1, 1))
+        theta[:, 2] = np.arctan2(2 * (w * qz + qx * qy), 1 - 2 * (qy * qy + qz * qz))
+        # Euler rates, as omega2thetadot: w1_rot = (sin(roll) w1 + cos(roll) w2) cos(pitch)
+        w1_rot_cthe = r21 * next_omega[:, 1] + r22 * next_omega[:, 2]
+        cthe_sq = r21 * r21 + r22 * r22
+        thetadot = out[:, STATE_SLICES["thetadot"]]
+        thetadot[:, 0] = next_omega[:, 0] - r20 * w1_rot_cthe / cthe_sq
+        thetadot[:, 1] = (r22 * next_omega[:, 1] - r21 * next_omega[:, 2]) / np.sqrt(cthe_sq)
+        thetadot[:, 2] = w1_rot_cthe / cthe_sq
+        return next_quat, next_omega
+
+    def to_body_rates(self, states):
+        """Replace thetadot by the body angular velocity omega, the variables
+        the higher order integrators work in: [x, xdot, theta, omega]."""
+        y = states.copy()
+        y[:, 9:12] = self.thetadot2omega(states[:, 9:12], states[:, 6:9])
+        return y
+
+    def from_body_rates(self, y):
+        """Inverse of to_body_rates."""
+        states = y.copy()
+        states[:, 9:12] = self.omega2thetadot(y[:, 9:12], y[:, 6:9])
+        return states
+
+    def derivatives(self, y, u):
+        """Time derivative of [x, xdot, theta, omega] (N, 12) given input (N, 4)."""
+        dy = np.empty_like(y)
+        dy[:, 0:3] = y[:, 3:6]
+        dy[:, 3:6] = self.calc_acc(u, y[:, 6:9], y[:, 3:6])
+        dy[:, 6:9] = self.omega2thetadot(y[:, 9:12], y[:, 6:9])
+        dy[:, 9:12] = self.calc_ang_acc(u, y[:, 9:12])
+        return dy
+
+    def _step_semi_implicit(self, y, u, dt):
+        y = y.copy()
+        y[:, 3:6] += dt * self.calc_acc(u, y[:, 6:9], y[:, 3:6])
+        y[:, 9:12] += dt * self.calc_ang_acc(u, y[:, 9:12])
+        y[:, 0:3] += dt * y[:, 3:6]
+        y[:, 6:9] += dt * self.omega2thetadot(y[:, 9:12], y[:, 6:9])
+        return y
+
+    def _step_rk4(self, y, u, dt):
+        k1 = self.derivatives(y, u)
+        k2 = self.derivatives(y + dt / 2 * k1, u)
+        k3 = self.derivatives(y + dt / 2 * k2, u)
+        k4 = self.derivatives(y + dt * k3, u)
+        return y + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+    def _step_rk45(self, y, u, dt):
+        """Adaptive Dormand-Prince over [0, dt]. One substep size is shared by
+        all vehicles, set by the worst scaled error; it carries over between
+        calls in self.h."""
+        t = 0.0
+        h = dt if self.h is None else min(self.h, dt)
+        self.n_substeps = 0
+        k = [None] * 7
+        k[0] = self.derivatives(y, u)
+        while dt - t > 1e-12 * dt:
+            if self.n_substeps >= RK45_MAX_SUBSTEPS:
+                raise RuntimeError("rk45 exceeded %d substeps" % RK45_MAX_SUBSTEPS)
+            h_step = min(h, dt - t)
+            for i in range(1, 7):
+                k[i] = self.derivatives(y + h_step * sum(a * k[j] for j, a in enumerate(_DP_A[i]) if a), u)
+            y_new = y + h_step * sum(b * k[i] for i, b in enumerate(_DP_B5) if b)
+            err = h_step * sum(e * k[i] for i, e in enumerate(_DP_B5 - _DP_B4) if e)
+            scale = self.atol + self.rtol * np.maximum(np.abs(y), np.abs(y_new))
+            err_norm = np.max(np.sqrt(np.mean(np.square(err / scale), axis=1)), initial=0.0)
+            factor = 5.0 if err_norm == 0 else min(5.0, max(0.2, 0.9 * err_norm ** -0.2))
+            self.n_substeps += 1
+            if err_norm <= 1:
+                t += h_step
+                y = y_new
+                k[0] = k[6]  # first same as last
+                if h_step == h:  # a step cut short to end at dt says nothing about h
+                    h = h_step * factor
+            else:
+                h = h_step * factor
+        self.h = h
+        return y
+
+    def _step_euler(self, states, u, dt):
+        x = states[:, STATE_SLICES["x"]]
+        xdot = states[:, STATE_SLICES["xdot"]]
+        theta = states[:, STATE_SLICES["theta"]]
+        thetadot = states[:, STATE_SLICES["thetadot"]]
+
+        omega = self.thetadot2omega(thetadot, theta)
+        a = self.calc_acc(u, theta, xdot)
+        omegadot = self.calc_ang_acc(u, omega)
+
+        # Same update order as QuadDynamics.step_dynamics
+        next_states = np.empty_like(states)
+        next_states[:, STATE_SLICES["thetadot"]] = self.omega2thetadot(omega + dt * omegadot, theta)
+        next_states[:, STATE_SLICES["theta"]] = theta + dt * thetadot
+        next_xdot = xdot + dt * a
+        next_states[:, STATE_SLICES["xdot"]] = next_xdot
+        next_states[:, STATE_SLICES["x"]] = x + dt * next_xdot
+        return next_states
+
+    def calc_acc(self, u, theta, xdot):
+        """Linear acceleration (N, 3) in inertial frame. See QuadDynamics.calc_acc."""
+        p = self.param_dict
+        thrust = p["k"] * np.sum(saturate_motors(u, p), axis=1)
+        # Thrust only has a body z component, so R * T is the last column of R scaled
+        R = get_rot_matrix_batch(theta)
+        a = R[:, :, 2] * (thrust / p["m"])[:, np.newaxis] - p["kd"] * xdot
+        a[:, 2] += p["g"]
+        return a
+
+    def calc_torque(self, u):
+        """Torque (N, 3) in body frame. See QuadDynamics.calc_torque."""
+        p = self.param_dict
+        return np.stack((p["L"] * p["k"] * (u[:, 0] - u[:, 2]),
+                         p["L"] * p["k"] * (u[:, 1] - u[:, 3]),
+                         p["b"] * (u[:, 0] - u[:, 1] + u[:, 2] - u[:, 3])), axis=1)
+
+    def calc_ang_acc(self, u, omega):
+        """Angular acceleration (N, 3) in body frame. See QuadDynamics.calc_ang_acc."""
+        tau = self.calc_torque(u)
+        return (tau - np.cross(omega, omega @ self.I.T)) @ self.I_inv.T
+
+    def omega2thetadot(self, omega, theta):
+        """Euler angle rates (N, 3) from angular velocity, using the closed-form
+        inverse of the Euler rate matrix in QuadDynamics.omega2thetadot."""
+        sphi, cphi = np.sin(theta[:, 0]), np.cos(theta[:, 0])
+        cthe, tthe = np.cos(theta[:, 1]), np.tan(theta[:, 1])
+        w1_rot = sphi * omega[:, 1] + cphi * omega[:, 2]
+        return np.stack((omega[:, 0] + tthe * w1_rot,
+                         cphi * omega[:, 1] - sphi * omega[:, 2],
+                         w1_rot / cthe), axis=1)
+
+    def thetadot2omega(self, thetadot, theta):
+        """Angular velocity (N, 3) in body frame. See QuadDynamics.thetadot2omega."""
+        sphi, cphi = np.sin(theta[:, 0]), np.cos(theta[:, 0])
+        sthe, cthe = np.sin(theta[:, 1]), np.cos(theta[:, 1])
+        return np.stack((thetadot[:, 0] - sthe * thetadot[:, 2],
+                         cphi * thetadot[:, 1] + cthe * sphi * thetadot[:, 2],
+                         -sphi * thetadot[:, 1] + cthe * cphi * thetadot[:, 2]), axis=1)
+
+
 def basic_input():
     """Return arbritrary input to test simulator"""
     return np.power(np.array([950, 700, 700, 700]),2)
 
 
+# One QuadHistory record per step (angles in degrees)
+QUAD_HIST_DTYPE = np.dtype([("pos", np.double, 3), ("theta", np.double, 3), ("thetadot", np.double, 3),
+                            ("des_theta", np.double, 3), ("xdotdot", np.double, 3),
+                            ("des_xdot", np.double, 3), ("des_x", np.double, 3)])
+
+
 class QuadHistory():
-    """Keeps track of quadrotor history for plotting."""
-
-    def __init__(self):
-        self.hist_theta = []
-        self.hist_des_theta = []
-        self.hist_thetadot = []
-        self.hist_xdot = [[0,0,0]]
-        self.hist_xdotdot = []
-        self.hist_x = []
-        self.hist_y = []
-        self.hist_z = []
-        self.hist_pos = []
-        self.hist_des_xdot = []
-        self.hist_des_x = []
+    """Keeps track of quadrotor history for plotting.
+
+    Records are kept in a preallocated structured array (see ArrayHistory),
+    hist_* attributes are views into it. Set maxlen to only keep the last
+    maxlen steps.
+    """
+
+    def __init__(self, maxlen=None):
+        self.records = ArrayHistory(dtype=QUAD_HIST_DTYPE, maxlen=maxlen)
+        # Velocity history starts with an initial zero velocity
+        self.xdot = ArrayHistory((3,), maxlen=None if maxlen is None else maxlen + 1)
+        self.xdot.append(np.zeros(3))
 
     def update_history(self, state, des_theta_deg_i, des_xdot_i, des_x_i, dt):
         """Appends current state and desired theta for plotting."""
         x = state["x"]
         xdot = state["xdot"]
-        xdotdot = (xdot - np.array(self.hist_xdot[-1])) / dt
-        self.hist_x.append(x[0])
-        self.hist_y.append(x[1])
-        self.hist_z.append(x[2])
-        self.hist_theta.append(np.degrees(state["theta"]))
-        self.hist_thetadot.append(np.degrees(state["thetadot"]))
-        self.hist_des_theta.append(des_theta_deg_i)
-        self.hist_xdot.append(state["xdot"])
-        self.hist_des_xdot.append(des_xdot_i)
-        self.hist_des_x.append(des_x_i)
-        self.hist_pos.append(x)
-        
-        self.hist_xdotdot.append(xdotdot)
+        xdotdot = (xdot - self.xdot[-1]) / dt
+        self.records.append((x, np.degrees(state["theta"]), np.degrees(state["thetadot"]),
+                             des_theta_deg_i, xdotdot, des_xdot_i, des_x_i))
+        self.xdot.append(xdot)
+
+    @property
+    def hist_pos(self):
+        return self.records.data["pos"]
+
+    @property
+    def hist_x(self):
+        return self.hist_pos[:, 0]
+
+    @property
+    def hist_y(self):
+        return self.hist_pos[:, 1]
+
+    @property
+    def hist_z(self):
+        return self.hist_pos[:, 2]
+
+    @property
+    def hist_theta(self):
+        return self.records.data["theta"]
+
+    @property
+    def hist_thetadot(self):
+        return self.records.data["thetadot"]
+
+    @property
+    def hist_des_theta(self):
+        return self.records.data["des_theta"]
+
+    @property
+    def hist_xdot(self):
+        return self.xdot.data
+
+    @property
+    def hist_xdotdot(self):
+        return self.records.data["xdotdot"]
+
+    @property
+    def hist_des_xdot(self):
+        return self.records.data["des_xdot"]
+
+    @property
+    def hist_des_x(self):
+        return self.records.data["des_x"]
 
 
-def main():
+def main(headless=False, render_every=1):
     print("start")
     t_start = time.time()
 
@@ -332,20 +910,8 @@ def main():
     # Initialize quadrotor history tracker
     quad_hist = QuadHistory()
 
-    # Initialize visualization
-    fig = plt.figure()
-    ax = fig.add_subplot(2, 3, 1, projection='3d')
-    ax_x_error = fig.add_subplot(2, 3, 2)
-    ax_xd_error = fig.add_subplot(2,3,3)
-    ax_xdd_error = fig.add_subplot(2, 3, 4)
-    ax_th_error = fig.add_subplot(2, 3, 5)
-    ax_thr_error = fig.add_subplot(2, 3, 6)
-    
-
-
-    # Initialize controller errors
-    integral_p_err = None
-    integral_v_err = None
+    # Initialize controller (keeps its error integrals)
+    controller = CascadedController(param_dict)
 
     # Initialize quad dynamics
     quad_dyn = QuadDynamics()
@@ -355,17 +921,29 @@ def main():
 
         if t * dt > 20:
             des_pos = np.array([0,0,10])
-        ax.cla()
-        des_vel, integral_p_err = pi_position_control(state,des_pos, integral_p_err)
-        des_thrust, des_theta, integral_v_err = pi_velocity_control(state, des_vel, integral_v_err) # attitude control
-        des_theta_deg = np.degrees(des_theta) # for logging
-        u = pi_attitude_control(
-            state, des_theta, des_thrust, param_dict)  # attitude control
+        ctrl = controller.go_to_position(state_to_array(state), des_pos)
+        des_vel = ctrl["des_vel"][0]
+        des_theta_deg = np.degrees(ctrl["des_theta"][0]) # for logging
+        u = ctrl["u"][0]
         # Step dynamcis and update state dict
         state = quad_dyn.step_dynamics(state, u)
         quad_hist.update_history(state, des_theta_deg, des_vel, des_pos, dt)  # update history for plotting
 
-    for t in range(100):
+    print("Time Elapsed (simulation):", time.time() - t_start)
+    if headless:
+        return quad_hist
+
+    # Initialize visualization
+    fig = plt.figure()
+    ax = fig.add_subplot(2, 3, 1, projection='3d')
+    ax_x_error = fig.add_subplot(2, 3, 2)
+    ax_xd_error = fig.add_subplot(2,3,3)
+    ax_xdd_error = fig.add_subplot(2, 3, 4)
+    ax_th_error = fig.add_subplot(2, 3, 5)
+    ax_thr_error = fig.add_subplot(2, 3, 6)
+
+    # Replay recorded history
+    for t in range(0, 100, render_every):
         # # Visualize quadrotor and angle error
         ax.cla()
         visualize_quad_quadhist(ax, quad_hist, t)
@@ -373,5 +951,8 @@ def main():
 
 
     print("Time Elapsed:", time.time() - t_start)
+    return quad_hist
+
 if __name__ == '__main__':
-    main()
+    import sys
+    main(headless="--headless" in sys.argv)
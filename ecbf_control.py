@@ -1,4 +1,4 @@
-from dynamics import QuadDynamics
+from dynamics import QuadDynamics, BatchQuadDynamics, QuadState, STATE_SLICES, param_dict, state_to_array
 from controller import *
 import numpy as np
 import matplotlib.pyplot as plt
@@ -7,6 +7,12 @@ from cvxopt import solvers
 from matplotlib.patches import Ellipse
 import time
 import warnings
+from qp_solver import solve_qp_2d, solve_qp_2d_batch, QP_INFEASIBLE, QP_PATHS, QP_TOL
+from spatial_index import SpatialGrid
+from sim_utils import ArrayHistory
+from barrier import Superellipse
+from checkpoint import rng_state, set_rng_state, rng_from_state
+import profiling
 
 # warnings.filterwarnings("ignore")
 
@@ -14,115 +20,225 @@ a = 1
 b = 1
 safety_dist = 1
 robot_radius = 0.5
+barrier = Superellipse(a, b)  # r_x^4 / a^4 + r_y^4 / b^4 - safety_dist
 is_crash = False # Sets title as Crashed when crashed once
 
+# Constraint pruning in ECBF_control.compute_safe_control: constraints satisfied by the
+# nominal control whose h stays positive over PRUNE_HORIZON (s) at the current closing
+# speed are dropped, and the QP is first solved with at most MAX_QP_CONSTRAINTS of the
+# rest (least margin first). solve_pruned then adds back the dropped constraints the
+# reduced optimum violates and solves again, until the optimum is feasible for the full
+# set, so the result is that of the unpruned QP. MAX_QP_CONSTRAINTS is the starting
+# size of the reduced QP, not a bound on its size or on the solve time.
+PRUNE_HORIZON = 1.0
+MAX_QP_CONSTRAINTS = 16
+
+# Grid of the safety field plots (compute_plot_z, SafetyField)
+PLOT_RANGE = (-7.5, 7.5)
+PLOT_RES = 0.4
+
 class ECBF_control():
-    def __init__(self, state, goal=np.array([[0], [10]])):
+    def __init__(self, state, goal=np.array([[0], [10]]), Kp=6, Kd=8, safety_dist=safety_dist):
         self.state = state
-        self.shape_dict = {} #TODO: a, b
-        Kp = 6
-        Kd = 8
+        self.barrier = barrier
         self.K = np.array([Kp, Kd])
+        self.safety_dist = safety_dist
         self.goal=goal
         self.use_safe = True
+        self.qp_status = None  # status of last safe control QP
+        self.qp_active = []  # active constraints of last safe control QP, warm starts the next
+        self.qp_stats = dict.fromkeys(QP_PATHS, 0)  # number of solves that took each path
+        # constraint pruning, None disables either stage
+        self.prune_horizon = PRUNE_HORIZON
+        self.max_constraints = MAX_QP_CONSTRAINTS
+        self.n_pruned = 0  # constraints left out of the last safe control QP
+        self.h = np.zeros((0, 1))  # barrier values of last safe control QP
+        self._buffers = None  # constraint arrays, reused while the obstacle count is unchanged
+        self.u_nom = np.zeros((2, 1))  # nominal control of last compute_safe_control
+
+    def checkpoint(self):
+        """Gains, goal and the internals carried between calls (see checkpoint.py).
+        The state is shared with the robot and not included."""
+        return {"K": np.array(self.K), "safety_dist": self.safety_dist, "goal": np.array(self.goal),
+                "use_safe": self.use_safe, "qp_status": self.qp_status, "qp_active": list(self.qp_active),
+                "qp_stats": dict(self.qp_stats), "prune_horizon": self.prune_horizon,
+                "max_constraints": self.max_constraints, "n_pruned": self.n_pruned,
+                "h": np.array(self.h), "u_nom": np.array(self.u_nom)}
+
+    def restore(self, ckpt):
+        self.K = np.array(ckpt["K"])
+        self.safety_dist = ckpt["safety_dist"]
+        self.goal = np.array(ckpt["goal"])
+        self.use_safe = ckpt["use_safe"]
+        self.qp_status = ckpt["qp_status"]
+        self.qp_active = list(ckpt["qp_active"])
+        self.qp_stats = dict(ckpt["qp_stats"])
+        self.prune_horizon = ckpt["prune_horizon"]
+        self.max_constraints = ckpt["max_constraints"]
+        self.n_pruned = ckpt["n_pruned"]
+        self.h = np.array(ckpt["h"])
+        self.u_nom = np.array(ckpt["u_nom"])
 
     def compute_plot_z(self, obs):
-        plot_x = np.arange(-7.5, 7.5, 0.4)
-        plot_y = np.arange(-7.5, 7.5, 0.4)
-        xx, yy = np.meshgrid(plot_x, plot_y, sparse=True)
-        z = np.zeros(xx.shape)
-        for i in range(obs.shape[1]):
-            ztemp = h_func(xx - obs[0][i], yy - obs[1][i], a, b, safety_dist) > 0
-            z = z + ztemp
-        z = z / (obs.shape[1]-1)
-        p = {"x":plot_x, "y":plot_y, "z":z}
-        return p
+        return compute_plot_z(obs)
         
         
     def plot_h(self, plot_x, plot_y, z):
-        h = plt.contourf(plot_x, plot_y, z, [-1, 0, 1],colors=['#808080', '#A0A0A0', '#C0C0C0'])
-        plt.xlabel("X")
-        plt.ylabel("Y")
-        plt.pause(0.00000001)
+        plot_h(plot_x, plot_y, z)
+
 
 
+    def compute_rel_state(self, obs, obs_v=None):
+        """Relative position and velocity of robot w.r.t. each obstacle, (2, n_obs) each."""
+        rel_r = np.atleast_2d(self.state["x"][:2]).T - obs
+        if obs_v is None:
+            return rel_r, None
+        rd = np.atleast_2d(self.state["xdot"][:2]).T - obs_v
+        return rel_r, rd
+
+    def compute_constraints(self, obs, obs_v):
+        """Compute h, hd and the ECBF inequality A u <= b for all obstacles in one pass.
+
+        Parameters
+        ----------
+        obs : (2, n_obs) np.ndarray
+            obstacle positions
+        obs_v : (2, n_obs) np.ndarray
+            obstacle velocities
+
+        Returns
+        -------
+        h, hd : (n_obs, 1) np.ndarray
+            barrier value and its time derivative
+        A : (n_obs, 2) np.ndarray
+        b : (n_obs, 1) np.ndarray
+
+        The arrays are views of buffers kept by the controller and are
+        overwritten by the next call with the same number of obstacles.
+        """
+        n_obs = obs.shape[1]
+        buf = self._buffers
+        if buf is None or buf["h"].shape[0] != n_obs:
+            buf = self._buffers = self.barrier.constraint_buffers((n_obs,))
+            buf["rel_r"], buf["rd"] = np.empty((n_obs, 2)), np.empty((n_obs, 2))
+        rel_r, rd = buf["rel_r"], buf["rd"]
+        np.subtract(self.state["x"][:2, np.newaxis], obs, out=rel_r.T)
+        np.subtract(self.state["xdot"][:2, np.newaxis], obs_v, out=rd.T)
+        c = self.barrier.constraints(rel_r, rd, self.K, self.safety_dist, out=buf)
+        return c["h"].reshape(-1, 1), c["hd"].reshape(-1, 1), c["A"], c["b"].reshape(-1, 1)
 
     def compute_h(self, obs=np.array([[0], [0]]).T):
-        h = np.zeros((obs.shape[1], 1))
-        for i in range(obs.shape[1]):
-            rel_r = np.atleast_2d(self.state["x"][:2]).T - obs[:, i].reshape(2,1)
-            # TODO: a, safety_dist, obs, b
-            hr = h_func(rel_r[0], rel_r[1], a, b, safety_dist)
-            h[i] = hr
-        return h
+        rel_r, _ = self.compute_rel_state(obs)
+        h = self.barrier.h_xy(rel_r[0], rel_r[1], self.safety_dist)
+        return h.reshape(-1, 1).astype(np.double)
 
     def compute_hd(self, obs, obs_v):
-        hd = np.zeros((obs.shape[1], 1))
-        for i in range(obs.shape[1]):
-            rel_r = np.atleast_2d(self.state["x"][:2]).T - obs[:, i].reshape(2,1)
-            rd = np.atleast_2d(self.state["xdot"][:2]).T - obs_v[:, i].reshape(2,1)
-            term1 = (4 * np.power(rel_r[0],3) * rd[0])/(np.power(a,4))
-            term2 = (4 * np.power(rel_r[1],3) * rd[1])/(np.power(b,4))
-            hd[i] = term1 + term2
-        return hd
+        rel_r, rd = self.compute_rel_state(obs, obs_v)
+        return self.barrier.hd(rel_r.T, rd.T).reshape(-1, 1).astype(np.double)
 
     def compute_A(self, obs):
-        A = np.empty((0,2))
-        for i in range(obs.shape[1]):
-            rel_r = np.atleast_2d(self.state["x"][:2]).T - obs[:, i].reshape(2,1)
-            A0 = (4 * np.power(rel_r[0], 3))/(np.power(a, 4))
-            A1 = (4 * np.power(rel_r[1], 3))/(np.power(b, 4))
-            Atemp = np.array([np.hstack((A0, A1))])
-            
-            A = np.array(np.vstack((A, Atemp)))
-        
+        rel_r, _ = self.compute_rel_state(obs)
+        A = self.barrier.grad(rel_r.T)
+
         A = -1 * matrix(A.astype(np.double), tc='d')
         return A
 
     def compute_h_hd(self, obs, obs_v):
-        h = self.compute_h(obs)
-        hd = self.compute_hd(obs, obs_v)
+        h, hd, _, _ = self.compute_constraints(obs, obs_v)
         return np.vstack((h, hd)).astype(np.double)
 
     def compute_b(self, obs, obs_v):
         """extra + K * [h hd]"""
-        rel_r = np.atleast_2d(self.state["x"][:2]).T - obs
-        rd = np.atleast_2d(self.state["xdot"][:2]).T - obs_v
-
-        extra = -( (12 * np.square(rel_r[0]) * np.square(rd[0]))/np.power(a, 4) + (12 * np.square(rel_r[1]) * np.square(rd[1]))/np.power(b, 4) )
-        extra = extra.reshape(obs.shape[1], 1)
-
-        b_ineq =  extra - ( self.K[0] * self.compute_h(obs) + self.K[1] * self.compute_hd(obs, obs_v) )
-        b_ineq = -1 * matrix(b_ineq.astype(np.double), tc='d')
+        _, _, _, b_ineq = self.compute_constraints(obs, obs_v)
+        b_ineq = matrix(b_ineq, tc='d')
         return b_ineq
 
 
 
     def compute_safe_control(self,obs, obs_v, id):
         # control in R^2
+        self.qp_status = None
         if self.use_safe:
-            try:
-                A = self.compute_A(obs) # For Exercise 1
-                b = self.compute_b(obs, obs_v) # For Exercise 1
-                u_des = self.compute_nom_control() # For Exercise 1
-
-                optimized_u = u_des #! REPLACE!! Exercise 1: Write Minimum Interventional Control
-
-                # Solution to Exercise 1
-
-                # Solution to Exercise 3
-
-            except:
+            with profiling.section("ecbf.assembly"):
+                self.h, hd, A, b = self.compute_constraints(obs, obs_v)
+                u_des = np.array(self.compute_nom_control())
+                self.u_nom = u_des
+                keep = self.prune_constraints(self.h.ravel(), hd.ravel(), A, b.ravel(), u_des.ravel())
+
+            # Minimum interventional control: min ||u - u_des||^2 s.t. A u <= b
+            with profiling.section("ecbf.solve"):
+                sol = self.solve_pruned(A, b.ravel(), u_des.ravel(), keep)
+            profiling.record("qp.pruned", self.n_pruned)
+            self.qp_status = sol["status"]
+            self.qp_stats[sol["path"]] += 1
+            profiling.count("qp.solves")
+            profiling.count("qp.path." + sol["path"])
+            profiling.record("qp.active", len(sol["active"]))
+            if sol["status"] == QP_INFEASIBLE:
+                profiling.count("qp.infeasible")
                 print("Robot "+str(id)+": NO SOLUTION!!!")
-                optimized_u = [[0], [0]]
-            
+                optimized_u = np.zeros((2, 1))
+            else:
+                optimized_u = sol["x"].reshape(2, 1)
 
         else:
             optimized_u = self.compute_nom_control()
+            self.u_nom = np.array(optimized_u)
 
         
         return optimized_u
 
+    def prune_constraints(self, h, hd, A, b, u_des):
+        """Indices (sorted) of the constraints A u <= b worth solving with.
+
+        Constraints violated by the nominal control u_des are kept, as are those
+        whose h would reach 0 within prune_horizon at the current closing speed
+        hd. Of these, the max_constraints with the least margin (distance of
+        u_des from the constraint boundary) are kept.
+        """
+        row_norm = np.sqrt(A[:, 0] * A[:, 0] + A[:, 1] * A[:, 1])
+        margin = (b - A @ u_des) / np.where(row_norm > 0, row_norm, 1)
+        if self.prune_horizon is None:
+            keep = np.arange(b.size)
+        else:
+            keep = np.flatnonzero((margin <= 0) | (h + self.prune_horizon * np.minimum(hd, 0) <= 0))
+        if self.max_constraints is not None and keep.size > self.max_constraints:
+            keep = np.sort(keep[np.argsort(margin[keep], kind="stable")[:self.max_constraints]])
+        return keep
+
+    def solve_pruned(self, A, b, u_des, keep):
+        """solve_qp_2d on the constraints keep. Pruned constraints violated by the
+        solution are added back and the QP solved again, so the result is the
+        optimum of the full QP (the pruned QP is a relaxation of it). Sets
+        n_pruned and qp_active (indices into all constraints)."""
+        if keep.size == b.size:
+            # nothing pruned, indices into keep are indices into all constraints
+            sol = solve_qp_2d(A, b, u_des, warm_active=self.qp_active)
+            self.n_pruned = 0
+            self.qp_active = sol["active"]
+            return sol
+        pos = np.searchsorted(keep, self.qp_active).astype(int)
+        warm = None
+        if np.all(pos < keep.size) and np.array_equal(keep[pos], self.qp_active):
+            warm = pos.tolist()
+        pruned = np.ones(b.size, dtype=bool)
+        pruned[keep] = False
+        while True:
+            sol = solve_qp_2d(A[keep], b[keep], u_des, warm_active=warm)
+            if sol["status"] == QP_INFEASIBLE or keep.size == b.size:
+                break
+            row_norm = np.sqrt(A[:, 0] * A[:, 0] + A[:, 1] * A[:, 1])
+            violated = np.flatnonzero(pruned & (A @ sol["x"] - b > QP_TOL * row_norm))
+            if violated.size == 0:
+                break
+            profiling.count("qp.readded", violated.size)
+            pruned[violated] = False
+            keep = np.flatnonzero(~pruned)
+            warm = None
+        self.n_pruned = b.size - keep.size
+        self.qp_active = [int(keep[i]) for i in sol["active"]]
+        return sol
+
     def compute_nom_control(self, Kn=np.array([-0.08, -0.2])):
         vd = Kn[0]*(np.atleast_2d(self.state["x"][:2]).T - self.goal)
         u_nom = Kn[1]*(np.atleast_2d(self.state["xdot"][:2]).T - vd)
@@ -135,49 +251,112 @@ class ECBF_control():
 
 
 class Robot_Sim():
-    def __init__(self, x_init, goal_init, robot_id):
+    def __init__(self, x_init, goal_init, robot_id, dyn=None, hist_maxlen=None):
         self.id = robot_id
-        self.state = {"x": x_init,
-                "xdot": np.zeros(3,),
-                "theta": np.radians(np.array([0, 0, 0])),  # ! hardcoded
-                "thetadot": np.radians(np.array([0, 0, 0]))  # ! hardcoded
-                }
-        self.dyn = QuadDynamics()
+        # stepped in place, shared with self.ecbf
+        self.state = QuadState(x=x_init,
+                xdot=np.zeros(3,),
+                theta=np.radians(np.array([0, 0, 0])),  # ! hardcoded
+                thetadot=np.radians(np.array([0, 0, 0]))  # ! hardcoded
+                )
+        # QuadDynamics or BatchQuadDynamics, both provide step_dynamics()
+        self.dyn = QuadDynamics() if dyn is None else dyn
         self.goal = goal_init
         self.ecbf = ECBF_control(self.state, self.goal)
 
 
-        self.state_hist = []
+        # Position history, set hist_maxlen to only keep the last steps
+        self.state_hist = ArrayHistory((3,), maxlen=hist_maxlen)
         self.state_hist.append(self.state["x"])
 
         self.new_obs = np.array([[1], [1]])
+        self.rng = np.random  # noise source for update_obstacles, or a np.random.Generator
+
+    def checkpoint(self):
+        """State, dynamics, ECBF internals and own RNG state (see checkpoint.py).
+        The position history is not included. The global np.random state,
+        used by default, is saved by Simulation.checkpoint."""
+        return {"id": self.id, "state": state_to_array(self.state), "goal": np.array(self.goal),
+                "dyn_type": type(self.dyn).__name__, "dyn": self.dyn.checkpoint(), "ecbf": self.ecbf.checkpoint(),
+                "rng": None if self.rng is np.random else rng_state(self.rng)}
+
+    def restore(self, ckpt):
+        """Restore a checkpoint, in place: the state keeps being shared with
+        self.ecbf. The position history restarts at the restored position."""
+        if ckpt["id"] != self.id:
+            raise ValueError("checkpoint of robot %s, this is robot %s" % (ckpt["id"], self.id))
+        self.state.data[:] = ckpt["state"]
+        self.dyn.restore(ckpt["dyn"])
+        self.ecbf.restore(ckpt["ecbf"])
+        self.goal = self.ecbf.goal
+        if ckpt["rng"] is not None:
+            if self.rng is np.random:
+                self.rng = rng_from_state(ckpt["rng"])
+            else:
+                set_rng_state(self.rng, ckpt["rng"])
+        self.state_hist = ArrayHistory((3,), maxlen=self.state_hist.maxlen)
+        self.state_hist.append(self.state["x"])
+
+    @classmethod
+    def from_checkpoint(cls, ckpt, hist_maxlen=None):
+        """New robot restored from a checkpoint."""
+        dyn_type = {"QuadDynamics": QuadDynamics, "BatchQuadDynamics": BatchQuadDynamics}[ckpt["dyn_type"]]
+        robot = cls(ckpt["state"][STATE_SLICES["x"]], np.array(ckpt["goal"]), ckpt["id"],
+                    dyn=dyn_type(integrator=ckpt["dyn"]["integrator"]), hist_maxlen=hist_maxlen)
+        robot.restore(ckpt)
+        return robot
+
     def robot_step(self, new_obs, obs_v):
         u_hat_acc = self.ecbf.compute_safe_control(obs=new_obs, obs_v=obs_v, id=self.id)
         u_hat_acc = np.ndarray.flatten(np.array(np.vstack((u_hat_acc,np.zeros((1,1))))))  # acceleration
         assert(u_hat_acc.shape == (3,))
-        u_motor = go_to_acceleration(self.state, u_hat_acc, self.dyn.param_dict) # desired motor rate ^2
+        with profiling.section("go_to_acceleration"):
+            u_motor = go_to_acceleration(self.state, u_hat_acc, self.dyn.param_dict) # desired motor rate ^2
 
-        self.state = self.dyn.step_dynamics(self.state, u_motor)
+        with profiling.section("step_dynamics"):
+            self.state = self.dyn.step_dynamics(self.state, u_motor)
         self.ecbf.state = self.state
         self.state_hist.append(self.state["x"])
         return u_hat_acc
 
-    def update_obstacles(self, robots, obs, noisy = False):
+    @profiling.timed("update_obstacles")
+    def update_obstacles(self, robots, obs, noisy = False, index=None, sensing_radius=None):
+        """Collect positions and velocities of other robots and static obstacles.
+
+        noisy adds uniform noise to sensed robot positions, if a float it is
+        the noise amplitude (True: 1).
+
+        If index (see build_obstacle_index) is given, only robots and obstacles
+        closer than sensing_radius (default: index cell size) are returned.
+        """
         obst = []
         obs_v = []
+        radius = np.inf
+        if index is not None:
+            radius = index.cell_size if sensing_radius is None else sensing_radius
+            pos = self.state["x"][:2]
+            near = index.query_radius(pos, max(radius, robot_radius))
+            is_robot = near < len(robots)
+            robots = [robots[j] for j in near[is_robot]]
+            obs = index.points[near[~is_robot]]
+            obs = obs[np.linalg.norm(obs - pos, axis=1) < radius]
         for robot in robots:
             if robot.id == self.id:
                 continue
-            if np.linalg.norm( robot.state["x"][:2] - self.state["x"][:2]) < robot_radius:
+            dist = np.linalg.norm( robot.state["x"][:2] - self.state["x"][:2])
+            if dist < robot_radius:
                 print("CRASH!!!!!!!!!!!!!!!!!!!!")
                 global is_crash 
                 is_crash = True
+            if dist >= radius:
+                continue
             
-            obst_temp = robot.state["x"][:2] 
+            # copy, robot states are updated in place
+            obst_temp = robot.state["x"][:2].copy()
             if noisy:
-                obst_temp = obst_temp + (np.random.random(2)*2-1) # + np.array([[0.5], [0.5]]).T 
+                obst_temp = obst_temp + noisy * (self.rng.random(2)*2-1) # + np.array([[0.5], [0.5]]).T 
             obst.append(obst_temp.reshape(2,1))
-            obs_v.append(robot.state["xdot"][:2].reshape(2,1))
+            obs_v.append(robot.state["xdot"][:2].reshape(2,1).copy())
         if not len(obs):
             return {"obs":obst, "obs_v":obs_v}
         if obs.ndim == 1:
@@ -195,16 +374,362 @@ class Robot_Sim():
 
 
 
-@np.vectorize
+def build_obstacle_index(robots, obs, cell_size):
+    """Spatial index over robot positions followed by static obstacles, for
+    Robot_Sim.update_obstacles. Rebuild once per tick."""
+    points = [robot.state["x"][:2] for robot in robots]
+    if len(obs):
+        points.extend(np.asarray(obs, dtype=np.double).reshape(-1, 2))
+    return SpatialGrid(np.array(points).reshape(-1, 2), cell_size)
+
+
+class Swarm_Sim():
+    """Steps all robots of a swarm together.
+
+    Holds the states of all robots in one BatchQuadDynamics engine, assembles
+    the ECBF constraints of every robot in one pass and solves all the
+    minimum-intervention QPs in one batched call.
+    """
+    def __init__(self, x_inits, goals, K=np.array([6, 8]), sensing_radius=None, safety_dist=safety_dist,
+                 param_dict=param_dict, integrator="euler"):
+        x_inits = np.atleast_2d(np.asarray(x_inits, dtype=np.double))
+        self.n_robots = x_inits.shape[0]
+        # param_dict["dt"] is the control / integration step, see dynamics.INTEGRATORS
+        self.dyn = BatchQuadDynamics(self.n_robots, param_dict, integrator)
+        self.dyn.states[:, STATE_SLICES["x"]] = x_inits
+        self.goals = np.asarray(goals, dtype=np.double).reshape(self.n_robots, 2)
+        self.K = np.asarray(K, dtype=np.double)
+        self.safety_dist = safety_dist
+        self.barrier = barrier
+        self.use_safe = True
+        self.qp_feasible = np.ones(self.n_robots, dtype=bool)
+        # constraint pruning, see compute_swarm_safe_control, None disables either stage
+        self.prune_horizon = PRUNE_HORIZON
+        self.max_constraints = MAX_QP_CONSTRAINTS
+        # If set, robots only see neighbours within this radius (uses SpatialGrid)
+        self.sensing_radius = sensing_radius
+
+        self.state_hist = ArrayHistory((self.n_robots, 3))
+        self.state_hist.append(self.positions)
+
+    @classmethod
+    def from_robots(cls, robots):
+        """Create from a list of Robot_Sim, using their current states and goals."""
+        swarm = cls([robot.state["x"] for robot in robots], [robot.goal for robot in robots],
+                    robots[0].ecbf.K, safety_dist=robots[0].ecbf.safety_dist)
+        for i, robot in enumerate(robots):
+            for key, sl in STATE_SLICES.items():
+                swarm.dyn.states[i, sl] = robot.state[key]
+        return swarm
+
+    @property
+    def states(self):
+        return self.dyn.states
+
+    @property
+    def positions(self):
+        return self.dyn.states[:, STATE_SLICES["x"]]
+
+    @profiling.timed("update_obstacles")
+    def update_obstacles(self, obs=[]):
+        """Stack obstacle set of every robot: other robots, then static obstacles.
+
+        Without sensing_radius every robot sees every other robot and obstacle.
+        With it, neighbours are found with a SpatialGrid rebuilt every call, and
+        robots with fewer neighbours are padded (see "mask").
+
+        Returns
+        -------
+        obstacles : dict
+            "obs", "obs_v" : (N, n_obs, 2) np.ndarray, "mask" : (N, n_obs) bool np.ndarray
+        """
+        global is_crash
+        pos = self.states[:, STATE_SLICES["x"]][:, :2]
+        vel = self.states[:, STATE_SLICES["xdot"]][:, :2]
+        n = self.n_robots
+        static = np.asarray(obs, dtype=np.double).reshape(-1, 2)
+
+        if self.sensing_radius is not None:
+            return self._update_obstacles_indexed(pos, vel, static)
+
+        obst = np.broadcast_to(pos, (n, n, 2))
+        obs_v = np.broadcast_to(vel, (n, n, 2))
+        mask = ~np.eye(n, dtype=bool)
+
+        dist = np.linalg.norm(pos[:, np.newaxis, :] - pos[np.newaxis, :, :], axis=2)
+        if np.any(mask & (dist < robot_radius)):
+            print("CRASH!!!!!!!!!!!!!!!!!!!!")
+            is_crash = True
+
+        if static.shape[0]:
+            obst = np.concatenate((obst, np.broadcast_to(static, (n,) + static.shape)), axis=1)
+            obs_v = np.concatenate((obs_v, np.zeros((n,) + static.shape)), axis=1)
+            mask = np.hstack((mask, np.ones((n, static.shape[0]), dtype=bool)))
+        return {"obs": obst, "obs_v": obs_v, "mask": mask}
+
+    def _update_obstacles_indexed(self, pos, vel, static):
+        global is_crash
+        n = self.n_robots
+        points = np.vstack((pos, static))
+        points_v = np.vstack((vel, np.zeros_like(static)))
+        grid = SpatialGrid(points, self.sensing_radius)
+        i, j, dist = grid.query_pairs(max(self.sensing_radius, robot_radius), np.arange(n))
+
+        if np.any((j < n) & (dist < robot_radius)):
+            print("CRASH!!!!!!!!!!!!!!!!!!!!")
+            is_crash = True
+        keep = dist < self.sensing_radius
+        i, j = i[keep], j[keep]
+
+        # Scatter neighbour pairs (sorted by i) into padded per-robot rows
+        count = np.bincount(i, minlength=n)
+        slot = np.arange(i.size) - (np.cumsum(count) - count)[i]
+        n_obs = np.max(count) if n else 0
+        obst = np.zeros((n, n_obs, 2))
+        obs_v = np.zeros((n, n_obs, 2))
+        mask = np.zeros((n, n_obs), dtype=bool)
+        obst[i, slot] = points[j]
+        obs_v[i, slot] = points_v[j]
+        mask[i, slot] = True
+        return {"obs": obst, "obs_v": obs_v, "mask": mask}
+
+    def compute_safe_control(self, obs, obs_v, mask=None):
+        """Safe acceleration (N, 2) of every robot. See compute_swarm_safe_control."""
+        if not self.use_safe:
+            return compute_swarm_nom_control(self.states, self.goals)
+        u, self.qp_feasible = compute_swarm_safe_control(self.states, self.goals, obs, obs_v, mask, self.K,
+                                                         self.safety_dist, self.barrier, self.prune_horizon,
+                                                         self.max_constraints)
+        profiling.count("qp.solves", self.n_robots)
+        profiling.count("qp.infeasible", int(np.count_nonzero(~self.qp_feasible)))
+        for i in np.flatnonzero(~self.qp_feasible):
+            print("Robot "+str(i)+": NO SOLUTION!!!")
+        return u
+
+    def step(self, obs=[]):
+        """Move every robot one time step. Returns safe accelerations (N, 3)."""
+        obstacles = self.update_obstacles(obs)
+        u_hat_acc = np.zeros((self.n_robots, 3))
+        u_hat_acc[:, :2] = self.compute_safe_control(obstacles["obs"], obstacles["obs_v"], obstacles["mask"])
+
+        with profiling.section("go_to_acceleration"):
+            u_motor = go_to_acceleration_batch(self.dyn.states, u_hat_acc, self.dyn.param_dict)
+        with profiling.section("step_dynamics"):
+            self.dyn.step(u_motor)
+        self.state_hist.append(self.positions)
+        return u_hat_acc
+
+
+def compute_swarm_constraints(states, obs, obs_v, K=np.array([6, 8]), safety_dist=safety_dist, barrier=barrier):
+    """Batched ECBF_control.compute_constraints for N robots.
+
+    Parameters
+    ----------
+    states : (N, 12) np.ndarray
+        stacked robot states, see dynamics.STATE_SLICES
+    obs, obs_v : (N, n_obs, 2) np.ndarray
+        obstacle positions and velocities seen by each robot
+
+    Returns
+    -------
+    h, hd : (N, n_obs) np.ndarray
+    A : (N, n_obs, 2) np.ndarray
+    b : (N, n_obs) np.ndarray
+    """
+    K = np.asarray(K, dtype=np.double).reshape(-1, 1, 2)
+    rel_r = states[:, np.newaxis, STATE_SLICES["x"]][:, :, :2] - obs
+    rd = states[:, np.newaxis, STATE_SLICES["xdot"]][:, :, :2] - obs_v
+    c = barrier.constraints(rel_r, rd, K, safety_dist)
+    return c["h"], c["hd"], c["A"], c["b"]
+
+
+def compute_swarm_nom_control(states, goals, Kn=np.array([-0.08, -0.2])):
+    """Batched ECBF_control.compute_nom_control. Returns (N, 2) np.ndarray."""
+    vd = Kn[0] * (states[:, STATE_SLICES["x"]][:, :2] - goals)
+    u_nom = Kn[1] * (states[:, STATE_SLICES["xdot"]][:, :2] - vd)
+
+    norm = np.linalg.norm(u_nom, axis=1, keepdims=True)
+    return np.where(norm > 0.05, u_nom / np.where(norm > 0, norm, 1) * 0.05, u_nom)
+
+
+def prune_swarm_constraints(h, hd, A, b, u_des, mask, prune_horizon=PRUNE_HORIZON,
+                            max_constraints=MAX_QP_CONSTRAINTS):
+    """Batched ECBF_control.prune_constraints: the constraints (N, n_obs) of
+    each robot worth solving with, as a mask."""
+    row_norm = np.sqrt(A[..., 0] * A[..., 0] + A[..., 1] * A[..., 1])
+    margin = (b - (A[..., 0] * u_des[:, 0:1] + A[..., 1] * u_des[:, 1:2])) / np.where(row_norm > 0, row_norm, 1)
+    keep = mask.copy()
+    if prune_horizon is not None:
+        keep &= (margin <= 0) | (h + prune_horizon * np.minimum(hd, 0) <= 0)
+    if max_constraints is not None and keep.shape[1] > max_constraints:
+        # the max_constraints kept rows of least margin
+        order = np.argsort(np.where(keep, margin, np.inf), axis=1, kind="stable")[:, :max_constraints]
+        capped = np.zeros_like(keep)
+        np.put_along_axis(capped, order, True, axis=1)
+        keep &= capped
+    return keep
+
+
+def compute_swarm_safe_control(states, goals, obs, obs_v, mask=None, K=np.array([6, 8]), safety_dist=safety_dist,
+                               barrier=barrier, prune_horizon=PRUNE_HORIZON, max_constraints=MAX_QP_CONSTRAINTS):
+    """Minimum-intervention safe acceleration of every robot, in one batched computation.
+
+    Constraints are pruned as in ECBF_control.compute_safe_control, and
+    pruned constraints violated by a robot's solution are added back and its
+    QP solved again, so the result is the optimum of the full QP.
+
+    Parameters
+    ----------
+    states : (N, 12) np.ndarray
+    goals : (N, 2) np.ndarray
+    obs, obs_v : (N, n_obs, 2) np.ndarray
+    mask : (N, n_obs) bool np.ndarray, optional
+        marks valid obstacles, for robots seeing fewer than n_obs obstacles
+    prune_horizon, max_constraints : float, int or None
+        see PRUNE_HORIZON / MAX_QP_CONSTRAINTS, None disables either stage
+
+    Returns
+    -------
+    u : (N, 2) np.ndarray
+        safe acceleration, zeros where the QP is infeasible
+    feasible : (N, ) bool np.ndarray
+    """
+    with profiling.section("ecbf.assembly"):
+        h, hd, A, b_ineq = compute_swarm_constraints(states, obs, obs_v, K, safety_dist, barrier)
+        u_des = compute_swarm_nom_control(states, goals)
+        if mask is None:
+            mask = np.ones(b_ineq.shape, dtype=bool)
+        keep = prune_swarm_constraints(h, hd, A, b_ineq, u_des, mask, prune_horizon, max_constraints)
+    with profiling.section("ecbf.solve"):
+        u, feasible = solve_qp_2d_batch(A, b_ineq, u_des, keep)
+        row_norm = np.sqrt(A[..., 0] * A[..., 0] + A[..., 1] * A[..., 1])
+        todo = np.arange(u.shape[0])
+        while todo.size:
+            At, bt, ut = A[todo], b_ineq[todo], u[todo]
+            violated = (mask[todo] & ~keep[todo] & feasible[todo, np.newaxis] &
+                        (At[..., 0] * ut[:, 0:1] + At[..., 1] * ut[:, 1:2] - bt > QP_TOL * row_norm[todo]))
+            todo = todo[np.any(violated, axis=1)]
+            if not todo.size:
+                break
+            profiling.count("qp.readded", int(np.count_nonzero(violated)))
+            keep[todo] |= violated[np.any(violated, axis=1)]
+            u[todo], feasible[todo] = solve_qp_2d_batch(A[todo], b_ineq[todo], u_des[todo], keep[todo])
+        profiling.record("qp.pruned", int(np.count_nonzero(mask) - np.count_nonzero(keep)))
+        return u, feasible
+
+
 def h_func(r1, r2, a, b, safety_dist):
-    hr = np.power(r1,4)/np.power(a, 4) + \
-        np.power(r2, 4)/np.power(b, 4) - safety_dist
-    return hr
+    """Barrier value at relative position (r1, r2), broadcasts over array inputs."""
+    return Superellipse(a, b).h_xy(r1, r2, safety_dist)
+
+
+def compute_plot_z(obs, x_range=PLOT_RANGE, y_range=PLOT_RANGE, res=PLOT_RES):
+    """Fraction of obstacles (2, n_obs) with h > 0 over a grid, normalised by n_obs - 1
+    (obs includes the other robots). Returns {"x", "y", "z"}."""
+    plot_x = np.arange(x_range[0], x_range[1], res)
+    plot_y = np.arange(y_range[0], y_range[1], res)
+    h = barrier.h_xy(plot_x[np.newaxis, np.newaxis, :] - obs[0][:, np.newaxis, np.newaxis],
+                     plot_y[np.newaxis, :, np.newaxis] - obs[1][:, np.newaxis, np.newaxis], safety_dist)
+    z = np.count_nonzero(h > 0, axis=0) / (obs.shape[1]-1)
+    p = {"x":plot_x, "y":plot_y, "z":z}
+    return p
+
+
+class SafetyField():
+    """Safety field of a multi-robot run, kept up to date incrementally.
+
+    Gives the z that Renderer averages over robots: for robot i, the number of
+    its obstacles (other robots and static obstacles) with h > 0 at each grid
+    point, normalised as in compute_plot_z. Only points inside an obstacle's
+    barrier (h <= 0) differ from the obstacle count, so the field is kept as
+    integer counts of such points. Static obstacles are rasterised once; a
+    robot that moved only updates the cells around its old and new position.
+
+    Parameters
+    ----------
+    obs : (n_obs, 2) np.ndarray or []
+        static obstacles
+    x_range, y_range : (2, ) tuple
+        grid region, as np.arange start / stop
+    res : float
+        grid spacing
+    barrier : barrier.Superellipse
+    """
+    def __init__(self, obs=[], x_range=PLOT_RANGE, y_range=PLOT_RANGE, res=PLOT_RES,
+                 barrier=barrier, safety_dist=safety_dist):
+        self.x = np.arange(x_range[0], x_range[1], res)
+        self.y = np.arange(y_range[0], y_range[1], res)
+        self.res = res
+        self.barrier, self.safety_dist = barrier, safety_dist
+        # half extent of the h <= 0 region around an obstacle
+        extent = max(safety_dist, 0) ** (1 / barrier.exponent)
+        self._half_size = (barrier.a * extent, barrier.b * extent)
+        self.static_obs = np.asarray(obs, dtype=np.double).reshape(-1, 2)
+        self._static_inside = np.zeros((self.y.size, self.x.size), dtype=np.int32)
+        for point in self.static_obs:
+            self._add(self._static_inside, point, 1)
+        self.robot_pos = np.zeros((0, 2))
+        self._robot_inside = np.zeros_like(self._static_inside)
+
+    def _add(self, inside, point, sign):
+        """Add sign to the cells of inside where h(cell - point) <= 0."""
+        ix = np.searchsorted(self.x, [point[0] - self._half_size[0] - self.res,
+                                      point[0] + self._half_size[0] + self.res])
+        iy = np.searchsorted(self.y, [point[1] - self._half_size[1] - self.res,
+                                      point[1] + self._half_size[1] + self.res])
+        if ix[0] == ix[1] or iy[0] == iy[1]:
+            return
+        h = self.barrier.h_xy(self.x[np.newaxis, ix[0]:ix[1]] - point[0], self.y[iy[0]:iy[1], np.newaxis] - point[1],
+                              self.safety_dist)
+        inside[iy[0]:iy[1], ix[0]:ix[1]] += sign * (h <= 0)
+
+    def update(self, pos):
+        """Move robots to pos (n_robots, 2+), updating only robots that moved.
+        Returns the number of robots updated."""
+        pos = np.asarray(pos, dtype=np.double)[:, :2]
+        if pos.shape != self.robot_pos.shape:
+            self._robot_inside[:] = 0
+            moved = np.arange(pos.shape[0])
+        else:
+            moved = np.flatnonzero(np.any(pos != self.robot_pos, axis=1))
+            for i in moved:
+                self._add(self._robot_inside, self.robot_pos[i], -1)
+        for i in moved:
+            self._add(self._robot_inside, pos[i], 1)
+        self.robot_pos = pos.copy()
+        return moved.size
+
+    @property
+    def z(self):
+        """Robot-averaged field, equal to averaging compute_plot_z over each robot's
+        obstacles (other robots, then static obstacles)."""
+        n, n_static = self.robot_pos.shape[0], self.static_obs.shape[0]
+        # each robot counts every other robot once and every static obstacle once
+        robots_safe = (n - 1) / n * (n - self._robot_inside)
+        return (robots_safe + (n_static - self._static_inside)) / (n - 1 + n_static - 1)
+
+    def plot(self, pause=None):
+        plot_h(self.x, self.y, self.z, pause=pause)
+
+
+def plot_h(plot_x, plot_y, z, pause=0.00000001):
+    h = plt.contourf(plot_x, plot_y, z, [-1, 0, 1],colors=['#808080', '#A0A0A0', '#C0C0C0'])
+    plt.xlabel("X")
+    plt.ylabel("Y")
+    if pause:
+        plt.pause(pause)
 
 
 def plot_step(id, ecbf, new_obs, u_hat_acc, state_hist, plot_handle):
-    state_hist_plot = np.array(state_hist)
-    nom_cont = ecbf.compute_nom_control()
+    plot_robot(id, state_hist, ecbf.goal, u_hat_acc, ecbf.compute_nom_control(), new_obs, plot_handle)
+
+
+def plot_robot(id, state_hist, goal, u_hat_acc, nom_cont, new_obs, plot_handle, crashed=None):
+    """Draw one robot: path, safe and nominal control, goal, obstacles and safety region.
+    Only needs recorded values, so it can also replay a headless run."""
+    state_hist_plot = np.asarray(state_hist)
+    if crashed is None:
+        crashed = is_crash
     multiplier_const = 15
     plot_handle.plot([state_hist_plot[-1, 0], state_hist_plot[-1, 0] + multiplier_const *
                 u_hat_acc[0]],
@@ -214,24 +739,24 @@ def plot_step(id, ecbf, new_obs, u_hat_acc, state_hist, plot_handle):
                 [state_hist_plot[-1, 1], state_hist_plot[-1, 1] + multiplier_const * nom_cont[1]],label="Nominal",color='orange')
 
     plot_handle.plot(state_hist_plot[:, 0], state_hist_plot[:, 1])
-    plot_handle.plot(ecbf.goal[0], ecbf.goal[1], '*r')
-    plot_handle.text(ecbf.goal[0]+0.2, ecbf.goal[1]+0.2, str(id),color='r')
+    plot_handle.plot(goal[0], goal[1], '*r')
+    plot_handle.text(goal[0]+0.2, goal[1]+0.2, str(id),color='r')
     # plot_handle.plot(state_hist_plot[-1, 0], state_hist_plot[-1, 1], '8k') # current
     plot_handle.text(state_hist_plot[-1,0]+0.2, state_hist_plot[-1,1]+0.2, str(id))
-    if is_crash:
+    if crashed:
         plot_handle.set_title("CRASHED!")
 
     for i in range(new_obs.shape[1]):
         plot_handle.plot(new_obs[0, i], new_obs[1, i], '8k') # obs
     
 
-    ell = Ellipse((state_hist_plot[-1, 0], state_hist_plot[-1, 1]), a*safety_dist+0.5, b*safety_dist+0.5, 0)
+    ell = Ellipse((state_hist_plot[-1, 0], state_hist_plot[-1, 1]), a*safety_dist+0.5, b*safety_dist+0.5, angle=0)
     ell.set_alpha(0.3)
     ell.set_facecolor(np.array([0, 1, 0]))
     
     plot_handle.add_artist(ell)
 
-    ell = Ellipse((state_hist_plot[-1, 0], state_hist_plot[-1, 1]), robot_radius+0.5, robot_radius+0.5, 0)
+    ell = Ellipse((state_hist_plot[-1, 0], state_hist_plot[-1, 1]), robot_radius+0.5, robot_radius+0.5, angle=0)
     ell.set_alpha(0.8)
     ell.set_facecolor(np.array([1, 0, 0]))
     
@@ -243,11 +768,19 @@ def plot_step(id, ecbf, new_obs, u_hat_acc, state_hist, plot_handle):
 def solve_qp(P,q,G,h):
     # Custom wrapper cvxopt.solvers.qp
     # Takes in numpy array Converts to matrix double
+    # 2 variable problems with P = p * I are solved exactly by qp_solver
+    P_arr = np.array(P, dtype=np.double)
+    if P_arr.shape == (2, 2) and P_arr[0, 0] > 0 and np.array_equal(P_arr, P_arr[0, 0] * np.eye(2)):
+        u_des = -np.array(q, dtype=np.double).reshape(2) / P_arr[0, 0]
+        sol = solve_qp_2d(np.array(G, dtype=np.double), np.array(h, dtype=np.double), u_des)
+        if sol["status"] == QP_INFEASIBLE:
+            return {"x": None, "status": "primal infeasible"}
+        return {"x": matrix(sol["x"].reshape(2, 1), tc='d'), "status": "optimal"}
+
     P = matrix(P,tc='d')
     q = matrix(q,tc='d')
     G = matrix(G,tc='d')
     h = matrix(h,tc='d')
-    solvers.options['show_progress'] = False
-    Sol = solvers.qp(P,q,G,h)
+    Sol = solvers.qp(P,q,G,h)  # show_progress is turned off once, in qp_solver
     
-    return Sol
\ No newline at end of file
+    return Sol
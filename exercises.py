@@ -2,22 +2,32 @@ import numpy as np
 import matplotlib.pyplot as plt
 import ecbf_control
 from ecbf_control import Robot_Sim
+from sim_runner import Simulation, Renderer, parse_args
+from checkpoint import load_checkpoint, CHECKPOINT_EVERY
 import warnings
 
 warnings.filterwarnings("ignore")
 
-def main():
-    #! EXERCISE 1: FILL OUT ECBF_CONTROL.PY compute_safe_control()
+def main(headless=False, n_steps=20000, render_every=10, record=None, checkpoint=None,
+         checkpoint_every=CHECKPOINT_EVERY, resume=None):
+    #! EXERCISE 1 (DONE): ECBF_CONTROL.PY compute_safe_control() solves the minimum interventional
+    #! control QP with qp_solver.solve_qp_2d. Read it; set robot.ecbf.use_safe = False to compare
+    #! with the nominal control.
     
+    # headless recorded runs are only streamed to disk: robots keep their last position
+    # instead of the full history, and no trajectory is kept, so memory stays flat
+    stream = headless and record
+    hist_maxlen = 1 if stream else None
+
     ### Define Robot 0
     x_init0 = np.array([3, -5, 10])
     goal_init0 =np.array([[-6], [4]])
-    Robot0 = Robot_Sim(x_init0, goal_init0, robot_id=0)
+    Robot0 = Robot_Sim(x_init0, goal_init0, robot_id=0, hist_maxlen=hist_maxlen)
     
     ### Define Robot 1
     x_init1 =np.array([-5, 3, 10])
     goal_init1 =np.array([[4], [-6]])
-    Robot1 = Robot_Sim(x_init1, goal_init1, robot_id=1)
+    Robot1 = Robot_Sim(x_init1, goal_init1, robot_id=1, hist_maxlen=hist_maxlen)
 
     #! EXERCISE 2: ADD 2 More Robots (4 in Total). Don't overlap + ADD some obstacles
 
@@ -29,7 +39,10 @@ def main():
 
     
 
-    a, ax1 = plt.subplots()
+    renderer = None
+    if not headless:
+        a, ax1 = plt.subplots()
+        renderer = Renderer(ax1)
     
     ## Define Obstacles
     # obs1 = np.array([[2], [2]])
@@ -38,35 +51,20 @@ def main():
     # obs = np.hstack((obs1, obs2)).T 
     obs = []   
 
-    for tt in range(20000):
-
-        obstacles = []
-        for robot in Robots:
-            obstacles.append(robot.update_obstacles(Robots, obs, noisy=False))
-
-        u_hat_acc = []
-        for robot in Robots:
-            u_hat_acc.append(robot.robot_step(np.array(obstacles[robot.id]["obs"])[:, :, 0].T, np.array(obstacles[robot.id]["obs_v"])[:, :, 0].T))
-
-        if(tt % 10 == 0):
-            print(tt)
-            plt.cla()
-            sz = 0
-            p = []
-            x = 0
-            y = 0
-            z = 0
-            for robot in Robots:
-                ecbf_control.plot_step(robot.id, robot.ecbf, np.array(obstacles[robot.id]["obs"])[:, :, 0].T, u_hat_acc[robot.id], robot.state_hist, ax1)
-                p.append( robot.ecbf.compute_plot_z(np.array(obstacles[robot.id]["obs"])[:, :, 0].T) )
-                x = x + p[robot.id]["x"]
-                y = y + p[robot.id]["y"]
-                z = z + p[robot.id]["z"]
-                
-                sz = sz + 1
-                 
-            Robot0.ecbf.plot_h(x/sz, y/sz, z/sz)
-            plt.pause(0.00000001)
+    sim = Simulation(Robots, obs, noisy=False, record=not stream)
+    if resume:
+        sim.restore(load_checkpoint(resume))
+    if record:
+        sim.start_recording(record)
+    if checkpoint:
+        sim.start_checkpoints(checkpoint, checkpoint_every)
+    sim.run(n_steps, renderer=renderer, render_every=render_every)
+    sim.stop_recording()
+    return sim.trajectory
 
 if __name__=="__main__":
-    main()
+    args = parse_args()
+    traj = main(args.headless, args.steps, args.render_every, args.record, args.checkpoint, args.checkpoint_every,
+                args.resume)
+    if args.save:
+        traj.save(args.save)
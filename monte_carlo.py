@@ -0,0 +1,215 @@
+"""monte_carlo.py
+Parallel Monte Carlo evaluation of ECBF safe control.
+
+Samples randomized multi-robot scenarios (start positions, goals, static
+obstacles, sensing noise, ECBF gains and safety distance), runs each one
+headless with sim_runner.Simulation across a process pool and collects one
+row of metrics per scenario:
+
+* crashed / n_crash_ticks : whether / for how many ticks two robots were
+  closer than robot_radius
+* min_h : smallest barrier value between any robot and any other robot or
+  obstacle, from true (not noisy) positions
+* n_infeasible : number of infeasible safe control QPs
+* time_to_goal : time (s) until every robot is within goal_tol of its goal,
+  NaN if not reached
+
+Scenario i only depends on (seed, i), so the same seed gives the same table
+whatever the number of workers.
+
+`python monte_carlo.py --n 1000 --workers 8 --seed 0 --out results.csv`
+"""
+
+import argparse
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import ecbf_control
+from ecbf_control import Robot_Sim
+from qp_solver import QP_INFEASIBLE
+from barrier import pairwise
+from dynamics import dt
+from sim_runner import Simulation
+
+# Ranges scenarios are sampled from
+SCENARIO_RANGES = {
+    "n_robots": (2, 5),  # inclusive
+    "n_obs": (0, 3),  # inclusive
+    "arena": 6.0,  # starts, goals and obstacles in [-arena, arena]^2
+    "min_sep": 1.5,  # minimum distance between starts / goals / obstacles
+    "noise": (0.0, 1.0),
+    "Kp": (4.0, 8.0),
+    "Kd": (6.0, 10.0),
+    "safety_dist": (0.5, 1.5),
+}
+SCENARIO_TRIES = 100  # resamples of a scenario whose points do not fit
+
+
+def sample_points(rng, n, arena, min_sep, avoid=np.zeros((0, 2)), max_tries=1000):
+    """Sample n points in [-arena, arena]^2 at least min_sep from each other and from avoid.
+    Raises ValueError if they could not all be placed in max_tries samples."""
+    points = np.array(avoid, dtype=np.double).reshape(-1, 2)
+    n_avoid = points.shape[0]
+    for _ in range(max_tries):
+        if points.shape[0] - n_avoid == n:
+            break
+        p = rng.uniform(-arena, arena, 2)
+        if np.all(np.linalg.norm(points - p, axis=1) >= min_sep):
+            points = np.vstack((points, p))
+    if points.shape[0] - n_avoid < n:
+        raise ValueError("placed %d of %d points %g apart in [-%g, %g]^2" % (points.shape[0] - n_avoid, n, min_sep,
+                                                                           arena, arena))
+    return points[n_avoid:]
+
+
+def sample_scenario(seed, ranges=SCENARIO_RANGES):
+    """Randomized scenario parameters, deterministic given seed. Scenarios whose
+    starts, goals or obstacles do not fit are resampled (SCENARIO_TRIES times)."""
+    rng = np.random.default_rng(seed)
+    for _ in range(SCENARIO_TRIES):
+        n_robots = rng.integers(ranges["n_robots"][0], ranges["n_robots"][1] + 1)
+        n_obs = rng.integers(ranges["n_obs"][0], ranges["n_obs"][1] + 1)
+        try:
+            obs = sample_points(rng, n_obs, ranges["arena"] / 2, ranges["min_sep"])
+            starts = sample_points(rng, n_robots, ranges["arena"], ranges["min_sep"], obs)
+            goals = sample_points(rng, n_robots, ranges["arena"], ranges["min_sep"], obs)
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError("scenario %s: no placement of starts, goals and obstacles in %d tries" % (seed,
+                                                                                                 SCENARIO_TRIES))
+    return {
+        "seed": seed,
+        "starts": starts,
+        "goals": goals,
+        "obs": obs,
+        "noise": rng.uniform(*ranges["noise"]),
+        "Kp": rng.uniform(*ranges["Kp"]),
+        "Kd": rng.uniform(*ranges["Kd"]),
+        "safety_dist": rng.uniform(*ranges["safety_dist"]),
+    }
+
+
+def true_min_h(pos, obs, safety_dist):
+    """Smallest barrier value over all robot-robot and robot-obstacle pairs."""
+    others = np.vstack((pos, obs))
+    h = ecbf_control.barrier.h(pairwise(pos, others), safety_dist)
+    h[np.arange(pos.shape[0]), np.arange(pos.shape[0])] = np.inf  # self pairs
+    return np.min(h)
+
+
+def run_scenario(scenario, n_steps=2000, goal_tol=0.3):
+    """Run one scenario headless. Returns a dict of scenario parameters and metrics."""
+    robots = []
+    for i, (start, goal) in enumerate(zip(scenario["starts"], scenario["goals"])):
+        robot = Robot_Sim(np.array([start[0], start[1], 10.0]), goal.reshape(2, 1), i, hist_maxlen=1)
+        robot.ecbf.K = np.array([scenario["Kp"], scenario["Kd"]])
+        robot.ecbf.safety_dist = scenario["safety_dist"]
+        robot.rng = np.random.default_rng([scenario["seed"], i])
+        robots.append(robot)
+    obs = scenario["obs"] if scenario["obs"].shape[0] else []
+    sim = Simulation(robots, obs, noisy=scenario["noise"], record=False)
+    goals = scenario["goals"]
+
+    ecbf_control.is_crash = False
+    min_h = np.inf
+    n_infeasible = 0
+    n_crash_ticks = 0
+    time_to_goal = np.nan
+    # Robots print crash and infeasibility messages, keep workers quiet
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tt in range(n_steps):
+            sim.step()
+            pos = sim.positions()[:, :2]
+            n_infeasible += sum(robot.ecbf.qp_status == QP_INFEASIBLE for robot in robots)
+            min_h = min(min_h, true_min_h(pos, scenario["obs"], scenario["safety_dist"]))
+            dist = np.linalg.norm(pos[:, np.newaxis, :] - pos[np.newaxis, :, :], axis=2)
+            n_crash_ticks += np.any(dist[np.triu_indices(len(robots), 1)] < ecbf_control.robot_radius)
+            if np.all(np.linalg.norm(pos - goals, axis=1) < goal_tol):
+                time_to_goal = (tt + 1) * dt
+                break
+
+    return {
+        "seed": scenario["seed"],
+        "n_robots": len(robots),
+        "n_obs": scenario["obs"].shape[0],
+        "noise": scenario["noise"],
+        "Kp": scenario["Kp"],
+        "Kd": scenario["Kd"],
+        "safety_dist": scenario["safety_dist"],
+        "crashed": n_crash_ticks > 0,
+        "n_crash_ticks": int(n_crash_ticks),
+        "min_h": min_h,
+        "n_infeasible": int(n_infeasible),
+        "time_to_goal": time_to_goal,
+    }
+
+
+def _run_seed(args):
+    seed, n_steps, ranges = args
+    return run_scenario(sample_scenario(seed, ranges), n_steps)
+
+
+def scenario_seeds(n, seed=0):
+    """Independent per-scenario seeds derived from one base seed."""
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(n)]
+
+
+def iter_monte_carlo(n, seed=0, n_steps=2000, workers=None, ranges=SCENARIO_RANGES):
+    """Yield result rows in scenario order as they finish. workers=1 runs in process."""
+    jobs = [(s, n_steps, ranges) for s in scenario_seeds(n, seed)]
+    if workers == 1:
+        for job in jobs:
+            yield _run_seed(job)
+        return
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for row in pool.map(_run_seed, jobs, chunksize=max(1, n // (4 * workers))):
+            yield row
+
+
+def run_monte_carlo(n, seed=0, n_steps=2000, workers=None, ranges=SCENARIO_RANGES, out=None):
+    """Run n scenarios and return a pd.DataFrame with one row each.
+    If out is given, rows are also written to that csv as they arrive."""
+    rows = []
+    for row in iter_monte_carlo(n, seed, n_steps, workers, ranges):
+        if out is not None:
+            pd.DataFrame([row]).to_csv(out, mode="a" if rows else "w", header=not rows, index=False)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def summarize(results):
+    """Aggregate a results table into overall safety metrics."""
+    return pd.Series({
+        "n_scenarios": len(results),
+        "crash_rate": results["crashed"].mean(),
+        "min_h": results["min_h"].min(),
+        "mean_min_h": results["min_h"].mean(),
+        "n_infeasible": results["n_infeasible"].sum(),
+        "goal_rate": results["time_to_goal"].notna().mean(),
+        "mean_time_to_goal": results["time_to_goal"].mean(),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo evaluation of ECBF safe control.")
+    parser.add_argument("--n", type=int, default=100, help="number of scenarios")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--steps", type=int, default=2000, help="max ticks per scenario")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--out", default=None, help="csv file to stream results to")
+    args = parser.parse_args()
+
+    results = run_monte_carlo(args.n, args.seed, args.steps, args.workers, out=args.out)
+    print(summarize(results).to_string())
+
+
+if __name__ == "__main__":
+    main()
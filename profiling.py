@@ -0,0 +1,271 @@
+"""profiling.py
+Opt-in timing of simulation subsystems.
+
+Instrumented code marks sections with `with profiling.section(name):` or the
+`@profiling.timed(name)` decorator, and reports counts / values with
+`profiling.count` and `profiling.record`. Profiling is off by default: then
+sections are a shared no-op context manager and count / record return
+immediately, so instrumentation costs a function call.
+
+    profiling.enable(trace=True)
+    sim.run(1000)
+    profiling.print_summary()
+    profiling.write_trace("trace.json")  # chrome://tracing or ui.perfetto.dev
+    profiling.disable()
+
+Instrumented sections: "tick" (Simulation.step), "update_obstacles",
+"ecbf.assembly" / "ecbf.solve" (compute_safe_control), "go_to_acceleration",
+"step_dynamics" and "render". Values: "qp.active" (active constraints at the
+optimum, the active-set solver's work), counters: "qp.solves", "qp.infeasible"
+"qp.path.<path>" (see qp_solver.QP_PATHS), and from realtime.RealTimeRuntime
+"rt.deadline_misses" and "rt.fallbacks".
+
+`python -m profiling test --steps 500 --out prof` profiles an example script
+headless and writes prof.json (summary) and prof.trace.json.
+"""
+
+import argparse
+import contextlib
+import functools
+import importlib
+import json
+import os
+import time
+
+import numpy as np
+
+MAX_TRACE_EVENTS = 1000000  # trace events kept, later ones are dropped (and counted)
+SUMMARY_PERCENTILES = (50, 90, 99)
+
+_profiler = None  # active Profiler, None when disabled
+
+
+class _NullSection():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class _Section():
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_duration(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class Profiler():
+    """Collects section durations (ns), counters and recorded values.
+
+    Parameters
+    ----------
+    trace : bool
+        also keep every section as a trace event, for write_trace
+    max_trace_events : int
+    """
+    def __init__(self, trace=False, max_trace_events=MAX_TRACE_EVENTS):
+        self.trace = trace
+        self.max_trace_events = max_trace_events
+        self.durations = {}  # name -> list of ns
+        self.values = {}  # name -> list of recorded values
+        self.counters = {}
+        self.events = []  # (name, start_ns, duration_ns)
+        self.dropped_events = 0
+        self.t0 = time.perf_counter_ns()
+
+    def section(self, name):
+        return _Section(self, name)
+
+    def add_duration(self, name, start, duration):
+        self.durations.setdefault(name, []).append(duration)
+        if self.trace:
+            if len(self.events) < self.max_trace_events:
+                self.events.append((name, start, duration))
+            else:
+                self.dropped_events += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, value):
+        self.values.setdefault(name, []).append(value)
+
+    def histogram(self, name, bins=20):
+        """(counts, edges) of a section's durations (us) or of recorded values."""
+        if name in self.durations:
+            data = np.asarray(self.durations[name]) / 1e3
+        else:
+            data = np.asarray(self.values[name])
+        return np.histogram(data, bins=bins)
+
+    def summary(self):
+        """Per-run summary dict: "sections" (count, total_s, mean / percentile /
+        max latency in us), "values" (count, mean, max, counts of each value)
+        and "counters"."""
+        sections = {}
+        for name, durations in self.durations.items():
+            us = np.asarray(durations) / 1e3
+            row = {"count": int(us.size), "total_s": float(us.sum() / 1e6), "mean_us": float(us.mean())}
+            for q, v in zip(SUMMARY_PERCENTILES, np.percentile(us, SUMMARY_PERCENTILES)):
+                row["p%d_us" % q] = float(v)
+            row["max_us"] = float(us.max())
+            sections[name] = row
+        values = {}
+        for name, vals in self.values.items():
+            vals = np.asarray(vals)
+            uniq, counts = np.unique(vals, return_counts=True)
+            values[name] = {"count": int(vals.size), "mean": float(vals.mean()), "max": float(vals.max()),
+                            "histogram": {str(u): int(c) for u, c in zip(uniq, counts)}}
+        return {"wall_s": (time.perf_counter_ns() - self.t0) / 1e9, "sections": sections,
+                "values": values, "counters": dict(self.counters), "dropped_trace_events": self.dropped_events}
+
+    def print_summary(self):
+        summ = self.summary()
+        print("%-24s %8s %10s %10s %10s %10s %10s" % ("section", "count", "total_s", "mean_us", "p50_us",
+                                                      "p99_us", "max_us"))
+        for name, row in sorted(summ["sections"].items(), key=lambda kv: -kv[1]["total_s"]):
+            print("%-24s %8d %10.4f %10.1f %10.1f %10.1f %10.1f" % (name, row["count"], row["total_s"],
+                  row["mean_us"], row["p50_us"], row["p99_us"], row["max_us"]))
+        for name, row in summ["values"].items():
+            print("%-24s %8d  mean %.3g  max %.3g  %s" % (name, row["count"], row["mean"], row["max"],
+                                                          row["histogram"]))
+        for name, n in summ["counters"].items():
+            print("%-24s %8d" % (name, n))
+
+    def write_summary(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_trace(self, path):
+        """Write trace events in the Chrome trace event format (JSON), for
+        chrome://tracing, ui.perfetto.dev or speedscope."""
+        pid = os.getpid()
+        events = [{"name": name, "ph": "X", "ts": (start - self.t0) / 1e3, "dur": dur / 1e3, "pid": pid, "tid": 0}
+                  for name, start, dur in self.events]
+        for name, n in self.counters.items():
+            events.append({"name": name, "ph": "C", "ts": (time.perf_counter_ns() - self.t0) / 1e3,
+                           "pid": pid, "tid": 0, "args": {name: n}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def enable(trace=False, max_trace_events=MAX_TRACE_EVENTS):
+    """Start profiling with a new Profiler, returned."""
+    global _profiler
+    _profiler = Profiler(trace, max_trace_events)
+    return _profiler
+
+
+def disable():
+    """Stop profiling. Returns the Profiler that was active, or None."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+@contextlib.contextmanager
+def profile(trace=False):
+    """Profile a block: `with profile() as prof: ...`, prof stays readable afterwards."""
+    profiler = enable(trace)
+    try:
+        yield profiler
+    finally:
+        if _profiler is profiler:
+            disable()
+
+
+def section(name):
+    """Context manager timing its block as section name (no-op when disabled)."""
+    if _profiler is None:
+        return _NULL_SECTION
+    return _Section(_profiler, name)
+
+
+def timed(name):
+    """Decorator timing every call of a function as section name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.add_duration(name, start, time.perf_counter_ns() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def record(name, value):
+    if _profiler is not None:
+        _profiler.record(name, value)
+
+
+def print_summary():
+    if _profiler is not None:
+        _profiler.print_summary()
+
+
+def write_summary(path):
+    if _profiler is not None:
+        _profiler.write_summary(path)
+
+
+def write_trace(path):
+    if _profiler is not None:
+        _profiler.write_trace(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile an example script (test, exercises, ...) headless.")
+    parser.add_argument("script", help="module with main(headless, n_steps, render_every)")
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--render", action="store_true", help="also time rendering (every 10 ticks)")
+    parser.add_argument("--out", default="profile", help="writes OUT.json (summary) and OUT.trace.json")
+    args = parser.parse_args()
+
+    if not args.render:
+        import matplotlib
+        matplotlib.use("Agg")
+    module = importlib.import_module(args.script)
+    # Run as a script this module is __main__, enable the profiler instrumented modules import
+    profiling = importlib.import_module("profiling")
+    # robots print crash / infeasibility messages
+    with open(os.devnull, "w") as devnull, profiling.profile(trace=True) as profiler, \
+            contextlib.redirect_stdout(devnull):
+        module.main(headless=not args.render, n_steps=args.steps)
+    profiler.print_summary()
+    profiler.write_summary(args.out + ".json")
+    profiler.write_trace(args.out + ".trace.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""qp_solver.py
+Exact solver for the small minimum-intervention QP used by the ECBF controller
+
+    min ||u - u_des||^2   s.t.   A u <= b,   u in R^2
+
+With two decision variables the optimum has at most two linearly independent
+active constraints, so the active set can be found by enumerating projections
+onto single constraints and intersections of constraint pairs. This is much
+cheaper than setting up an interior-point solve for every robot every tick.
+"""
+
+import math
+
+import numpy as np
+from cvxopt import matrix
+from cvxopt import solvers
+
+solvers.options['show_progress'] = False
+
+# Solver status, reported in the "status" entry of the returned dict
+QP_OPTIMAL = "optimal"
+QP_INFEASIBLE = "infeasible"
+
+# How the solution was found, reported in the "path" entry of the returned dict
+QP_PATH_NOMINAL = "nominal"  # desired control already feasible, no solve
+QP_PATH_WARM = "warm"  # optimum at the given warm start active set
+QP_PATH_PROJECTION = "projection"  # projection onto one constraint
+QP_PATH_VERTEX = "vertex"  # intersection of two constraints
+QP_PATH_CVXOPT = "cvxopt"  # too many constraints for the active set search
+QP_PATH_INFEASIBLE = "infeasible"
+QP_PATHS = (QP_PATH_NOMINAL, QP_PATH_WARM, QP_PATH_PROJECTION, QP_PATH_VERTEX, QP_PATH_CVXOPT, QP_PATH_INFEASIBLE)
+
+QP_TOL = 1e-9  # feasibility tolerance, relative to the row norm of A
+MAX_ACTIVE_SET_CONSTRAINTS = 64  # above this, fall back to cvxopt
+SMALL_QP_CONSTRAINTS = 8  # up to this, solve in plain floats (numpy call overhead dominates)
+
+
+def solve_qp_2d(A, b, u_des, tol=QP_TOL, warm_active=None):
+    """Solve min ||u - u_des||^2 s.t. A u <= b for u in R^2.
+
+    Parameters
+    ----------
+    A : (n_cons, 2) np.ndarray
+    b : (n_cons, ) np.ndarray
+    u_des : (2, ) np.ndarray
+        desired (nominal) control
+    warm_active : list, optional
+        guess of the active constraints, e.g. "active" of the previous solve.
+        Used if it satisfies the optimality conditions, so a wrong guess only
+        costs the check
+
+    Returns
+    -------
+    sol : dict
+        "x" : (2, ) np.ndarray, optimal control (None if infeasible)
+        "status" : QP_OPTIMAL or QP_INFEASIBLE
+        "active" : list of indices of active constraints
+        "path" : one of QP_PATHS
+    """
+    A = np.asarray(A, dtype=np.double).reshape(-1, 2)
+    b = np.asarray(b, dtype=np.double).reshape(-1)
+    u_des = np.asarray(u_des, dtype=np.double).reshape(2)
+
+    if A.shape[0] <= SMALL_QP_CONSTRAINTS:
+        return _solve_qp_2d_small(A.tolist(), b.tolist(), u_des, tol, warm_active)
+    if A.shape[0] > MAX_ACTIVE_SET_CONSTRAINTS:
+        return solve_qp_2d_cvxopt(A, b, u_des)
+
+    # Normalize rows so the tolerance is scale free. Rows with A_i = 0 are
+    # either always or never satisfied
+    row_norm = np.sqrt(A[:, 0] * A[:, 0] + A[:, 1] * A[:, 1])
+    degenerate = row_norm < tol
+    rows = None  # original row index of each kept row, if any were dropped
+    if np.any(degenerate):
+        if np.any(b[degenerate] < -tol):
+            return {"x": None, "status": QP_INFEASIBLE, "active": [], "path": QP_PATH_INFEASIBLE}
+        rows = np.flatnonzero(~degenerate)
+        A, b, row_norm = A[rows], b[rows], row_norm[rows]
+    A = A / row_norm[:, np.newaxis]
+    b = b / row_norm
+
+    # Nominal control already safe, no intervention needed. Written out, as in
+    # _solve_qp_2d_small, so both paths round the same
+    slack = b - (A[:, 0] * u_des[0] + A[:, 1] * u_des[1])
+    violated = np.flatnonzero(slack < -tol)
+    if violated.size == 0:
+        return {"x": u_des, "status": QP_OPTIMAL, "active": [], "path": QP_PATH_NOMINAL}
+
+    if warm_active and rows is None:
+        x = _check_active_set(A, b, u_des, slack, warm_active, tol)
+        if x is not None:
+            return {"x": x, "status": QP_OPTIMAL, "active": list(warm_active), "path": QP_PATH_WARM}
+
+    # At least one active constraint of the optimum is violated by u_des.
+    # A projection onto one violated constraint that satisfies all others
+    # solves the relaxed problem, so it is the optimum.
+    proj = u_des + slack[violated, np.newaxis] * A[violated]
+    feasible = np.all(proj @ A.T <= b + tol, axis=1)
+    if np.any(feasible):
+        best = np.argmax(feasible)
+        return {"x": proj[best], "status": QP_OPTIMAL, "active": _orig_rows(rows, [violated[best]]),
+                "path": QP_PATH_PROJECTION}
+
+    # Otherwise the optimum is a vertex of a violated constraint with another
+    # one. Every feasible vertex is an upper bound, the cheapest is optimal.
+    vi = np.repeat(violated, A.shape[0])
+    vj = np.tile(np.arange(A.shape[0]), violated.size)
+    det = A[vi, 0] * A[vj, 1] - A[vi, 1] * A[vj, 0]
+    keep = np.abs(det) > tol
+    vi, vj, det = vi[keep], vj[keep], det[keep]
+    vert = np.stack(((b[vi] * A[vj, 1] - b[vj] * A[vi, 1]) / det,
+                     (A[vi, 0] * b[vj] - A[vj, 0] * b[vi]) / det), axis=1)
+    feasible = np.all(vert @ A.T <= b + tol, axis=1)
+    if not np.any(feasible):
+        return {"x": None, "status": QP_INFEASIBLE, "active": [], "path": QP_PATH_INFEASIBLE}
+    cost = np.sum(np.square(vert - u_des), axis=1)
+    best = np.flatnonzero(feasible)[np.argmin(cost[feasible])]
+    return {"x": vert[best], "status": QP_OPTIMAL, "active": _orig_rows(rows, [vi[best], vj[best]]),
+            "path": QP_PATH_VERTEX}
+
+
+def _solve_qp_2d_small(A, b, u_des, tol, warm_active):
+    """solve_qp_2d on lists A (n_cons x 2) and b, same steps in plain floats."""
+    u0, u1 = u_des.tolist()
+    rows = []  # original index, normalized row and bound, slack at u_des
+    for i, ((a0, a1), bi) in enumerate(zip(A, b)):
+        norm = math.sqrt(a0 * a0 + a1 * a1)
+        if norm < tol:
+            if bi < -tol:
+                return {"x": None, "status": QP_INFEASIBLE, "active": [], "path": QP_PATH_INFEASIBLE}
+            continue
+        a0, a1, bi = a0 / norm, a1 / norm, bi / norm
+        rows.append((i, a0, a1, bi, bi - (a0 * u0 + a1 * u1)))
+    violated = [row for row in rows if row[4] < -tol]
+    if not violated:
+        return {"x": u_des, "status": QP_OPTIMAL, "active": [], "path": QP_PATH_NOMINAL}
+
+    def is_feasible(x0, x1):
+        for _, a0, a1, bi, _ in rows:
+            if a0 * x0 + a1 * x1 > bi + tol:
+                return False
+        return True
+
+    if warm_active and len(rows) == len(A):
+        x = None
+        if len(warm_active) == 1 and warm_active[0] < len(rows):
+            _, a0, a1, _, si = rows[warm_active[0]]
+            if si < -tol:
+                x = (u0 + si * a0, u1 + si * a1)
+        elif len(warm_active) == 2 and max(warm_active) < len(rows):
+            _, ai0, ai1, bi, _ = rows[warm_active[0]]
+            _, aj0, aj1, bj, _ = rows[warm_active[1]]
+            det = ai0 * aj1 - ai1 * aj0
+            if abs(det) > tol:
+                x = ((bi * aj1 - bj * ai1) / det, (ai0 * bj - aj0 * bi) / det)
+                d0, d1 = u0 - x[0], u1 - x[1]
+                if (d0 * aj1 - d1 * aj0) / det < -tol or (ai0 * d1 - ai1 * d0) / det < -tol:
+                    x = None
+        if x is not None and is_feasible(*x):
+            return {"x": np.array(x), "status": QP_OPTIMAL, "active": list(warm_active), "path": QP_PATH_WARM}
+
+    for i, a0, a1, _, si in violated:
+        x0, x1 = u0 + si * a0, u1 + si * a1
+        if is_feasible(x0, x1):
+            return {"x": np.array([x0, x1]), "status": QP_OPTIMAL, "active": [i], "path": QP_PATH_PROJECTION}
+
+    best, best_cost = None, math.inf
+    for i, ai0, ai1, bi, _ in violated:
+        for j, aj0, aj1, bj, _ in rows:
+            det = ai0 * aj1 - ai1 * aj0
+            if abs(det) <= tol:
+                continue
+            x0, x1 = (bi * aj1 - bj * ai1) / det, (ai0 * bj - aj0 * bi) / det
+            cost = (x0 - u0) ** 2 + (x1 - u1) ** 2
+            if cost < best_cost and is_feasible(x0, x1):
+                best, best_cost = (x0, x1, i, j), cost
+    if best is None:
+        return {"x": None, "status": QP_INFEASIBLE, "active": [], "path": QP_PATH_INFEASIBLE}
+    return {"x": np.array(best[:2]), "status": QP_OPTIMAL, "active": [best[2], best[3]], "path": QP_PATH_VERTEX}
+
+
+def _check_active_set(A, b, u_des, slack, active, tol):
+    """Optimum of the QP (normalized A, b) if it has exactly the constraints
+    active active (1 or 2 indices), else None. Checks the KKT conditions:
+    feasibility and non-negative multipliers, u_des - x = sum mu_i A_i."""
+    if any(i >= b.size for i in active):
+        return None
+    if len(active) == 1:
+        i = active[0]
+        if slack[i] >= -tol:  # multiplier is -slack[i]
+            return None
+        x = u_des + slack[i] * A[i]
+    elif len(active) == 2:
+        # same vertex expression as in solve_qp_2d
+        i, j = active
+        det = A[i, 0] * A[j, 1] - A[i, 1] * A[j, 0]
+        if abs(det) <= tol:
+            return None
+        x = np.array([(b[i] * A[j, 1] - b[j] * A[i, 1]) / det, (A[i, 0] * b[j] - A[j, 0] * b[i]) / det])
+        d = u_des - x
+        if (d[0] * A[j, 1] - d[1] * A[j, 0]) / det < -tol or (A[i, 0] * d[1] - A[i, 1] * d[0]) / det < -tol:
+            return None
+    else:
+        return None
+    if np.all(A @ x <= b + tol):
+        return x
+    return None
+
+
+def _orig_rows(rows, idx):
+    if rows is None:
+        return [int(i) for i in idx]
+    return [int(rows[i]) for i in idx]
+
+
+def solve_qp_2d_cvxopt(A, b, u_des):
+    """Same problem and return format as solve_qp_2d, solved with cvxopt."""
+    u_des = np.asarray(u_des, dtype=np.double).reshape(2)
+    try:
+        Sol = solvers.qp(matrix(2 * np.eye(2), tc='d'), matrix(-2 * u_des, tc='d'),
+                         matrix(np.asarray(A, dtype=np.double).reshape(-1, 2), tc='d'),
+                         matrix(np.asarray(b, dtype=np.double).reshape(-1, 1), tc='d'))
+    except (ValueError, ArithmeticError):
+        return {"x": None, "status": QP_INFEASIBLE, "active": [], "path": QP_PATH_INFEASIBLE}
+    if Sol['status'] != 'optimal':
+        return {"x": None, "status": QP_INFEASIBLE, "active": [], "path": QP_PATH_INFEASIBLE}
+    return {"x": np.array(Sol['x']).reshape(2), "status": QP_OPTIMAL, "active": [], "path": QP_PATH_CVXOPT}
+
+
+def solve_qp_2d_batch(A, b, u_des, mask=None, tol=QP_TOL, max_block=4000000):
+    """Solve N independent 2 variable QPs (see solve_qp_2d) in one batched computation.
+
+    Parameters
+    ----------
+    A : (N, n_cons, 2) np.ndarray
+    b : (N, n_cons) np.ndarray
+    u_des : (N, 2) np.ndarray
+        desired (nominal) control of each problem
+    mask : (N, n_cons) bool np.ndarray, optional
+        marks valid constraints, for problems with fewer than n_cons rows
+    max_block : int
+        bounds the number of elements of temporary arrays in the vertex step
+
+    Valid rows are packed to the front, so the work per problem grows with its
+    number of valid constraints, not n_cons. Problems with more than
+    MAX_ACTIVE_SET_CONSTRAINTS of them are solved one by one with solve_qp_2d
+    (cvxopt), as the vertex step is cubic in the number of constraints.
+
+    Returns
+    -------
+    x : (N, 2) np.ndarray
+        optimal control, zeros for infeasible problems
+    feasible : (N, ) bool np.ndarray
+    """
+    A = np.asarray(A, dtype=np.double)
+    b = np.asarray(b, dtype=np.double)
+    u_des = np.asarray(u_des, dtype=np.double).reshape(-1, 2)
+    n_prob, n_cons = b.shape
+    x = u_des.copy()
+    feasible = np.ones(n_prob, dtype=bool)
+    if n_cons == 0:
+        return x, feasible
+    if mask is None:
+        mask = np.ones((n_prob, n_cons), dtype=bool)
+
+    n_valid = np.count_nonzero(mask, axis=1)
+    big = n_valid > MAX_ACTIVE_SET_CONSTRAINTS
+    if np.any(big):
+        for i in np.flatnonzero(big):
+            sol = solve_qp_2d(A[i][mask[i]], b[i][mask[i]], u_des[i], tol)
+            feasible[i] = sol["status"] == QP_OPTIMAL
+            x[i] = sol["x"] if feasible[i] else 0
+        rest = np.flatnonzero(~big)
+        if rest.size:
+            x[rest], feasible[rest] = solve_qp_2d_batch(A[rest], b[rest], u_des[rest], mask[rest], tol, max_block)
+        return x, feasible
+    width = np.max(n_valid)
+    if width < n_cons:
+        # valid rows first, in order
+        order = np.argsort(~mask, axis=1, kind="stable")[:, :width]
+        A = np.take_along_axis(A, order[:, :, np.newaxis], axis=1)
+        b = np.take_along_axis(b, order, axis=1)
+        mask = np.take_along_axis(mask, order, axis=1)
+        n_cons = width
+        if n_cons == 0:
+            return x, feasible
+
+    # Normalize rows. Padded and zero rows become 0 <= 1, which never binds
+    row_norm = np.sqrt(np.sum(A * A, axis=2))
+    degenerate = row_norm < tol
+    feasible &= ~np.any(mask & degenerate & (b < -tol), axis=1)
+    unused = ~mask | degenerate
+    row_norm = np.where(unused, 1, row_norm)
+    A = np.where(unused[:, :, np.newaxis], 0, A / row_norm[:, :, np.newaxis])
+    b = np.where(unused, 1, b / row_norm)
+
+    # Nominal control already safe
+    slack = b - np.einsum('nij,nj->ni', A, u_des)
+    violated = slack < -tol
+    todo = feasible & np.any(violated, axis=1)
+
+    # Projections onto a single violated constraint (see solve_qp_2d)
+    idx = np.flatnonzero(todo)
+    proj = u_des[idx, np.newaxis, :] + np.minimum(slack[idx], 0)[:, :, np.newaxis] * A[idx]
+    proj_ok = violated[idx] & np.all(np.einsum('nkd,njd->nkj', proj, A[idx]) <= b[idx, np.newaxis, :] + tol, axis=2)
+    solved = np.any(proj_ok, axis=1)
+    best = np.argmax(proj_ok, axis=1)
+    x[idx[solved]] = proj[solved, best[solved]]
+    todo[idx[solved]] = False
+
+    # Vertices of a violated constraint with another one, in blocks of problems
+    idx = np.flatnonzero(todo)
+    block = max(1, max_block // (n_cons ** 3))
+    for start in range(0, idx.size, block):
+        blk = idx[start:start + block]
+        Ab, bb = A[blk], b[blk]
+        Ai, Aj = Ab[:, :, np.newaxis, :], Ab[:, np.newaxis, :, :]
+        bi, bj = bb[:, :, np.newaxis], bb[:, np.newaxis, :]
+        det = Ai[..., 0] * Aj[..., 1] - Ai[..., 1] * Aj[..., 0]
+        valid = violated[blk][:, :, np.newaxis] & (np.abs(det) > tol)
+        det = np.where(valid, det, 1)
+        vert = np.stack(((bi * Aj[..., 1] - bj * Ai[..., 1]) / det,
+                         (Ai[..., 0] * bj - Aj[..., 0] * bi) / det), axis=-1)
+        vert = vert.reshape(blk.size, n_cons * n_cons, 2)
+        valid = valid.reshape(blk.size, n_cons * n_cons)
+        valid &= np.all(np.einsum('nkd,njd->nkj', vert, Ab) <= bb[:, np.newaxis, :] + tol, axis=2)
+        cost = np.where(valid, np.sum(np.square(vert - u_des[blk, np.newaxis, :]), axis=2), np.inf)
+        best = np.argmin(cost, axis=1)
+        ok = np.any(valid, axis=1)
+        x[blk[ok]] = vert[ok, best[ok]]
+        feasible[blk[~ok]] = False
+
+    x[~feasible] = 0
+    return x, feasible
@@ -0,0 +1,278 @@
+"""realtime.py
+Run the ECBF control pipeline of each robot at a fixed wall-clock rate.
+
+RealTimeRuntime gives every robot an asyncio task that, once per period,
+
+    sensor.read -> compute_safe_control -> go_to_acceleration -> actuator.write
+
+Cycle k of a robot is released at t0 + k * period and must finish (actuator
+written) by its deadline, the next release. Each cycle records its jitter
+(release lateness) and latency (release to actuation); late cycles count as
+deadline misses, and releases already past when a cycle ends are skipped
+rather than run back to back.
+
+With a solve_budget, the QP runs in a worker thread. If it is not done
+within the budget, the robot's last safe control is sent instead (a
+fallback) and the solve keeps running; its result is picked up by a later
+cycle, which does not start a new solve in the meantime. Without a budget
+the QP runs inline, and an overrun only shows as a deadline miss. Workers
+share the GIL with the event loop, so budgets not well above
+sys.getswitchinterval() (5 ms by default) also see fallbacks from solves
+that were waiting for it.
+
+Sensors and actuators are objects with `async read(robot)` and
+`async write(robot, u_motor)`. StubSensor and StubActuator stand in for
+real ones: they read the simulated robot states and step the simulated
+dynamics (one dynamics.dt per cycle, whatever the rate).
+
+`python realtime.py --robots 10 --rate 100 --duration 5 --solve-budget 0.5`
+runs a random monte_carlo scenario and prints the deadline statistics.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import ecbf_control
+import profiling
+from controller import go_to_acceleration
+from dynamics import QuadState
+from profiling import SUMMARY_PERCENTILES
+from sim_runner import obstacles_to_array
+from sim_utils import ArrayHistory
+
+CONTROL_RATE = 100  # Hz
+STATS_WINDOW = 10000  # cycles of jitter / latency kept per robot
+
+
+class StubSensor():
+    """Reads obstacles as Robot_Sim.update_obstacles sees them, and a copy of
+    the robot's own state, after an optional simulated latency (s)."""
+    def __init__(self, robots, obs=[], noisy=False, latency=0):
+        self.robots = robots
+        self.obs = obs
+        self.noisy = noisy
+        self.latency = latency
+
+    async def read(self, robot):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        obs, obs_v = obstacles_to_array(robot.update_obstacles(self.robots, self.obs, noisy=self.noisy))
+        return {"state": QuadState(data=robot.state.data.copy()), "obs": obs, "obs_v": obs_v}
+
+
+class StubActuator():
+    """Applies motor inputs by stepping the robot's simulated dynamics, after
+    an optional simulated latency (s)."""
+    def __init__(self, latency=0):
+        self.latency = latency
+
+    async def write(self, robot, u_motor):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with profiling.section("step_dynamics"):
+            robot.state = robot.dyn.step_dynamics(robot.state, u_motor)
+        robot.state_hist.append(robot.state["x"])
+
+
+class DeadlineStats():
+    """Deadline misses, fallbacks and timing of one robot's control loop.
+
+    Attributes
+    ----------
+    n_cycles : int
+    deadline_misses : int
+        cycles that wrote the actuator after their deadline
+    fallbacks : int
+        cycles that sent the last safe control because the solve overran
+    skipped : int
+        releases skipped because the loop was behind
+    jitter, latency : ArrayHistory
+        release lateness and release to actuation time (s) of the last
+        STATS_WINDOW cycles
+    """
+    def __init__(self, window=STATS_WINDOW):
+        self.n_cycles = 0
+        self.deadline_misses = 0
+        self.fallbacks = 0
+        self.skipped = 0
+        self.jitter = ArrayHistory(maxlen=window)
+        self.latency = ArrayHistory(maxlen=window)
+
+    def summary(self):
+        """Counts, and mean / percentile / max jitter and latency in us."""
+        summ = {"n_cycles": self.n_cycles, "deadline_misses": self.deadline_misses,
+                "fallbacks": self.fallbacks, "skipped": self.skipped}
+        for name in ("jitter", "latency"):
+            us = np.asarray(getattr(self, name)) * 1e6
+            if not us.size:
+                continue
+            summ[name + "_mean_us"] = float(us.mean())
+            for q, v in zip(SUMMARY_PERCENTILES, np.percentile(us, SUMMARY_PERCENTILES)):
+                summ["%s_p%d_us" % (name, q)] = float(v)
+            summ[name + "_max_us"] = float(us.max())
+        return summ
+
+
+class RealTimeRuntime():
+    """Fixed-rate asyncio control loops for a list of Robot_Sim.
+
+    Parameters
+    ----------
+    robots : list of Robot_Sim
+    sensor, actuator : endpoints
+        see StubSensor / StubActuator for the interface
+    rate : float or array_like
+        control rate (Hz), one for all robots or one per robot
+    solve_budget : float, optional
+        fraction of the period the safe control QP may take before the
+        last safe control is sent instead; None solves inline, no fallback
+    """
+    def __init__(self, robots, sensor, actuator, rate=CONTROL_RATE, solve_budget=None):
+        self.robots = robots
+        self.sensor = sensor
+        self.actuator = actuator
+        self.periods = 1.0 / np.broadcast_to(np.asarray(rate, dtype=np.double), (len(robots),))
+        self.solve_budget = solve_budget
+        self.stats = [DeadlineStats() for _ in robots]
+        self.last_u = [np.zeros(3) for _ in robots]  # last safe acceleration sent
+        self._pending = [None] * len(robots)  # running solve of each robot
+        self._executor = None
+        self._stop = False
+
+    def stop(self):
+        """Stop all loops after their current cycle."""
+        self._stop = True
+
+    def summary(self):
+        """Per-robot DeadlineStats.summary, and totals over robots."""
+        robots = [stats.summary() for stats in self.stats]
+        totals = {key: sum(row[key] for row in robots) for key in ("n_cycles", "deadline_misses", "fallbacks",
+                                                                    "skipped")}
+        if any("jitter_max_us" in row for row in robots):
+            totals["jitter_max_us"] = max(row.get("jitter_max_us", 0) for row in robots)
+        return {"robots": robots, "total": totals}
+
+    def _solve(self, robot, reading):
+        """Safe acceleration (3, ) from a sensor reading. ECBF_control computes
+        from the reading's state, not the live one the actuator steps."""
+        robot.ecbf.state = reading["state"]
+        u = robot.ecbf.compute_safe_control(reading["obs"], reading["obs_v"], robot.id)
+        return np.ndarray.flatten(np.array(np.vstack((u, np.zeros((1, 1))))))
+
+    async def _safe_control(self, i, reading, timeout):
+        """Safe acceleration of robot i, or its last one if the solve does not finish in timeout (s)."""
+        robot = self.robots[i]
+        if self._executor is None:
+            self.last_u[i] = self._solve(robot, reading)
+            return self.last_u[i], False
+        if self._pending[i] is None:
+            self._pending[i] = asyncio.wrap_future(self._executor.submit(self._solve, robot, reading))
+        done, _ = await asyncio.wait([self._pending[i]], timeout=max(timeout, 0))
+        if not done:
+            return self.last_u[i], True
+        future, self._pending[i] = self._pending[i], None
+        self.last_u[i] = future.result()
+        return self.last_u[i], False
+
+    async def _robot_loop(self, i, n_cycles=None, t0=None):
+        loop = asyncio.get_running_loop()
+        robot, stats, period = self.robots[i], self.stats[i], self.periods[i]
+        t0 = loop.time() if t0 is None else t0
+        k = 0
+        while not self._stop and (n_cycles is None or stats.n_cycles < n_cycles):
+            release = t0 + k * period
+            await asyncio.sleep(max(release - loop.time(), 0))
+            start = loop.time()
+            stats.jitter.append(start - release)
+
+            reading = await self.sensor.read(robot)
+            budget = period if self.solve_budget is None else self.solve_budget * period
+            u_hat_acc, fallback = await self._safe_control(i, reading, release + budget - loop.time())
+            with profiling.section("go_to_acceleration"):
+                u_motor = go_to_acceleration(robot.state, u_hat_acc, robot.dyn.param_dict)
+            await self.actuator.write(robot, u_motor)
+
+            end = loop.time()
+            stats.latency.append(end - release)
+            stats.n_cycles += 1
+            if fallback:
+                stats.fallbacks += 1
+                profiling.count("rt.fallbacks")
+            if end > release + period:
+                stats.deadline_misses += 1
+                profiling.count("rt.deadline_misses")
+            # next release not already past
+            next_k = max(k + 1, math.ceil((end - t0) / period))
+            stats.skipped += next_k - k - 1
+            k = next_k
+
+    async def run(self, duration=None, n_cycles=None):
+        """Run every robot's loop for duration (s) or n_cycles cycles (or
+        until stop()). Returns summary()."""
+        self._stop = False
+        if self.solve_budget is not None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.robots))
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        tasks = [asyncio.ensure_future(self._robot_loop(i, n_cycles, t0)) for i in range(len(self.robots))]
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.wait(tasks, timeout=duration)
+                self.stop()
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            self._pending = [None] * len(self.robots)
+            for robot in self.robots:
+                robot.ecbf.state = robot.state
+        return self.summary()
+
+    def run_sync(self, duration=None, n_cycles=None):
+        """run() in a new event loop."""
+        return asyncio.run(self.run(duration, n_cycles))
+
+
+def main():
+    from monte_carlo import sample_scenario, SCENARIO_RANGES
+
+    parser = argparse.ArgumentParser(description="Run a random scenario with fixed-rate control loops.")
+    parser.add_argument("--robots", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=CONTROL_RATE, help="control rate (Hz)")
+    parser.add_argument("--duration", type=float, default=5.0, help="wall-clock run time (s)")
+    parser.add_argument("--solve-budget", type=float, default=None,
+                        help="fraction of the period the QP may take before the last safe control is reused")
+    parser.add_argument("--sensor-latency", type=float, default=0, help="simulated sensor latency (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scenario = sample_scenario(args.seed, dict(SCENARIO_RANGES, n_robots=(args.robots, args.robots)))
+    robots = [ecbf_control.Robot_Sim(np.array([start[0], start[1], 10.0]), goal.reshape(2, 1), i, hist_maxlen=1)
+              for i, (start, goal) in enumerate(zip(scenario["starts"], scenario["goals"]))]
+    obs = scenario["obs"] if scenario["obs"].shape[0] else []
+    runtime = RealTimeRuntime(robots, StubSensor(robots, obs, latency=args.sensor_latency), StubActuator(),
+                              args.rate, args.solve_budget)
+    # robots print crash / infeasibility messages
+    with contextlib.redirect_stdout(io.StringIO()):
+        summ = runtime.run_sync(args.duration)
+    print("%5s %8s %8s %9s %8s %12s %12s %12s" % ("robot", "cycles", "missed", "fallback", "skipped",
+                                                  "jitter_p99", "latency_p50", "latency_max"))
+    for i, row in enumerate(summ["robots"]):
+        print("%5d %8d %8d %9d %8d %10.0fus %10.0fus %10.0fus" % (i, row["n_cycles"], row["deadline_misses"],
+              row["fallbacks"], row["skipped"], row.get("jitter_p99_us", np.nan), row.get("latency_p50_us", np.nan),
+              row.get("latency_max_us", np.nan)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""recorder.py
+Stream per-tick, per-robot simulation records to disk.
+
+A recording is a directory with one .npy file per column, every column
+indexed by tick first:
+
+* tick : (T, ) int64
+* state : (T, N, 12) float64, robot states after the tick (see dynamics.STATE_SLICES)
+* u_nom, u_safe : (T, N, 2) / (T, N, 3) float64, nominal and safe acceleration
+* h : (T, N, max_obs) float64, barrier value of each obstacle seen, NaN padded
+* qp_status : (T, N) int8, see QP_STATUS_CODES
+* crashed : (T, ) bool
+* goals.npy, obs.npy and meta.json describe the run
+
+Records are buffered in chunks of chunk_size ticks and appended to the
+.npy files, whose fixed-size header is rewritten with the new length after
+every chunk. Memory use does not grow with the run length, and the files are
+valid (and readable with np.load(..., mmap_mode="r")) while the run goes on.
+
+    with TrajectoryRecorder("run", n_robots=5, max_obs=6) as rec:
+        sim = Simulation(robots, obs, recorder=rec)
+        sim.run(20000)
+    data = load_recording("run")  # memory mapped
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from dynamics import STATE_DIM
+from qp_solver import QP_OPTIMAL, QP_INFEASIBLE
+
+NPY_HEADER_SIZE = 256  # bytes, multiple of 64, leaves room for any shape
+RECORD_CHUNK = 1024  # ticks buffered before writing
+QP_STATUS_CODES = {None: 0, QP_OPTIMAL: 1, QP_INFEASIBLE: 2}  # None: no QP solved (nominal control)
+
+
+def _npy_header(dtype, shape):
+    """.npy (version 1.0) header padded to NPY_HEADER_SIZE bytes."""
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                   "shape": tuple(shape)})
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return np.lib.format.MAGIC_PREFIX + bytes([1, 0]) + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class NpyAppender():
+    """.npy file of shape (n, *item_shape) that grows along the first axis.
+
+    Parameters
+    ----------
+    path : str
+    item_shape : tuple
+    dtype : np.dtype
+    """
+    def __init__(self, path, item_shape=(), dtype=np.double):
+        self.path = path
+        self.item_shape = tuple(item_shape)
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self._file = open(path, "wb")
+        self._file.write(_npy_header(self.dtype, (0,) + self.item_shape))
+
+    def append(self, items):
+        """Append items (n, *item_shape) and update the header."""
+        items = np.ascontiguousarray(items, dtype=self.dtype)
+        if items.shape[1:] != self.item_shape:
+            raise ValueError("items of shape %s, expected (n, %s)" % (items.shape, self.item_shape))
+        self._file.write(items.tobytes())
+        self.length += items.shape[0]
+        self._file.seek(0)
+        self._file.write(_npy_header(self.dtype, (self.length,) + self.item_shape))
+        self._file.seek(0, os.SEEK_END)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class TrajectoryRecorder():
+    """Streams records of a multi-robot run into a recording directory.
+
+    Parameters
+    ----------
+    path : str
+        directory, created if needed
+    n_robots : int
+    max_obs : int
+        obstacles per robot kept in h, at most n_robots - 1 + number of static obstacles
+    chunk_size : int
+        ticks buffered in memory before writing
+    goals, obs : np.ndarray, optional
+        robot goals (N, 2) and static obstacles (n_obs, 2), saved with the recording
+    meta : dict, optional
+        extra entries for meta.json
+    """
+    def __init__(self, path, n_robots, max_obs, chunk_size=RECORD_CHUNK, goals=None, obs=None, meta=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.n_robots = n_robots
+        self.max_obs = max_obs
+        self.chunk_size = chunk_size
+        n = n_robots
+        self.columns = {
+            "tick": ((), np.int64),
+            "state": ((n, STATE_DIM), np.double),
+            "u_nom": ((n, 2), np.double),
+            "u_safe": ((n, 3), np.double),
+            "h": ((n, max_obs), np.double),
+            "qp_status": ((n,), np.int8),
+            "crashed": ((), bool),
+        }
+        self._files = {name: NpyAppender(os.path.join(path, name + ".npy"), shape, dtype)
+                       for name, (shape, dtype) in self.columns.items()}
+        self._chunk = {name: np.zeros((chunk_size,) + shape, dtype=dtype)
+                       for name, (shape, dtype) in self.columns.items()}
+        self._n_buffered = 0
+        self.n_ticks = 0
+
+        if goals is not None:
+            np.save(os.path.join(path, "goals.npy"), np.asarray(goals, dtype=np.double).reshape(n, 2))
+        if obs is not None:
+            np.save(os.path.join(path, "obs.npy"), np.asarray(obs, dtype=np.double).reshape(-1, 2))
+        info = {"n_robots": n_robots, "max_obs": max_obs, "chunk_size": chunk_size,
+                "qp_status_codes": {str(k): v for k, v in QP_STATUS_CODES.items()}}
+        info.update(meta or {})
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(info, f, indent=2)
+
+    def append(self, tick, state, u_nom, u_safe, h, qp_status, crashed=False):
+        """Record one tick.
+
+        Parameters
+        ----------
+        tick : int
+        state : (N, 12) np.ndarray
+        u_nom : (N, 2) np.ndarray
+        u_safe : (N, 3) np.ndarray
+        h : list of N array_like
+            barrier values of each robot's obstacles, padded / cut to max_obs
+        qp_status : list of N QP status (None, QP_OPTIMAL or QP_INFEASIBLE)
+        crashed : bool
+        """
+        i = self._n_buffered
+        c = self._chunk
+        c["tick"][i] = tick
+        c["state"][i] = state
+        c["u_nom"][i] = u_nom
+        c["u_safe"][i] = u_safe
+        row = c["h"][i]
+        row[:] = np.nan
+        for r, h_r in enumerate(h):
+            h_r = np.ravel(h_r)[:self.max_obs]
+            row[r, :h_r.size] = h_r
+        c["qp_status"][i] = [QP_STATUS_CODES[s] for s in qp_status]
+        c["crashed"][i] = crashed
+        self._n_buffered += 1
+        self.n_ticks += 1
+        if self._n_buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered ticks."""
+        if self._n_buffered:
+            for name, f in self._files.items():
+                f.append(self._chunk[name][:self._n_buffered])
+            self._n_buffered = 0
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def load_recording(path, mmap=True):
+    """Columns of a recording as a dict of np.ndarray (read-only memory maps
+    if mmap), plus "goals" / "obs" if saved and "meta"."""
+    data = {}
+    for name in os.listdir(path):
+        if name.endswith(".npy"):
+            data[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="r" if mmap else None)
+    with open(os.path.join(path, "meta.json")) as f:
+        data["meta"] = json.load(f)
+    return data
@@ -0,0 +1,331 @@
+"""sim_runner.py
+Run multi-robot ECBF simulations with or without rendering.
+
+The simulation loop (update_obstacles -> robot_step for every robot) is in
+Simulation and never touches matplotlib. Runs are recorded into a Trajectory,
+which Renderer can draw live every few ticks or replay after a headless run.
+
+`python sim_runner.py traj.npz` replays a trajectory saved by a headless run,
+e.g. `python test.py --headless --save traj.npz`. Simulations can also be
+checkpointed (see checkpoint.py) and continued from a checkpoint, e.g.
+`python sim_runner.py --resume ckpt/tick_00014000.npz --steps 500`.
+"""
+
+import argparse
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+import ecbf_control
+import profiling
+from dynamics import state_to_array, dt
+from recorder import TrajectoryRecorder, RECORD_CHUNK
+from checkpoint import (CHECKPOINT_VERSION, CHECKPOINT_EVERY, CHECKPOINT_NAME, save_checkpoint, load_checkpoint,
+                        rng_state, set_rng_state)
+from sim_utils import ArrayHistory
+
+
+def obstacles_to_array(obstacles):
+    """Convert update_obstacles() output to (2, n_obs) obs and obs_v arrays."""
+    if not len(obstacles["obs"]):
+        return np.zeros((2, 0)), np.zeros((2, 0))
+    return (np.hstack(obstacles["obs"]).astype(np.double),
+            np.hstack(obstacles["obs_v"]).astype(np.double))
+
+
+class Trajectory():
+    """Recorded run: robot positions, controls and crash flag at every tick.
+
+    Records are kept in ArrayHistory buffers, so appending is O(1) and
+    slicing returns views. pos has one more entry than the per-tick records,
+    pos[0] is the initial position and pos[t + 1] the position after tick t.
+    Record t is simulation tick start_tick + t (runs restored from a checkpoint
+    start recording at the checkpoint's tick).
+    """
+    def __init__(self, goals, obs=[], start_tick=0):
+        self.goals = np.asarray(goals, dtype=np.double).reshape(-1, 2)
+        self.obs = np.asarray(obs, dtype=np.double).reshape(-1, 2)
+        self.start_tick = start_tick
+        n = self.n_robots
+        self.pos = ArrayHistory((n, 3))
+        self.u_safe = ArrayHistory((n, 3))
+        self.u_nom = ArrayHistory((n, 2))
+        self.crashed = ArrayHistory(dtype=bool)
+
+    def __len__(self):
+        return len(self.u_safe)
+
+    @property
+    def n_robots(self):
+        return self.goals.shape[0]
+
+    def frame_obstacles(self, t, robot_idx):
+        """Obstacles seen by a robot at tick t: other robots, then static obstacles.
+        Noise added during the run is not recorded."""
+        pos = self.pos[t][:, :2]
+        others = np.delete(pos, robot_idx, axis=0)
+        return np.vstack((others, self.obs)).T
+
+    def save(self, path):
+        np.savez_compressed(path, goals=self.goals, obs=self.obs, pos=self.pos.data,
+                            u_safe=self.u_safe.data, u_nom=self.u_nom.data,
+                            crashed=self.crashed.data, start_tick=self.start_tick)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        traj = cls(data["goals"], data["obs"], int(data["start_tick"]) if "start_tick" in data.files else 0)
+        traj.pos = ArrayHistory.from_array(data["pos"])
+        traj.u_safe = ArrayHistory.from_array(data["u_safe"])
+        traj.u_nom = ArrayHistory.from_array(data["u_nom"])
+        traj.crashed = ArrayHistory.from_array(data["crashed"])
+        return traj
+
+
+class Simulation():
+    """Multi-robot ECBF simulation loop, as in exercises.py / test.py, without plotting.
+
+    Parameters
+    ----------
+    robots : list of Robot_Sim
+    obs : (n_obs, 2) np.ndarray or []
+        static obstacles
+    noisy : bool or float
+        add noise to sensed robot positions, see Robot_Sim.update_obstacles
+    sensing_radius : float, optional
+        if set, robots only see neighbours in this radius (uses a spatial index)
+    record : bool
+        record the run into self.trajectory (in memory)
+    recorder : recorder.TrajectoryRecorder, optional
+        stream per-tick records to disk, see start_recording
+
+    checkpoint() captures everything the following ticks depend on, and
+    restore() continues from it bit for bit; start_checkpoints writes one
+    every few ticks.
+    """
+    def __init__(self, robots, obs=[], noisy=False, sensing_radius=None, record=True, recorder=None):
+        self.robots = robots
+        self.obs = obs
+        self.noisy = noisy
+        self.sensing_radius = sensing_radius
+        self.tick = 0
+        self.trajectory = None
+        self.recorder = recorder
+        self.checkpoint_dir = None
+        self.checkpoint_every = CHECKPOINT_EVERY
+        if record:
+            self._start_trajectory()
+
+    def _start_trajectory(self):
+        self.trajectory = Trajectory([robot.goal for robot in self.robots], self.obs, self.tick)
+        self.trajectory.pos.append(self.positions())
+
+    def positions(self):
+        return np.array([robot.state["x"] for robot in self.robots], dtype=np.double)
+
+    def states(self):
+        return np.array([state_to_array(robot.state) for robot in self.robots])
+
+    def start_recording(self, path, chunk_size=RECORD_CHUNK):
+        """Stream the following ticks to the recording directory path."""
+        n_obs = np.asarray(self.obs).reshape(-1, 2).shape[0]
+        self.recorder = TrajectoryRecorder(path, len(self.robots), len(self.robots) - 1 + n_obs, chunk_size,
+                                           goals=[robot.goal for robot in self.robots], obs=self.obs,
+                                           meta={"dt": dt, "start_tick": self.tick, "noisy": float(self.noisy)})
+        return self.recorder
+
+    def stop_recording(self):
+        """Write out and close the recorder, if any."""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def checkpoint(self):
+        """Full simulation state as a dict of arrays and plain values, see checkpoint.py.
+
+        Includes the tick, obstacles and sensing options, the crash flag, the
+        global np.random state (robot noise source by default) and every
+        robot's Robot_Sim.checkpoint. Recorded histories are not included.
+        """
+        return {"version": CHECKPOINT_VERSION, "tick": self.tick, "obs": np.asarray(self.obs, dtype=np.double),
+                "noisy": self.noisy, "sensing_radius": self.sensing_radius, "is_crash": ecbf_control.is_crash,
+                "rng": rng_state(np.random), "robots": [robot.checkpoint() for robot in self.robots]}
+
+    def restore(self, ckpt):
+        """Continue from a checkpoint of a simulation of the same robots. The
+        trajectory, if recorded, restarts at the checkpoint's tick."""
+        if len(ckpt["robots"]) != len(self.robots):
+            raise ValueError("checkpoint of %d robots, simulation has %d" % (len(ckpt["robots"]), len(self.robots)))
+        for robot, robot_ckpt in zip(self.robots, ckpt["robots"]):
+            robot.restore(robot_ckpt)
+        self.tick = ckpt["tick"]
+        self.obs = ckpt["obs"] if len(ckpt["obs"]) else []
+        self.noisy = ckpt["noisy"]
+        self.sensing_radius = ckpt["sensing_radius"]
+        ecbf_control.is_crash = ckpt["is_crash"]
+        set_rng_state(np.random, ckpt["rng"])
+        if self.trajectory is not None:
+            self._start_trajectory()
+
+    @classmethod
+    def from_checkpoint(cls, ckpt, record=True):
+        """New simulation restored from a checkpoint, without the script that built it.
+        Without record, robots only keep their last position."""
+        hist_maxlen = None if record else 1
+        robots = [ecbf_control.Robot_Sim.from_checkpoint(robot_ckpt, hist_maxlen) for robot_ckpt in ckpt["robots"]]
+        sim = cls(robots, record=False)
+        sim.restore(ckpt)
+        if record:
+            sim._start_trajectory()
+        return sim
+
+    def start_checkpoints(self, directory, every=CHECKPOINT_EVERY):
+        """Write a checkpoint to directory now and after every tick that is a
+        multiple of every, named CHECKPOINT_NAME % tick."""
+        os.makedirs(directory, exist_ok=True)
+        self.checkpoint_dir = directory
+        self.checkpoint_every = every
+        self.save_checkpoint()
+
+    def save_checkpoint(self, path=None):
+        """Write a checkpoint of the current tick, to checkpoint_dir by default."""
+        if path is None:
+            path = os.path.join(self.checkpoint_dir, CHECKPOINT_NAME % self.tick)
+        with profiling.section("checkpoint"):
+            save_checkpoint(path, self.checkpoint())
+        return path
+
+    @profiling.timed("tick")
+    def step(self):
+        """Advance all robots by one tick. Returns the obstacles each robot saw
+        as (2, n_obs) arrays and the safe accelerations (N, 3)."""
+        index = None
+        if self.sensing_radius is not None:
+            index = ecbf_control.build_obstacle_index(self.robots, self.obs, self.sensing_radius)
+        obstacles = [obstacles_to_array(robot.update_obstacles(self.robots, self.obs, noisy=self.noisy, index=index))
+                     for robot in self.robots]
+
+        u_hat_acc = np.array([robot.robot_step(obs, obs_v)
+                              for robot, (obs, obs_v) in zip(self.robots, obstacles)])
+
+        traj = self.trajectory
+        if traj is not None:
+            traj.pos.append(self.positions())
+            traj.u_safe.append(u_hat_acc)
+            traj.u_nom.append(np.array([robot.ecbf.u_nom.ravel() for robot in self.robots]))
+            traj.crashed.append(ecbf_control.is_crash)
+        if self.recorder is not None:
+            self.recorder.append(self.tick, self.states(), [robot.ecbf.u_nom.ravel() for robot in self.robots],
+                                 u_hat_acc, [robot.ecbf.h for robot in self.robots],
+                                 [robot.ecbf.qp_status for robot in self.robots], ecbf_control.is_crash)
+        self.tick += 1
+        if self.checkpoint_dir is not None and self.tick % self.checkpoint_every == 0:
+            self.save_checkpoint()
+        return [obs for obs, _ in obstacles], u_hat_acc
+
+    def run(self, n_steps, renderer=None, render_every=10):
+        """Run n_steps ticks. If a renderer is given, draw every render_every ticks,
+        which needs the recorded trajectory (record=True)."""
+        if renderer is not None and self.trajectory is None:
+            raise ValueError("rendering needs the recorded trajectory, create the Simulation with record=True")
+        for _ in range(n_steps):
+            tt = self.tick
+            frame_obs = self.step()[0]
+            if renderer is not None and tt % render_every == 0:
+                print(tt)
+                renderer.draw(self.trajectory, tt - self.trajectory.start_tick, frame_obs, noisy=bool(self.noisy))
+        return self.trajectory
+
+
+class Renderer():
+    """Draws recorded frames of a Trajectory with matplotlib, live or as replay.
+
+    The safety field is kept in an ecbf_control.SafetyField over field_range
+    (x and y) at field_res spacing, drawn from the recorded robot positions,
+    and only updated around robots that moved between frames. Live frames of a
+    noisy run instead average compute_plot_z over the obstacles each robot
+    sensed, so the field shows the sensing noise the controllers saw; replays
+    only have the recorded positions.
+    """
+    def __init__(self, ax=None, pause=0.00000001, field_range=ecbf_control.PLOT_RANGE,
+                 field_res=ecbf_control.PLOT_RES):
+        if ax is None:
+            _, ax = plt.subplots()
+        self.ax = ax
+        self.pause = pause
+        self.field_range = field_range
+        self.field_res = field_res
+        self.field = None
+        self._field_traj = None
+
+    def safety_field(self, traj, t):
+        """SafetyField of traj at tick t, reusing the one of the last drawn frame."""
+        if self._field_traj is not traj:
+            self.field = ecbf_control.SafetyField(traj.obs, self.field_range, self.field_range, self.field_res)
+            self._field_traj = traj
+        self.field.update(traj.pos[t])
+        return self.field
+
+    @profiling.timed("render")
+    def draw(self, traj, t, frame_obs=None, noisy=False):
+        """Draw tick t. frame_obs, the (2, n_obs) obstacles of each robot, are
+        reconstructed from the trajectory if not given. If noisy, the given
+        frame_obs were sensed with noise and the field is computed from them."""
+        plt.cla()
+        sensed = noisy and frame_obs is not None
+        if frame_obs is None:
+            frame_obs = [traj.frame_obstacles(t, i) for i in range(traj.n_robots)]
+        for i in range(traj.n_robots):
+            ecbf_control.plot_robot(i, traj.pos[:t + 2, i], traj.goals[i], traj.u_safe[t][i], traj.u_nom[t][i],
+                                    frame_obs[i], self.ax, crashed=traj.crashed[t])
+        if sensed:
+            z = 0
+            for obs in frame_obs:
+                p = ecbf_control.compute_plot_z(obs, self.field_range, self.field_range, self.field_res)
+                z = z + p["z"]
+            ecbf_control.plot_h(p["x"], p["y"], z / len(frame_obs), pause=None)
+        else:
+            self.safety_field(traj, t).plot()
+        if self.pause:
+            plt.pause(self.pause)
+
+    def replay(self, traj, every=10):
+        for t in range(0, len(traj), every):
+            self.draw(traj, t)
+
+
+def parse_args():
+    """Command line options shared by the example scripts."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true", help="run without rendering")
+    parser.add_argument("--steps", type=int, default=20000, help="number of ticks")
+    parser.add_argument("--render-every", type=int, default=10, help="ticks between rendered frames")
+    parser.add_argument("--save", default=None, help="save trajectory to .npz for replay")
+    parser.add_argument("--record", default=None, help="stream per-tick records to this directory (see recorder.py)")
+    parser.add_argument("--checkpoint", default=None, help="write checkpoints to this directory (see checkpoint.py)")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="ticks between checkpoints")
+    parser.add_argument("--resume", default=None, help="continue from this checkpoint (.npz)")
+    args = parser.parse_args()
+    if args.headless and args.record and args.save:
+        parser.error("headless runs with --record are not kept in memory, use --record or --save")
+    return args
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a saved trajectory, or continue a run from a checkpoint.")
+    parser.add_argument("trajectory", nargs="?", help=".npz file saved with --save")
+    parser.add_argument("--every", type=int, default=10, help="ticks between frames")
+    parser.add_argument("--resume", default=None, help="checkpoint (.npz) to continue from instead")
+    parser.add_argument("--steps", type=int, default=1000, help="ticks to run from the checkpoint")
+    parser.add_argument("--headless", action="store_true", help="run from the checkpoint without rendering")
+    args = parser.parse_args()
+    if args.resume:
+        sim = Simulation.from_checkpoint(load_checkpoint(args.resume), record=not args.headless)
+        sim.run(args.steps, renderer=None if args.headless else Renderer(), render_every=args.every)
+    elif args.trajectory:
+        Renderer().replay(Trajectory.load(args.trajectory), args.every)
+    else:
+        parser.error("give a trajectory or --resume")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,3 +14,144 @@ def get_rot_matrix(angles):
                             cpsi, cphi * sthe * spsi - sphi * cpsi],
                         [-sthe,       cthe * sphi,                      cthe * cphi]])
     return rot_mat
+
+
+def get_rot_matrix_batch(angles):
+    """Vectorized get_rot_matrix. Takes (N, 3) roll, pitch, yaw and returns (N, 3, 3)."""
+    angles = np.asarray(angles, dtype=np.double)
+    cphi, cthe, cpsi = np.cos(angles).T
+    sphi, sthe, spsi = np.sin(angles).T
+
+    rot_mat = np.empty((angles.shape[0], 3, 3))
+    rot_mat[:, 0, 0] = cthe * cpsi
+    rot_mat[:, 0, 1] = sphi * sthe * cpsi - cphi * spsi
+    rot_mat[:, 0, 2] = cphi * sthe * cpsi + sphi * spsi
+    rot_mat[:, 1, 0] = cthe * spsi
+    rot_mat[:, 1, 1] = sphi * sthe * spsi + cphi * cpsi
+    rot_mat[:, 1, 2] = cphi * sthe * spsi - sphi * cpsi
+    rot_mat[:, 2, 0] = -sthe
+    rot_mat[:, 2, 1] = cthe * sphi
+    rot_mat[:, 2, 2] = cthe * cphi
+    return rot_mat
+
+
+def euler_to_quat(angles):
+    """Unit quaternions (N, 4) [w, x, y, z] from (N, 3) roll, pitch, yaw,
+    same z-y-x convention as get_rot_matrix."""
+    half = 0.5 * np.asarray(angles, dtype=np.double)
+    cr, cp, cy = np.cos(half).T
+    sr, sp, sy = np.sin(half).T
+    return np.stack((cr * cp * cy + sr * sp * sy,
+                     sr * cp * cy - cr * sp * sy,
+                     cr * sp * cy + sr * cp * sy,
+                     cr * cp * sy - sr * sp * cy), axis=1)
+
+
+def quat_to_euler(q):
+    """Roll, pitch, yaw (N, 3) from unit quaternions (N, 4). Inverse of euler_to_quat."""
+    w, x, y, z = q.T
+    return np.stack((np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y)),
+                     np.arcsin(np.clip(2 * (w * y - z * x), -1, 1)),
+                     np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))), axis=1)
+
+
+def quat_to_rot_matrix(q):
+    """Rotation matrices (N, 3, 3) from unit quaternions (N, 4), no trigonometry."""
+    w, x, y, z = q.T
+    rot_mat = np.empty((q.shape[0], 3, 3))
+    rot_mat[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    rot_mat[:, 0, 1] = 2 * (x * y - w * z)
+    rot_mat[:, 0, 2] = 2 * (x * z + w * y)
+    rot_mat[:, 1, 0] = 2 * (x * y + w * z)
+    rot_mat[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    rot_mat[:, 1, 2] = 2 * (y * z - w * x)
+    rot_mat[:, 2, 0] = 2 * (x * z - w * y)
+    rot_mat[:, 2, 1] = 2 * (y * z + w * x)
+    rot_mat[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return rot_mat
+
+
+def quat_multiply(q, r):
+    """Hamilton products q * r of (N, 4) quaternions."""
+    w1, x1, y1, z1 = q.T
+    w2, x2, y2, z2 = r.T
+    return np.stack((w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2), axis=1)
+
+
+class ArrayHistory():
+    """Growable array of fixed-shape records with amortized O(1) append.
+
+    Records are stored in one preallocated np.ndarray (which may have a
+    structured dtype). `data` returns a view of the recorded part without
+    copying; a view taken before the buffer grows keeps pointing at the
+    old buffer.
+
+    With maxlen set, acts as a ring buffer that keeps the last maxlen records
+    with bounded memory. Every record is written twice, to slot i and
+    i + maxlen, so the last maxlen records are always one contiguous view.
+    """
+    def __init__(self, item_shape=(), dtype=np.double, capacity=64, maxlen=None):
+        if maxlen is not None and maxlen < 1:
+            raise ValueError("maxlen must be None or at least 1, got %r" % (maxlen,))
+        self.item_shape = tuple(item_shape)
+        self.maxlen = maxlen
+        if maxlen is not None:
+            capacity = 2 * maxlen
+        self._buf = np.zeros((max(capacity, 1),) + self.item_shape, dtype=dtype)
+        self._count = 0  # total records appended
+
+    @classmethod
+    def from_array(cls, arr, maxlen=None):
+        arr = np.asarray(arr)
+        hist = cls(arr.shape[1:], arr.dtype, capacity=2 * arr.shape[0], maxlen=maxlen)
+        if maxlen is None:
+            hist._buf[:arr.shape[0]] = arr
+            hist._count = arr.shape[0]
+        else:
+            for item in arr[-maxlen:]:
+                hist.append(item)
+        return hist
+
+    def append(self, item):
+        if self.maxlen is None:
+            if self._count == self._buf.shape[0]:
+                new_buf = np.zeros((2 * self._buf.shape[0],) + self.item_shape, dtype=self._buf.dtype)
+                new_buf[:self._count] = self._buf
+                self._buf = new_buf
+            self._buf[self._count] = item
+        else:
+            i = self._count % self.maxlen
+            self._buf[i] = item
+            self._buf[i + self.maxlen] = item
+        self._count += 1
+
+    @property
+    def data(self):
+        """View of recorded records, oldest first."""
+        if self.maxlen is None:
+            return self._buf[:self._count]
+        n = min(self._count, self.maxlen)
+        start = (self._count - n) % self.maxlen
+        return self._buf[start:start + n]
+
+    @property
+    def n_appended(self):
+        """Total records appended, including ones dropped by the ring buffer."""
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self.maxlen) if self.maxlen is not None else self._count
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.data
+        return self.data.astype(dtype)
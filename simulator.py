@@ -5,29 +5,53 @@ Simulator
 
 """
 
+import argparse
+import os
+import struct
 import numpy as np
 import matplotlib.pyplot as plt
 import math
 import random
 from bresenham import bresenham
-from dynamics import QuadDynamics
+from dynamics import QuadDynamics, QuadState
 from dynamics import basic_input
 from controller import *
 
 MAX_RANGE = 1000
 DISPSCALE = 5
 SAFE_RANGE = 30
+OCC_THRESH = 0.99  # map cells above this are obstacles
+RAY_CHUNK = 32  # cells traced per beam in the first DDA iteration
+RAY_CHUNK_GROWTH = 4  # chunk growth per iteration for beams without a hit yet
+RAY_NEVER = 1e12  # crossing parameter for axes a beam is parallel to
+SPHERE_MIN_STEP = 1.0  # sphere tracing steps shorter than this (cells) switch to DDA
+
+# Binary map format (.map), little endian:
+#   header (MAP_HEADER_SIZE bytes): magic, version, height, width, flags
+#   occupancy: uint8 (height, width), 0 / 1, rows as in Map.map (already flipped)
+#   if flags & MAP_HAS_DIST: dist float32 (height, width), then nearest int32 (height, width, 2)
+# Sections start at multiples of MAP_ALIGN bytes.
+MAP_EXT = ".map"
+MAP_MAGIC = b"ECBFMAP\0"
+MAP_VERSION = 1
+MAP_HEADER = "<8sIIII"
+MAP_HEADER_SIZE = 32
+MAP_ALIGN = 8
+MAP_HAS_DIST = 1
+
+# Loaded maps by (absolute path, mtime), shared by every Map in the process
+_map_cache = {}
 
 class Robot():
-    def __init__(self, map1, lidar=None, pos_cont=None, use_safe=True):
-        self.state = {"x": np.array([50, 10, 10]),
-                      "xdot": np.zeros(3,),
-                      "theta": np.radians(np.array([0, 0, 0])),  # ! hardcoded
-                      "thetadot": np.radians(np.array([0, 0, 0]))
-                      }
+    def __init__(self, map1, lidar=None, pos_cont=None, use_safe=True, dynamics=None):
+        self.state = QuadState(x=np.array([50, 10, 10]),
+                               xdot=np.zeros(3,),
+                               theta=np.radians(np.array([0, 0, 0])),  # ! hardcoded
+                               thetadot=np.radians(np.array([0, 0, 0])))
         self.x = self.state["x"][0]
         self.y = self.state["x"][1]
-        self.dynamics = QuadDynamics()
+        # QuadDynamics or BatchQuadDynamics, both provide step_dynamics()
+        self.dynamics = QuadDynamics() if dynamics is None else dynamics
         self.hist_x = []
         self.hist_y = [] 
         self.map = map1
@@ -71,7 +95,7 @@ class Robot():
         """Moves robot and updates sensor readings"""
 
         self.lidar.update_reading((self.x, self.y), self.state["theta"][2])
-        self.pos_cont.calc_control(self.use_safe)
+        self.pos_cont.calc_control(self.use_safe, (self.x, self.y))
         self.move()
         
         
@@ -79,13 +103,81 @@ class Robot():
 
 class Map():
     def __init__(self, src_path_map):
-        self.map = np.flipud(np.genfromtxt(src_path_map))
+        # text .dat or binary .map, see load_map. Arrays are read-only and
+        # shared with other Maps of the same file
+        data = load_map(src_path_map)
+        self.map = data["map"]
         self.width = self.map.shape[1] #TODO: check
         self.height = self.map.shape[0]
+        self.occupied = data["occupied"]
         self.max_dist = math.sqrt(self.width**2 + self.height**2)
+        # distance (cells) from every cell to the nearest occupied cell, and that cell (x, y)
+        self.dist, self.nearest = data["dist"], data["nearest"]
         print("Finished reading map of width " + 
             str(self.width) + "and height " + str(self.height))
 
+    def nearest_obstacle(self, pos):
+        """Nearest occupied cell to pos, from the precomputed distance field.
+
+        Parameters
+        ----------
+        pos : (2,) or (N, 2) array-like
+            positions in map coordinates, clipped to the map
+
+        Returns
+        -------
+        dict
+            points : (2,) or (N, 2) np.ndarray, nearest occupied cell coordinates (x, y)
+            dist : float or (N,) np.ndarray, distance from pos to that cell
+        """
+        pos = np.asarray(pos, dtype=np.double)
+        cx = np.clip(np.floor(pos[..., 0]).astype(int), 0, self.width - 1)
+        cy = np.clip(np.floor(pos[..., 1]).astype(int), 0, self.height - 1)
+        points = self.nearest[cy, cx]
+        return {"points": points, "dist": np.linalg.norm(points - pos[..., :2], axis=-1)}
+
+    def sphere_trace(self, pos, angles, min_step=SPHERE_MIN_STEP):
+        """Cast beams by sphere tracing the distance field: each beam jumps by
+        the free distance around its current cell. Same output as
+        LidarSimulator.cast_rays.
+
+        A jump of d - sqrt(2), d the distance of the current cell to the
+        nearest occupied cell, cannot reach an occupied cell. Once that is less
+        than min_step cells, the beam is near an obstacle and is finished from
+        its current point by the exact DDA traversal (trace_grid). Beams stop
+        without a hit when they leave the map; pos should be inside the map.
+        """
+        pos = np.asarray(pos, dtype=np.double)[:2]
+        angles = np.atleast_1d(np.asarray(angles, dtype=np.double))
+        n_beams = angles.shape[0]
+        direction = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+
+        t = np.zeros(n_beams)
+        points = np.full((n_beams, 2), np.nan)
+        hit = np.zeros(n_beams, dtype=bool)
+        near = np.zeros(n_beams, dtype=bool)  # beams to finish by DDA
+        active = np.arange(n_beams)
+        while active.size:
+            p = pos + t[active, np.newaxis] * direction[active]
+            cx = np.floor(p[:, 0]).astype(int)
+            cy = np.floor(p[:, 1]).astype(int)
+            inside = (cx >= 0) & (cx < self.width) & (cy >= 0) & (cy < self.height)
+            active, cx, cy = active[inside], cx[inside], cy[inside]
+            jump = self.dist[cy, cx] - np.sqrt(2)
+            short = jump < min_step
+            near[active[short]] = True
+            # an infinite jump: the map has no occupied cell
+            far = ~short & np.isfinite(jump)
+            active = active[far]
+            t[active] += jump[far]
+
+        if near.any():
+            origin = pos + t[near, np.newaxis] * direction[near]
+            hit[near], points[near] = trace_grid(self.occupied, origin, direction[near])
+        ranges = np.full(n_beams, np.inf)
+        ranges[hit] = np.linalg.norm(points[hit] - pos, axis=1)
+        return {"hit": hit, "points": points, "ranges": ranges}
+
     def visualize_map(self):
         # x = np.arange(0, self.height)
         # y = np.arange(0, self.width)
@@ -99,17 +191,19 @@ class Map():
 
 
 class PositionController():
-    def __init__(self, lidar):
+    def __init__(self, lidar, use_distance_field=False):
         self.u_x = 0
         self.u_y = 0
         self.og_control = (0,0)
         self.safe_control = (0,0)
         self.lidar = lidar
+        # take the nearest obstacle from the map distance field instead of the lidar beams
+        self.use_distance_field = use_distance_field
 
-    def calc_control(self, use_safe):
+    def calc_control(self, use_safe, pos=None):
         self.calc_original_control()
         if use_safe:
-            self.calc_safe_control()
+            self.calc_safe_control(pos)
         self.u_x = self.og_control[0] + self.safe_control[0]
         self.u_y = self.og_control[1] + self.safe_control[1]
 
@@ -121,14 +215,21 @@ class PositionController():
         self.og_control = (og_ux, og_uy)
         return (og_ux, og_uy)
 
-    def calc_safe_control(self):
+    def calc_safe_control(self, pos=None):
         # Naive: choose minimum distance and push away. should have equilibrium point when at stopping limit
         # min_angle_ind = np.argmin(self.lidar.ranges)
         # self.lidar.reset_unsafe_range()
         # self.lidar.unsafe_range[min_angle_ind] = 1
 
-        min_angle_ind = np.argmin(self.lidar.ranges)
-        min_range = np.min(self.lidar.ranges)
+        if self.use_distance_field and pos is not None:
+            # nearest obstacle in any direction, mark the beam closest to it
+            nearest = self.lidar.map.nearest_obstacle(pos[:2])
+            min_range = nearest["dist"]
+            obs_angle = math.atan2(nearest["points"][1] - pos[1], nearest["points"][0] - pos[0])
+            min_angle_ind = np.argmin(np.abs(np.angle(np.exp(1j * (self.lidar.angles - obs_angle)))))
+        else:
+            min_angle_ind = np.argmin(self.lidar.ranges)
+            min_range = np.min(self.lidar.ranges)
         self.lidar.reset_unsafe_range()
         
         if min_range < SAFE_RANGE:
@@ -136,7 +237,10 @@ class PositionController():
             self.lidar.unsafe_range[min_angle_ind] = 1
 
             # Push away
-            unsafe_angle = self.lidar.angles[min_angle_ind]
+            if self.use_distance_field and pos is not None:
+                unsafe_angle = obs_angle
+            else:
+                unsafe_angle = self.lidar.angles[min_angle_ind]
 
             # TODO: cast to int
             safe_ux = int((SAFE_RANGE - min_range)//10 * np.cos(unsafe_angle + np.pi))
@@ -167,10 +271,12 @@ class PositionController():
         plt.legend()
 
 class LidarSimulator():
-    def __init__(self, map1, angles=np.array(range(10)) * 33): 
+    def __init__(self, map1, angles=np.array(range(10)) * 33, use_distance_field=False): 
         self.range_noise = 0.0
         self.angles = angles * np.pi/180. # list in deg
         self.map = map1 #TODO: move to robot?
+        # cast beams by sphere tracing the map distance field instead of DDA
+        self.use_distance_field = use_distance_field
         self.sensed_obs = None 
         self.ranges = None
         self.unsafe_range = np.zeros_like(self.angles)
@@ -187,12 +293,48 @@ class LidarSimulator():
 
     def update_reading(self, pos, cur_yaw):
         """Update sensed obstacle locations and ranges."""
-        closest_obs = [self.get_closest_obstacle(
-            pos, angle + cur_yaw) for angle in self.angles]
-        self.sensed_obs = np.array(closest_obs)
+        angles = self.angles + cur_yaw
+        if self.use_distance_field:
+            rays = self.map.sphere_trace(pos, angles)
+        else:
+            rays = self.cast_rays(pos, angles)
+        # beams without a hit keep the MAX_RANGE point of get_closest_obstacle
+        no_hit = MAX_RANGE * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+        self.sensed_obs = np.where(rays["hit"][:, np.newaxis], rays["points"], no_hit)
 
         self.ranges = self.get_ranges(pos)
 
+    def cast_rays(self, pos, angles, chunk=RAY_CHUNK):
+        """Trace all beams at once through the map grid and stop each at its first hit.
+
+        Uses DDA (grid traversal) stepping: every cell a beam passes through is
+        visited in order, see trace_grid. The cost depends on the distance to
+        the hit rather than on map.max_dist.
+
+        Parameters
+        ----------
+        pos : (2,) array-like
+            beam origin in map coordinates, cell (i, j) covers [i, i+1) x [j, j+1)
+        angles : (n_beams,) np.ndarray
+            beam angles (rad)
+        chunk : int
+            cells traced per beam in the first iteration, grows by RAY_CHUNK_GROWTH after each
+
+        Returns
+        -------
+        dict
+            hit : (n_beams,) bool, whether the beam hit an obstacle
+            points : (n_beams, 2) np.ndarray, hit cell coordinates (NaN if no hit)
+            ranges : (n_beams,) np.ndarray, distance from pos to hit point (inf if no hit)
+        """
+        pos = np.asarray(pos, dtype=np.double)[:2]
+        angles = np.atleast_1d(np.asarray(angles, dtype=np.double))
+        direction = np.stack((np.cos(angles), np.sin(angles)), axis=1)
+        hit, points = trace_grid(self.map.occupied, pos, direction, chunk)
+        ranges = np.full(angles.shape[0], np.inf)
+        ranges[hit] = np.linalg.norm(points[hit] - pos, axis=1)
+        return {"hit": hit, "points": points, "ranges": ranges}
+
     def get_ranges(self, pos):
         """Get ranges given sensed obstacles"""
 
@@ -206,7 +348,8 @@ class LidarSimulator():
 
         
     def get_closest_obstacle(self, pos, angle):
-        """"Get closest obs position given angle. Gives in map coordinate (NEU)."""
+        """"Get closest obs position given angle. Gives in map coordinate (NEU).
+        Traces a single beam with bresenham, see cast_rays for all beams at once."""
         end_point_x = int(round(self.map.max_dist * np.cos(angle) + pos[0]))
         end_point_y = int(round(self.map.max_dist * np.sin(angle) + pos[1]))
         end_point = (end_point_x, end_point_y)
@@ -218,9 +361,8 @@ class LidarSimulator():
         along_line_pts = np.array(along_line_pts)
         # plt.plot(along_line_pts[:,0], along_line_pts[:,1], '.')
         if along_line_pts.size > 0:
-            along_line_occ = self.map.map[along_line_pts[:,1], along_line_pts[:,0]]
-            # TODO: change to binary
-            closest_obs_coord = along_line_pts[np.where(along_line_occ > 0.99)]
+            along_line_occ = self.map.occupied[along_line_pts[:,1], along_line_pts[:,0]]
+            closest_obs_coord = along_line_pts[np.where(along_line_occ)]
             if len(closest_obs_coord) == 0: # no obstacles
                 # TODO: make into constant
                 return [MAX_RANGE * np.cos(angle), MAX_RANGE * np.sin(angle)]
@@ -249,6 +391,253 @@ class LidarSimulator():
                  np.vstack((unsafe_obs[:, 1], np.ones(len(unsafe_obs)) * pos[1])), 'r', linewidth=0.5)
 
 
+def trace_grid(occupied, pos, direction, chunk=RAY_CHUNK):
+    """First occupied cell along each beam, by DDA (grid traversal) stepping.
+
+    Every cell a beam passes through is visited in order, starting with the
+    cell of its origin. Beams are advanced a chunk of cells at a time and
+    dropped once they hit an obstacle or leave the grid.
+
+    Parameters
+    ----------
+    occupied : (H, W) bool np.ndarray
+    pos : (2,) or (n_beams, 2) np.ndarray
+        beam origins, cell (i, j) covers [i, i+1) x [j, j+1)
+    direction : (n_beams, 2) np.ndarray
+        unit beam directions
+    chunk : int
+        cells traced per beam in the first iteration, grows by RAY_CHUNK_GROWTH after each
+
+    Returns
+    -------
+    hit : (n_beams,) bool np.ndarray
+    points : (n_beams, 2) np.ndarray
+        hit cell coordinates (x, y), NaN if no hit
+    """
+    n_beams = direction.shape[0]
+    height, width = occupied.shape
+    pos = np.broadcast_to(pos, (n_beams, 2))
+
+    cell0 = np.floor(pos).astype(int)
+    step = np.where(direction > 0, 1, -1)
+    # an axis the beam is parallel to is never crossed, RAY_NEVER keeps the arithmetic finite
+    moving = direction != 0
+    t_delta = np.full((n_beams, 2), RAY_NEVER)
+    t_delta[moving] = 1 / np.abs(direction[moving])
+    # ray parameter of the first cell boundary crossing on each axis
+    frac = pos - cell0
+    t_next = np.where(moving, np.where(direction > 0, 1 - frac, frac) * t_delta, RAY_NEVER)
+    n_steps = np.zeros((n_beams, 2), dtype=int)
+    # beams whose cell moves away from the grid on an axis once past its edge
+    low_out = direction <= 0
+    high_out = direction >= 0
+
+    points = np.full((n_beams, 2), np.nan)
+    hit = np.zeros(n_beams, dtype=bool)
+    if not n_beams:
+        return hit, points
+    # crossing the grid takes at most width + height steps once inside
+    max_cells = width + height + np.abs(cell0).sum(axis=1).max() + 2
+    active = np.arange(n_beams)
+    traced = 0
+    while active.size and traced < max_cells:
+        n_active = active.size
+        j = np.arange(chunk)
+        t_a, td_a = t_next[active], t_delta[active]
+        # next chunk boundary crossings of both axes, keep the first chunk in ray order
+        crossings = np.concatenate((t_a[:, 0:1] + j * td_a[:, 0:1],
+                                    t_a[:, 1:2] + j * td_a[:, 1:2]), axis=1)
+        is_y = np.argsort(crossings, axis=1, kind="stable")[:, :chunk] >= chunk
+        # y / x crossings before each visited cell: current cell, then the cell after each crossing
+        n_y = np.cumsum(is_y, axis=1)
+        before_y = n_y - is_y
+        cx = cell0[active, 0:1] + step[active, 0:1] * (n_steps[active, 0:1] + j - before_y)
+        cy = cell0[active, 1:2] + step[active, 1:2] * (n_steps[active, 1:2] + before_y)
+        cx_in = np.clip(cx, 0, width - 1)
+        cy_in = np.clip(cy, 0, height - 1)
+        cell_hit = occupied[cy_in, cx_in] & (cx_in == cx) & (cy_in == cy)
+
+        has_hit = cell_hit.any(axis=1)
+        if has_hit.any():
+            first = np.argmax(cell_hit[has_hit], axis=1)
+            hit[active[has_hit]] = True
+            points[active[has_hit], 0] = cx[has_hit, first]
+            points[active[has_hit], 1] = cy[has_hit, first]
+
+        # advance past this chunk of crossings
+        advance = np.empty((n_active, 2), dtype=int)
+        advance[:, 1] = n_y[:, -1]
+        advance[:, 0] = chunk - advance[:, 1]
+        n_steps[active] += advance
+        t_next[active] = t_a + advance * td_a
+
+        # drop beams that hit, or are outside the grid and moving away from it
+        cur = cell0[active] + step[active] * n_steps[active]
+        outward = (((cur < 0) & low_out[active]) | ((cur >= (width, height)) & high_out[active])).any(axis=1)
+        active = active[~has_hit & ~outward]
+        traced += chunk
+        chunk *= RAY_CHUNK_GROWTH
+    return hit, points
+
+
+def distance_transform(occupied):
+    """Exact Euclidean distance transform of an occupancy grid, in O(H W).
+
+    Separable: a column pass finds the nearest occupied cell in each column,
+    then a row pass takes, for every cell, the lower envelope of the parabolas
+    (x - x')^2 + col_dist_sq(x', y) of its row (Felzenszwalb & Huttenlocher,
+    "Distance Transforms of Sampled Functions"). The row pass steps through
+    the columns and is vectorized over rows.
+
+    Parameters
+    ----------
+    occupied : (H, W) bool np.ndarray
+
+    Returns
+    -------
+    dist : (H, W) np.ndarray
+        distance (cells) to the nearest occupied cell, 0 on occupied cells,
+        inf if the grid has none
+    nearest : (H, W, 2) np.ndarray
+        (x, y) of that cell, -1 if the grid has none
+    """
+    height, width = occupied.shape
+    dist = np.full((height, width), np.inf)
+    nearest = np.full((height, width, 2), -1, dtype=int)
+    if not occupied.any():
+        return dist, nearest
+
+    # column pass: nearest occupied row above / below in each column
+    rows = np.broadcast_to(np.arange(height, dtype=np.double)[:, np.newaxis], (height, width))
+    below = np.maximum.accumulate(np.where(occupied, rows, -np.inf), axis=0)
+    above = np.minimum.accumulate(np.where(occupied, rows, np.inf)[::-1], axis=0)[::-1]
+    col_row = np.where(rows - below <= above - rows, below, above)
+    f = np.square(col_row - rows)  # inf in columns without an occupied cell
+
+    # row pass, lower envelope of each row: parabola k has its vertex at
+    # column v[:, k] and is lowest over [z[:, k], z[:, k + 1])
+    v = np.zeros((height, width), dtype=int)
+    z = np.full((height, width + 1), np.inf)
+    k = np.full(height, -1)  # last parabola of each row's envelope, -1 if none yet
+    for q in range(width):
+        r = np.flatnonzero(np.isfinite(f[:, q]))
+        fq = f[r, q] + q * q
+        s = np.full(r.size, -np.inf)
+        # drop the envelope's last parabolas while the new one is lower from where they start
+        pend = np.flatnonzero(k[r] >= 0)
+        while pend.size:
+            rr = r[pend]
+            vk = v[rr, k[rr]]
+            s[pend] = (fq[pend] - (f[rr, vk] + vk * vk)) / (2 * (q - vk))
+            drop = s[pend] <= z[rr, k[rr]]
+            pend = pend[drop]
+            k[r[pend]] -= 1
+        k[r] += 1
+        v[r, k[r]] = q
+        z[r, k[r]] = s
+        z[r, k[r] + 1] = np.inf
+
+    # read the envelope at every column
+    rows_set = np.flatnonzero(k >= 0)
+    j = np.zeros(rows_set.size, dtype=int)
+    for x in range(width):
+        pend = np.flatnonzero(z[rows_set, j + 1] < x)
+        while pend.size:
+            j[pend] += 1
+            pend = pend[z[rows_set[pend], j[pend] + 1] < x]
+        vx = v[rows_set, j]
+        dist[rows_set, x] = np.sqrt((x - vx) ** 2 + f[rows_set, vx])
+        nearest[rows_set, x, 0] = vx
+        nearest[rows_set, x, 1] = col_row[rows_set, vx]
+    return dist, nearest
+
+
+def load_map(path):
+    """Load a map file, through the process-wide cache.
+
+    Binary .map files are memory-mapped read-only, so all Maps and processes
+    loading the same file share its pages. Other files are parsed as the
+    whitespace text format with np.genfromtxt. The cache is keyed by absolute
+    path and modification time, so an updated file is reloaded.
+
+    Returns
+    -------
+    dict
+        map : (H, W) np.ndarray, cell values, row 0 at the bottom
+        occupied : (H, W) bool np.ndarray
+        dist, nearest : distance field, see distance_transform
+    """
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    if key not in _map_cache:
+        if os.path.splitext(path)[1] == MAP_EXT:
+            data = read_binary_map(path)
+        else:
+            grid = np.flipud(np.genfromtxt(path))
+            occupied = grid > OCC_THRESH
+            dist, nearest = distance_transform(occupied)
+            data = {"map": grid, "occupied": occupied, "dist": dist, "nearest": nearest}
+            for arr in data.values():
+                arr.flags.writeable = False
+        _map_cache[key] = data
+    return _map_cache[key]
+
+
+def _align(offset):
+    return -(-offset // MAP_ALIGN) * MAP_ALIGN
+
+
+def write_binary_map(path, grid, with_dist=True):
+    """Write an occupancy grid (rows as in Map.map) in the binary .map format.
+    Cells must be 0 or 1. with_dist also stores the distance field, so loading
+    does not recompute it."""
+    grid = np.asarray(grid)
+    if not np.isin(grid, (0, 1)).all():
+        raise ValueError("binary map format only stores 0 / 1 occupancy")
+    height, width = grid.shape
+    flags = MAP_HAS_DIST if with_dist else 0
+    with open(path, "wb") as f:
+        f.write(struct.pack(MAP_HEADER, MAP_MAGIC, MAP_VERSION, height, width, flags).ljust(MAP_HEADER_SIZE, b"\0"))
+        sections = [grid.astype(np.uint8)]
+        if with_dist:
+            dist, nearest = distance_transform(grid > OCC_THRESH)
+            sections += [dist.astype(np.float32), nearest.astype(np.int32)]
+        for arr in sections:
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(np.ascontiguousarray(arr).astype(arr.dtype.newbyteorder("<")).tobytes())
+
+
+def read_binary_map(path):
+    """Memory-map a binary .map file read-only. Returns a dict as load_map."""
+    with open(path, "rb") as f:
+        header = f.read(MAP_HEADER_SIZE)
+    magic, version, height, width, flags = struct.unpack_from(MAP_HEADER, header)
+    if magic != MAP_MAGIC or version != MAP_VERSION:
+        raise ValueError("%s is not a version %d binary map" % (path, MAP_VERSION))
+
+    offset = MAP_HEADER_SIZE
+    grid = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, width))
+    occupied = grid.view(bool)
+    if flags & MAP_HAS_DIST:
+        offset = _align(offset + grid.nbytes)
+        dist = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(height, width))
+        offset = _align(offset + dist.nbytes)
+        nearest = np.memmap(path, dtype="<i4", mode="r", offset=offset, shape=(height, width, 2))
+    else:
+        dist, nearest = distance_transform(occupied)
+        dist.flags.writeable = False
+        nearest.flags.writeable = False
+    return {"map": grid, "occupied": occupied, "dist": dist, "nearest": nearest}
+
+
+def convert_map(src_path, dst_path=None, with_dist=True):
+    """One-time conversion of a text .dat map to the binary format.
+    Writes next to the source with the .map extension by default."""
+    if dst_path is None:
+        dst_path = os.path.splitext(src_path)[0] + MAP_EXT
+    write_binary_map(dst_path, np.flipud(np.genfromtxt(src_path)), with_dist)
+    return dst_path
+
+
 def calc_dist(p1, p2):
     return math.sqrt((p2[0]-p1[0])**2 + (p2[1]-p1[1])**2)
 
@@ -256,6 +645,15 @@ def calc_dist(p1, p2):
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--convert", nargs="+", default=[], metavar="DAT",
+                        help="convert text .dat maps to the binary .map format")
+    parser.add_argument("--no-dist", action="store_true",
+                        help="do not store the distance field in converted maps (smaller files)")
+    args = parser.parse_args()
+    for src in args.convert:
+        print("Wrote " + convert_map(src, with_dist=not args.no_dist))
+
     print("start!!")
 
     print("done!!")
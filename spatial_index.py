@@ -0,0 +1,91 @@
+"""spatial_index.py
+Uniform grid spatial index for fixed-radius neighbour queries in 2D.
+
+Points are bucketed into square cells and sorted by cell, so finding the
+neighbours of a point only looks at the cells overlapping its query radius.
+Rebuilding the grid is O(N log N), cheap enough to do every tick.
+"""
+
+import numpy as np
+
+_CELL_OFFSET = 2**30  # shifts cell coordinates to be non-negative
+_CELL_STRIDE = 2**31
+
+
+class SpatialGrid():
+    """Uniform grid over a set of 2D points.
+
+    Parameters
+    ----------
+    points : (P, 2) np.ndarray
+        points to index
+    cell_size : float
+        side length of grid cells, best set to the typical query radius
+    """
+    def __init__(self, points, cell_size):
+        self.cell_size = float(cell_size)
+        self.points = np.asarray(points, dtype=np.double).reshape(-1, 2)
+        keys = self._cell_key(self._cell(self.points))
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def _cell(self, points):
+        return np.floor(points / self.cell_size).astype(np.int64)
+
+    def _cell_key(self, cells):
+        return (cells[..., 0] + _CELL_OFFSET) * _CELL_STRIDE + (cells[..., 1] + _CELL_OFFSET)
+
+    def _cell_offsets(self, radius):
+        n = int(np.ceil(radius / self.cell_size))
+        d = np.arange(-n, n + 1)
+        dx, dy = np.meshgrid(d, d, indexing="ij")
+        return np.stack((dx.ravel(), dy.ravel()), axis=1)
+
+    def query_radius(self, point, radius):
+        """Indices of points within radius (exclusive) of point, in increasing order."""
+        point = np.asarray(point, dtype=np.double).reshape(2)
+        _, j = self._candidates(point[np.newaxis, :], radius)
+        dist = np.linalg.norm(self.points[j] - point, axis=1)
+        return np.sort(j[dist < radius])
+
+    def query_pairs(self, radius, query_idx=None):
+        """All (query, neighbour) pairs closer than radius, excluding self pairs.
+
+        Parameters
+        ----------
+        radius : float
+        query_idx : (Q, ) np.ndarray, optional
+            indices of points to query neighbours for, defaults to all points
+
+        Returns
+        -------
+        i, j : (n_pairs, ) np.ndarray
+            indices of query point and neighbour, sorted by i then j
+        dist : (n_pairs, ) np.ndarray
+        """
+        if query_idx is None:
+            query_idx = np.arange(len(self))
+        query_idx = np.asarray(query_idx, dtype=np.int64)
+        qi, j = self._candidates(self.points[query_idx], radius)
+        i = query_idx[qi]
+        dist = np.linalg.norm(self.points[j] - self.points[i], axis=1)
+        keep = (dist < radius) & (i != j)
+        i, j, dist = i[keep], j[keep], dist[keep]
+        order = np.lexsort((j, i))
+        return i[order], j[order], dist[order]
+
+    def _candidates(self, query, radius):
+        """Points in cells overlapping radius of each query point, as flat (query, point) pairs."""
+        keys = self._cell_key(self._cell(query)[:, np.newaxis, :] + self._cell_offsets(radius))
+        lo = np.searchsorted(self.sorted_keys, keys, side="left").ravel()
+        hi = np.searchsorted(self.sorted_keys, keys, side="right").ravel()
+        count = hi - lo
+        total = np.sum(count)
+
+        # Expand each [lo, hi) range into positions of the sorted point list
+        qi = np.repeat(np.arange(query.shape[0]).repeat(keys.shape[1]), count)
+        start = np.repeat(lo - (np.cumsum(count) - count), count)
+        return qi, self.order[start + np.arange(total)]
@@ -0,0 +1,9 @@
+import os
+import sys
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+# The modules are flat files at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
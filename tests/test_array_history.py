@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from sim_utils import ArrayHistory
+
+
+@pytest.mark.parametrize("maxlen", [0, -1])
+def test_invalid_maxlen(maxlen):
+    with pytest.raises(ValueError):
+        ArrayHistory((2,), maxlen=maxlen)
+
+
+def test_ring_buffer_keeps_last_records():
+    hist = ArrayHistory((2,), maxlen=3)
+    for i in range(5):
+        hist.append([i, -i])
+    assert len(hist) == 3 and hist.n_appended == 5
+    assert np.array_equal(hist.data, [[2, -2], [3, -3], [4, -4]])
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from barrier import Superellipse, pairwise
+from ecbf_control import h_func
+
+EPS = 1e-5
+SHAPES = [(1, 1, 4), (0.7, 1.8, 4), (1.5, 0.5, 2), (1.2, 0.9, 6)]
+
+
+def baseline_quartic(rel_r, rd, K, a, b, safety_dist):
+    """h, hd, A, b of one pair as the original ECBF loop computed them."""
+    h = rel_r[0] ** 4 / a ** 4 + rel_r[1] ** 4 / b ** 4 - safety_dist
+    hd = 4 * rel_r[0] ** 3 * rd[0] / a ** 4 + 4 * rel_r[1] ** 3 * rd[1] / b ** 4
+    A = np.array([-4 * rel_r[0] ** 3 / a ** 4, -4 * rel_r[1] ** 3 / b ** 4])
+    extra = -(12 * rel_r[0] ** 2 * rd[0] ** 2 / a ** 4 + 12 * rel_r[1] ** 2 * rd[1] ** 2 / b ** 4)
+    return h, hd, A, -(extra - (K[0] * h + K[1] * hd))
+
+
+def central_difference(f, rel_r):
+    """df/dr (..., 2, ...) of f at rel_r (..., 2) by central differences."""
+    cols = []
+    for k in range(2):
+        step = np.zeros(2)
+        step[k] = EPS
+        cols.append((f(rel_r + step) - f(rel_r - step)) / (2 * EPS))
+    return np.stack(cols, axis=-1)
+
+
+@pytest.mark.parametrize("a, b, exponent", SHAPES)
+def test_derivatives_match_finite_differences(a, b, exponent):
+    barrier = Superellipse(a, b, exponent)
+    rel_r = np.random.default_rng(0).uniform(-2, 2, (40, 2))
+    grad = central_difference(lambda r: barrier.h(r, 0.8), rel_r)
+    np.testing.assert_allclose(barrier.grad(rel_r), grad, rtol=1e-6, atol=1e-6)
+    hess = central_difference(barrier.grad, rel_r)
+    np.testing.assert_allclose(barrier.hessian(rel_r), hess, rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(barrier.hessian_diag(rel_r), np.diagonal(barrier.hessian(rel_r), axis1=-2, axis2=-1))
+
+    # hd and the constraint follow h along r(t) = rel_r + t rd under acceleration u
+    rd = np.random.default_rng(1).uniform(-1, 1, (40, 2))
+    u = np.random.default_rng(2).uniform(-1, 1, (40, 2))
+    h_t = lambda t: barrier.h(rel_r + t * rd + t ** 2 / 2 * u, 0.8)
+    np.testing.assert_allclose(barrier.hd(rel_r, rd), (h_t(EPS) - h_t(-EPS)) / (2 * EPS), rtol=1e-6, atol=1e-6)
+    K = np.array([6.0, 8.0])
+    c = barrier.constraints(rel_r, rd, K, 0.8)
+    hdd = (h_t(EPS) - 2 * h_t(0) + h_t(-EPS)) / EPS ** 2
+    # A u <= b  <=>  hdd + K[0] h + K[1] hd >= 0
+    np.testing.assert_allclose(c["b"] - np.sum(c["A"] * u, axis=-1), hdd + K[0] * c["h"] + K[1] * c["hd"],
+                               rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("a, b", [(1, 1), (0.7, 1.8)])
+def test_quartic_matches_original_formulas(a, b):
+    rng = np.random.default_rng(3)
+    barrier = Superellipse(a, b)
+    rel_r, rd = rng.uniform(-3, 3, (50, 2)), rng.uniform(-1, 1, (50, 2))
+    K = np.array([6.0, 8.0])
+    c = barrier.constraints(rel_r, rd, K, 1.3)
+    for i in range(50):
+        h, hd, A, b_ineq = baseline_quartic(rel_r[i], rd[i], K, a, b, 1.3)
+        np.testing.assert_allclose([c["h"][i], c["hd"][i], c["b"][i]], [h, hd, b_ineq], rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(c["A"][i], A, rtol=1e-12, atol=1e-12)
+        assert barrier.h(rel_r[i], 1.3) == pytest.approx(h, rel=1e-12, abs=1e-12)
+        assert h_func(rel_r[i, 0], rel_r[i, 1], a, b, 1.3) == pytest.approx(h, rel=1e-12, abs=1e-12)
+
+
+def test_pairwise_constraints_match_per_pair():
+    rng = np.random.default_rng(4)
+    barrier = Superellipse(0.8, 1.2)
+    pos, vel = rng.uniform(-5, 5, (6, 2)), rng.uniform(-1, 1, (6, 2))
+    obs, obs_v = rng.uniform(-5, 5, (9, 2)), rng.uniform(-1, 1, (9, 2))
+    assert pairwise(pos, obs).shape == (6, 9, 2)
+    for K in (np.array([6.0, 8.0]), rng.uniform(1, 10, (6, 2))):
+        c = barrier.pairwise_constraints(pos, vel, obs, obs_v, K, 1.1)
+        assert c["h"].shape == c["hd"].shape == c["b"].shape == (6, 9) and c["A"].shape == (6, 9, 2)
+        for i in range(6):
+            K_i = K if K.ndim == 1 else K[i]
+            for j in range(9):
+                expected = barrier.constraints(pos[i] - obs[j], vel[i] - obs_v[j], K_i, 1.1)
+                for key in ("h", "hd", "A", "b"):
+                    np.testing.assert_allclose(c[key][i, j], expected[key], rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("exponent", [2, 4, 6])
+def test_constraints_into_buffers(exponent):
+    rng = np.random.default_rng(5)
+    barrier = Superellipse(0.9, 1.1, exponent)
+    buf = barrier.constraint_buffers((4, 7))
+    K = rng.uniform(1, 10, (4, 1, 2))
+    for _ in range(3):
+        rel_r, rd = rng.uniform(-3, 3, (4, 7, 2)), rng.uniform(-1, 1, (4, 7, 2))
+        c = barrier.constraints(rel_r, rd, K, 1.0, out=buf)
+        expected = barrier.constraints(rel_r, rd, K, 1.0)
+        for key in ("h", "hd", "A", "b"):
+            assert c[key] is buf[key]
+            assert np.array_equal(c[key], expected[key])
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import ecbf_control
+from checkpoint import CHECKPOINT_NAME, find_checkpoint, list_checkpoints, load_checkpoint, save_checkpoint
+from dynamics import QuadDynamics
+from sim_runner import Simulation
+
+OBS = np.array([[2.0, 2.0], [-2.0, -2.0]])
+STARTS = [(3, -5), (-5, 3), (0, 5)]
+GOALS = [(-6, 4), (4, -6), (0, -5)]
+
+
+@pytest.fixture(autouse=True)
+def quiet_sim(monkeypatch, capsys):
+    """Reset the global crash flag; robots print crash and infeasibility messages."""
+    monkeypatch.setattr(ecbf_control, "is_crash", False)
+
+
+def build(integrator="euler", noisy=False, generator=False):
+    robots = [ecbf_control.Robot_Sim(np.array([x, y, 10.0]), np.array([[gx], [gy]]), i, dyn=QuadDynamics(integrator))
+              for i, ((x, y), (gx, gy)) in enumerate(zip(STARTS, GOALS))]
+    if generator:
+        for robot in robots:
+            robot.rng = np.random.default_rng(robot.id)
+    return Simulation(robots, OBS, noisy=noisy, record=False)
+
+
+@pytest.mark.parametrize("integrator,noisy,generator", [
+    ("euler", False, False),
+    ("euler", 0.3, False),
+    ("quaternion", 0.3, True),
+    ("rk45", 0.3, True),
+])
+def test_resume_is_bitwise(tmp_path, integrator, noisy, generator):
+    np.random.seed(0)
+    sim = build(integrator, noisy, generator)
+    sim.run(150)
+    path = sim.save_checkpoint(str(tmp_path / "ckpt.npz"))
+    sim.run(150)
+
+    np.random.seed(99)  # restore must override the global RNG state
+    resumed = build(integrator, noisy, generator)
+    resumed.restore(load_checkpoint(path))
+    assert resumed.tick == 150
+    resumed.run(150)
+    assert np.array_equal(resumed.states(), sim.states())
+
+    rebuilt = Simulation.from_checkpoint(load_checkpoint(path), record=False)
+    rebuilt.run(150)
+    assert np.array_equal(rebuilt.states(), sim.states())
+
+
+def test_save_load_round_trip(tmp_path):
+    sim = build(noisy=0.3, generator=True)
+    sim.run(20)
+    ckpt = sim.checkpoint()
+    save_checkpoint(str(tmp_path / "ckpt.npz"), ckpt)
+    loaded = load_checkpoint(str(tmp_path / "ckpt.npz"))
+
+    def assert_same(a, b):
+        if isinstance(a, np.ndarray):
+            assert np.array_equal(np.asarray(b), a) and np.asarray(b).dtype == a.dtype
+        elif isinstance(a, dict):
+            assert set(map(str, a)) == set(b)
+            for key, value in a.items():
+                assert_same(value, b[str(key)])
+        elif isinstance(a, (list, tuple)):
+            assert len(a) == len(b)
+            for x, y in zip(a, b):
+                assert_same(x, y)
+        else:
+            assert a == b
+
+    assert_same(ckpt, loaded)
+
+
+def test_version_mismatch_raises(tmp_path):
+    ckpt = build().checkpoint()
+    ckpt["version"] += 1
+    save_checkpoint(str(tmp_path / "ckpt.npz"), ckpt)
+    with pytest.raises(ValueError):
+        load_checkpoint(str(tmp_path / "ckpt.npz"))
+
+
+def test_periodic_checkpoints(tmp_path):
+    sim = build()
+    sim.start_checkpoints(str(tmp_path), every=40)
+    sim.run(100)
+    assert [tick for tick, _ in list_checkpoints(str(tmp_path))] == [0, 40, 80]
+    assert find_checkpoint(str(tmp_path), 79).endswith(CHECKPOINT_NAME % 40)
+    assert find_checkpoint(str(tmp_path)).endswith(CHECKPOINT_NAME % 80)
+    with pytest.raises(FileNotFoundError):
+        find_checkpoint(str(tmp_path), -1)
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from controller import (CascadedController, allocation_matrix, angerr2u, dynamic_inversion, dynamic_inversion_batch,
+                        go_to_acceleration, go_to_acceleration_batch, go_to_position, saturate_motors)
+from dynamics import BatchQuadDynamics, QuadDynamics, array_to_state, init_state, param_dict, state_to_array
+
+N_STEPS = 300
+
+
+def baseline_angerr2u(error, tot_thrust, p):
+    """angerr2u as the original closed form computed it."""
+    b, k, L, I = p["b"], p["k"], p["L"], p["I"]
+    e0, e1, e2 = error
+    Ixx, Iyy, Izz = I[0, 0], I[1, 1], I[2, 2]
+    return np.array([tot_thrust / 4 - (2 * b * e0 * Ixx + e2 * Izz * k * L) / (4 * b * k * L),
+                     tot_thrust / 4 + (e2 * Izz) / (4 * b) - (e1 * Iyy) / (2 * k * L),
+                     tot_thrust / 4 + (2 * b * e0 * Ixx - e2 * Izz * k * L) / (4 * b * k * L),
+                     tot_thrust / 4 + (e2 * Izz) / (4 * b) + (e1 * Iyy) / (2 * k * L)])
+
+
+def start_states(n, seed=0):
+    rng = np.random.default_rng(seed)
+    states = np.tile(state_to_array(init_state()), (n, 1))
+    states[:, 0:3] += rng.uniform(-2, 2, (n, 3))
+    states[:, 8] = rng.uniform(-np.pi, np.pi, n)  # yaw
+    return states
+
+
+def test_angerr2u_matches_closed_form():
+    rng = np.random.default_rng(0)
+    error = rng.normal(size=(20, 3))
+    tot = rng.uniform(1e6, 2e6, 20)
+    batch = angerr2u(error, None, tot, param_dict)
+    for i in range(20):
+        expected = baseline_angerr2u(error[i], tot[i], param_dict)
+        np.testing.assert_allclose(angerr2u(error[i], None, tot[i], param_dict), expected, rtol=1e-12)
+        np.testing.assert_allclose(batch[i], expected, rtol=1e-12)
+    assert allocation_matrix(param_dict) is allocation_matrix(dict(param_dict))
+    assert not allocation_matrix(param_dict).flags.writeable
+
+
+def test_dynamic_inversion_batch_matches_scalar():
+    rng = np.random.default_rng(1)
+    des_acc = rng.normal(0, 2, (50, 3))
+    yaw = rng.uniform(-np.pi, np.pi, 50)
+    des_theta, des_thrust_pc = dynamic_inversion_batch(des_acc, yaw, param_dict)
+    for i in range(50):
+        theta, thrust_pc = dynamic_inversion(des_acc[i], {"theta": np.array([0, 0, yaw[i]])}, param_dict)
+        np.testing.assert_allclose(des_theta[i], theta, rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(des_thrust_pc[i], thrust_pc, rtol=1e-12)
+
+
+def test_go_to_acceleration_batch_matches_scalar_closed_loop():
+    n = 4
+    dyn = BatchQuadDynamics(0, param_dict)
+    for state in start_states(n):
+        dyn.add_robot(state)
+    scalar_dyn = QuadDynamics()
+    scalar = [array_to_state(state) for state in start_states(n)]
+    rng = np.random.default_rng(2)
+    for t in range(N_STEPS):
+        des_acc = np.column_stack((rng.normal(0, 0.05, (n, 2)), np.zeros(n)))
+        u = go_to_acceleration_batch(dyn.states, des_acc, param_dict)
+        for i in range(n):
+            u_i = go_to_acceleration(scalar[i], des_acc[i], param_dict)
+            np.testing.assert_allclose(u[i], u_i, rtol=1e-9)
+            scalar[i] = scalar_dyn.step_dynamics(scalar[i], u_i)
+        dyn.step(u)
+    np.testing.assert_allclose(dyn.states, [state_to_array(state) for state in scalar], rtol=1e-8, atol=1e-10)
+
+
+def test_cascaded_controller_matches_go_to_position():
+    # the loop of dynamics.main, for several vehicles with their own targets
+    n = 3
+    des_pos = np.array([[3.0, -3.0, 9.0], [0.0, 0.0, 10.0], [-2.0, 1.0, 11.0]])
+    states = start_states(n, seed=3)
+    controller = CascadedController(param_dict, n)
+    integral_p = [np.zeros(3) for _ in range(n)]
+    integral_v = [np.zeros(3) for _ in range(n)]
+    scalar = [array_to_state(state) for state in states]
+    scalar_dyn, dyn = QuadDynamics(), BatchQuadDynamics(0, param_dict)
+    for state in states:
+        dyn.add_robot(state)
+    for t in range(N_STEPS):
+        if t == N_STEPS // 2:
+            des_pos = des_pos[::-1].copy()
+        u = controller.go_to_position(dyn.states, des_pos)["u"]
+        for i in range(n):
+            u_i = go_to_position(scalar[i], des_pos[i], param_dict, integral_p[i], integral_v[i])
+            scalar[i] = scalar_dyn.step_dynamics(scalar[i], u_i)
+        dyn.step(u)
+        np.testing.assert_allclose(controller.integral_v_err, integral_v, rtol=1e-8, atol=1e-9)
+    np.testing.assert_allclose(controller.integral_p_err, integral_p, rtol=1e-8, atol=1e-9)
+    np.testing.assert_allclose(dyn.states, [state_to_array(state) for state in scalar], rtol=1e-8, atol=1e-9)
+
+
+def test_cascaded_controller_rejects_unknown_gains():
+    with pytest.raises(ValueError):
+        CascadedController(param_dict, 2, P_acc=[1, 1, 1])
+
+
+def test_motor_saturation_is_applied():
+    max_u = param_dict["maxRPM"] ** 2
+    u = np.array([[10 * max_u, -5e5, 4e5, 2 * max_u]])
+    clipped = saturate_motors(u, param_dict)
+    assert np.array_equal(clipped, [[max_u, 0, 4e5, max_u]])
+
+    # thrust is computed from saturated inputs (torques, as in the original dynamics, are not)
+    states = start_states(1)
+    theta, xdot = states[:, 6:9], states[:, 3:6]
+    batch = BatchQuadDynamics(0, param_dict)
+    assert np.array_equal(batch.calc_acc(u, theta, xdot), batch.calc_acc(clipped, theta, xdot))
+    single = QuadDynamics()
+    p = param_dict
+    assert np.array_equal(single.calc_acc(u[0], theta[0], xdot[0], p["m"], p["g"], p["k"], p["kd"]),
+                          single.calc_acc(clipped[0], theta[0], xdot[0], p["m"], p["g"], p["k"], p["kd"]))
+    # one step moves the vehicle by the current, saturated thrust
+    for integrator in ("euler", "quaternion"):
+        stepped = []
+        for inputs in (u, clipped):
+            dyn = BatchQuadDynamics(0, param_dict, integrator)
+            dyn.add_robot(states[0])
+            stepped.append(dyn.step(inputs)[:, 0:6].copy())
+        assert np.array_equal(stepped[0], stepped[1])
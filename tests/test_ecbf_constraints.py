@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import ecbf_control
+from ecbf_control import ECBF_control
+from dynamics import QuadState
+
+
+def make_ecbf(rng):
+    state = QuadState(x=np.append(rng.uniform(-5, 5, 2), 10), xdot=np.append(rng.uniform(-1, 1, 2), 0),
+                      theta=np.zeros(3), thetadot=np.zeros(3))
+    return ECBF_control(state, goal=np.array([[0], [10]]), Kp=6, Kd=8)
+
+
+def baseline_constraints(ecbf, obs, obs_v):
+    """h, hd, A, b as the original per-obstacle loops computed them (quartic barrier)."""
+    a, b, safety_dist = ecbf_control.a, ecbf_control.b, ecbf.safety_dist
+    n = obs.shape[1]
+    h, hd, A, b_ineq = np.zeros((n, 1)), np.zeros((n, 1)), np.zeros((n, 2)), np.zeros((n, 1))
+    for i in range(n):
+        rel_r = ecbf.state["x"][:2] - obs[:, i]
+        rd = ecbf.state["xdot"][:2] - obs_v[:, i]
+        h[i] = rel_r[0] ** 4 / a ** 4 + rel_r[1] ** 4 / b ** 4 - safety_dist
+        hd[i] = 4 * rel_r[0] ** 3 * rd[0] / a ** 4 + 4 * rel_r[1] ** 3 * rd[1] / b ** 4
+        A[i] = -4 * rel_r[0] ** 3 / a ** 4, -4 * rel_r[1] ** 3 / b ** 4
+        extra = -(12 * rel_r[0] ** 2 * rd[0] ** 2 / a ** 4 + 12 * rel_r[1] ** 2 * rd[1] ** 2 / b ** 4)
+        b_ineq[i] = -(extra - (ecbf.K[0] * h[i] + ecbf.K[1] * hd[i]))
+    return h, hd, A, b_ineq
+
+
+@pytest.mark.parametrize("n_obs", [0, 1, 2, 7, 50])
+def test_compute_constraints_matches_per_obstacle_functions(n_obs):
+    rng = np.random.default_rng(n_obs)
+    for _ in range(20):
+        ecbf = make_ecbf(rng)
+        obs = rng.uniform(-6, 6, (2, n_obs))
+        obs_v = rng.uniform(-1, 1, (2, n_obs))
+        h, hd, A, b = ecbf.compute_constraints(obs, obs_v)
+
+        assert h.shape == hd.shape == b.shape == (n_obs, 1)
+        assert A.shape == (n_obs, 2)
+        np.testing.assert_allclose(h, ecbf.compute_h(obs), rtol=1e-12, atol=1e-12)
+        np.testing.assert_allclose(hd, ecbf.compute_hd(obs, obs_v), rtol=1e-12, atol=1e-12)
+        if n_obs:
+            np.testing.assert_allclose(A, np.array(ecbf.compute_A(obs)), rtol=1e-12, atol=1e-12)
+            np.testing.assert_allclose(b, np.array(ecbf.compute_b(obs, obs_v)), rtol=1e-12, atol=1e-12)
+
+        h0, hd0, A0, b0 = baseline_constraints(ecbf, obs, obs_v)
+        for new, old in ((h, h0), (hd, hd0), (A, A0), (b, b0)):
+            np.testing.assert_allclose(new, old, rtol=1e-10, atol=1e-10)
+
+
+def test_compute_constraints_reuses_buffers():
+    rng = np.random.default_rng(11)
+    ecbf = make_ecbf(rng)
+    previous = None
+    for n_obs in (5, 5, 3, 3):
+        obs = rng.uniform(-6, 6, (2, n_obs))
+        obs_v = rng.uniform(-1, 1, (2, n_obs))
+        h, hd, A, b = ecbf.compute_constraints(obs, obs_v)
+        if previous is not None and previous.shape[0] == n_obs:
+            assert np.shares_memory(A, previous)
+        previous = A
+
+        rel_r = ecbf.state["x"][:2] - obs.T
+        rd = ecbf.state["xdot"][:2] - obs_v.T
+        c = ecbf.barrier.constraints(rel_r, rd, ecbf.K, ecbf.safety_dist)
+        for new, ref in ((h, c["h"]), (hd, c["hd"]), (A, c["A"]), (b, c["b"])):
+            assert np.array_equal(new.ravel(), ref.ravel())
+
+
+def test_swarm_pruning_keeps_optimum():
+    rng = np.random.default_rng(3)
+    n = 40
+    states = np.zeros((n, 12))
+    states[:, :2] = rng.uniform(-8, 8, (n, 2))
+    states[:, 3:5] = rng.normal(0, 0.5, (n, 2))
+    goals = rng.uniform(-8, 8, (n, 2))
+    obs = np.broadcast_to(states[:, :2], (n, n, 2))
+    obs_v = np.broadcast_to(states[:, 3:5], (n, n, 2))
+    mask = ~np.eye(n, dtype=bool)
+    u, feasible = ecbf_control.compute_swarm_safe_control(states, goals, obs, obs_v, mask, max_constraints=4)
+    u_full, feasible_full = ecbf_control.compute_swarm_safe_control(states, goals, obs, obs_v, mask,
+                                                                    prune_horizon=None, max_constraints=None)
+    assert np.array_equal(feasible, feasible_full)
+    np.testing.assert_allclose(u, u_full, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from dynamics import INTEGRATORS, BatchQuadDynamics, QuadDynamics, QuadState, param_dict
+
+N_ROBOTS = 5
+DURATION = 0.2  # s
+
+
+def initial_states(rng):
+    states = np.zeros((N_ROBOTS, 12))
+    states[:, 0:3] = rng.normal(size=(N_ROBOTS, 3))
+    states[:, 3:6] = rng.normal(size=(N_ROBOTS, 3))
+    states[:, 6:9] = 0.2 * rng.normal(size=(N_ROBOTS, 3))
+    states[:, 9:12] = 0.5 * rng.normal(size=(N_ROBOTS, 3))
+    return states
+
+
+def hover_inputs(rng):
+    return 408750 * (1 + 0.05 * rng.normal(size=(N_ROBOTS, 4)))
+
+
+def run_batch(states, u, integrator, params=param_dict):
+    dyn = BatchQuadDynamics(0, params, integrator)
+    for state in states:
+        dyn.add_robot(state)
+    for _ in range(int(round(DURATION / params["dt"]))):
+        dyn.step(u)
+    return dyn.states
+
+
+@pytest.mark.parametrize("integrator", INTEGRATORS)
+def test_single_vehicle_matches_batch(integrator):
+    rng = np.random.default_rng(1)
+    states, u = initial_states(rng), hover_inputs(rng)
+    batch = run_batch(states, u, integrator)
+    for i in range(N_ROBOTS):
+        dyn = QuadDynamics(integrator)
+        state = QuadState(data=states[i].copy())
+        for _ in range(int(round(DURATION / param_dict["dt"]))):
+            state = dyn.step_dynamics(state, u[i])
+        # rk45 adapts one substep size to the whole batch
+        np.testing.assert_allclose(state.data, batch[i], rtol=0, atol=1e-6)
+
+
+def test_higher_order_integrators_are_accurate():
+    rng = np.random.default_rng(2)
+    states, u = initial_states(rng), hover_inputs(rng)
+    reference = run_batch(states, u, "rk4", dict(param_dict, dt=param_dict["dt"] / 20))
+    error = {integrator: np.abs(run_batch(states, u, integrator) - reference).max() for integrator in INTEGRATORS}
+    assert error["rk45"] < 1e-5
+    assert error["rk4"] < 1e-3
+    for first_order in ("euler", "semi_implicit", "quaternion"):
+        assert error["rk4"] < error[first_order] / 100
+
+
+def test_unknown_integrator_raises():
+    with pytest.raises(ValueError):
+        QuadDynamics("leapfrog")
+    with pytest.raises(ValueError):
+        BatchQuadDynamics(integrator="leapfrog")
+
+
+def test_single_vehicle_quaternion_uses_batch_kernel():
+    rng = np.random.default_rng(3)
+    states, u = initial_states(rng), hover_inputs(rng)
+    batch = run_batch(states, u, "quaternion")
+    for i in range(N_ROBOTS):
+        dyn = QuadDynamics("quaternion")
+        state = QuadState(data=states[i].copy())
+        for _ in range(int(round(DURATION / param_dict["dt"]))):
+            state = dyn.step_dynamics(state, u[i])
+        assert np.array_equal(state.data, batch[i])
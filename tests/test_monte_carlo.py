@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from monte_carlo import sample_points, sample_scenario, SCENARIO_RANGES
+
+
+def test_sample_points_raises_when_points_do_not_fit():
+    rng = np.random.default_rng(0)
+    with pytest.raises(ValueError):
+        sample_points(rng, 50, arena=1.0, min_sep=1.0)
+
+
+def test_scenario_has_a_goal_per_start():
+    ranges = dict(SCENARIO_RANGES, n_robots=(8, 12), arena=4.0)
+    for seed in range(20):
+        scenario = sample_scenario(seed, ranges)
+        assert scenario["starts"].shape == scenario["goals"].shape
+        assert 8 <= scenario["starts"].shape[0] <= 12
+
+
+def test_unplaceable_scenario_raises():
+    with pytest.raises(ValueError):
+        sample_scenario(0, dict(SCENARIO_RANGES, n_robots=(40, 40), arena=2.0))
@@ -0,0 +1,86 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+import ecbf_control
+import profiling
+from sim_runner import Renderer, Simulation
+
+SECTIONS = ("tick", "update_obstacles", "ecbf.assembly", "ecbf.solve", "go_to_acceleration", "step_dynamics")
+
+
+@pytest.fixture(autouse=True)
+def quiet_sim(monkeypatch, capsys):
+    monkeypatch.setattr(ecbf_control, "is_crash", False)
+    yield
+    profiling.disable()
+
+
+def make_sim():
+    robots = [ecbf_control.Robot_Sim(np.array([x, y, 10.0]), np.array([[-x], [-y]]), i)
+              for i, (x, y) in enumerate([(4, 1), (-4, -1), (1, -4)])]
+    return Simulation(robots, np.array([[0.0, 3.0]]))
+
+
+def load_events(path):
+    with open(path) as f:
+        trace = json.load(f)
+    return trace["traceEvents"]
+
+
+def test_profiled_run_writes_chrome_trace(tmp_path):
+    sim = make_sim()
+    with profiling.profile(trace=True) as prof:
+        sim.run(20, renderer=Renderer(pause=None), render_every=10)
+    path = str(tmp_path / "run.trace.json")
+    prof.write_trace(path)
+    events = load_events(path)
+
+    spans = [e for e in events if e["ph"] in "BEX"]
+    assert all(e["ph"] == "X" for e in spans)  # complete events, no unmatched B / E
+    for e in spans:
+        assert e["dur"] >= 0 and e["ts"] >= 0 and isinstance(e["pid"], int)
+    names = [e["name"] for e in spans]
+    summary = prof.summary()["sections"]
+    for name in SECTIONS + ("render",):
+        assert names.count(name) == summary[name]["count"] > 0
+    assert names.count("tick") == 20 and names.count("render") == 2
+
+    # every controller / dynamics section lies within a tick
+    ticks = sorted((e["ts"], e["ts"] + e["dur"]) for e in spans if e["name"] == "tick")
+    for e in spans:
+        if e["name"] in SECTIONS[1:]:
+            assert any(start <= e["ts"] and e["ts"] + e["dur"] <= end for start, end in ticks)
+
+    counters = {e["name"]: e["args"][e["name"]] for e in events if e["ph"] == "C"}
+    assert counters["qp.solves"] == prof.counters["qp.solves"] > 0
+
+
+def test_trace_drops_events_past_limit(tmp_path):
+    with profiling.profile(trace=True) as prof:
+        prof.max_trace_events = 5
+        for _ in range(8):
+            with profiling.section("work"):
+                pass
+    assert prof.dropped_events == 3 and prof.summary()["sections"]["work"]["count"] == 8
+    prof.write_trace(str(tmp_path / "t.json"))
+    assert len(load_events(str(tmp_path / "t.json"))) == 5
+
+    # disabled, sections are not collected and nothing is written
+    assert not profiling.is_enabled()
+    assert profiling.section("work") is profiling.section("other")
+    profiling.write_trace(str(tmp_path / "none.json"))
+    assert not (tmp_path / "none.json").exists()
+
+
+def test_profiling_cli(tmp_path, monkeypatch):
+    out = str(tmp_path / "prof")
+    monkeypatch.setattr(sys, "argv", ["profiling", "test", "--steps", "10", "--out", out])
+    profiling.main()
+    with open(out + ".json") as f:
+        summary = json.load(f)
+    assert summary["sections"]["tick"]["count"] == 10
+    names = {e["name"] for e in load_events(out + ".trace.json") if e["ph"] == "X"}
+    assert set(SECTIONS) <= names
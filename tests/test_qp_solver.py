@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import qp_solver
+from qp_solver import (solve_qp_2d, solve_qp_2d_batch, solve_qp_2d_cvxopt, QP_OPTIMAL, QP_INFEASIBLE,
+                       QP_PATH_WARM)
+
+
+def random_problems(seed, n_problems, n_cons, feasible=True):
+    """Random QPs with constraints violated by u_des, feasible ones contain a
+    random point."""
+    rng = np.random.default_rng(seed)
+    for _ in range(n_problems):
+        A = rng.normal(size=(n_cons, 2))
+        if feasible:
+            b = A @ rng.normal(size=2) + rng.exponential(0.5, size=n_cons)
+        else:
+            b = rng.normal(size=n_cons) - 0.3
+        u_des = 3 * rng.normal(size=2)
+        yield A, b, u_des
+
+
+@pytest.mark.parametrize("n_cons", [1, 2, 5, 8, 9, 30])
+def test_matches_cvxopt(n_cons):
+    n_checked = 0
+    for A, b, u_des in random_problems(n_cons, 200, n_cons):
+        sol = solve_qp_2d(A, b, u_des)
+        ref = solve_qp_2d_cvxopt(A, b, u_des)
+        if ref["status"] != QP_OPTIMAL:
+            continue
+        n_checked += 1
+        assert sol["status"] == QP_OPTIMAL
+        assert np.all(A @ sol["x"] <= b + 1e-8)
+        cost, ref_cost = np.sum((sol["x"] - u_des) ** 2), np.sum((ref["x"] - u_des) ** 2)
+        # exact optimum, cvxopt's interior point solution is only approximately optimal (and feasible)
+        assert cost <= ref_cost * (1 + 1e-6) + 1e-9
+        assert cost >= ref_cost - 1e-4 * (1 + ref_cost)
+    assert n_checked > 150
+
+
+def test_infeasible():
+    A = np.array([[1.0, 0.0], [-1.0, 0.0]])
+    b = np.array([-1.0, -1.0])  # x <= -1 and x >= 1
+    assert solve_qp_2d(A, b, np.zeros(2))["status"] == QP_INFEASIBLE
+    x, feasible = solve_qp_2d_batch(A[np.newaxis], b[np.newaxis], np.zeros((1, 2)))
+    assert not feasible[0]
+
+
+@pytest.mark.parametrize("n_cons", [1, 3, 6, 8])
+def test_small_path_matches_array_path(n_cons, monkeypatch):
+    problems = list(random_problems(100 + n_cons, 200, n_cons)) + \
+        list(random_problems(100 + n_cons, 200, n_cons, feasible=False))
+    small = [solve_qp_2d(A, b, u_des) for A, b, u_des in problems]
+    monkeypatch.setattr(qp_solver, "SMALL_QP_CONSTRAINTS", 0)
+    for (A, b, u_des), sol in zip(problems, small):
+        ref = solve_qp_2d(A, b, u_des)
+        assert sol["status"] == ref["status"]
+        assert sol["path"] == ref["path"]
+        assert sol["active"] == ref["active"]
+        if ref["x"] is not None:
+            assert np.array_equal(sol["x"], ref["x"])
+
+
+@pytest.mark.parametrize("n_cons", [3, 12])
+def test_warm_start_gives_same_optimum(n_cons):
+    for A, b, u_des in random_problems(200 + n_cons, 200, n_cons):
+        cold = solve_qp_2d(A, b, u_des)
+        if cold["status"] != QP_OPTIMAL or not cold["active"]:
+            continue
+        warm = solve_qp_2d(A, b, u_des, warm_active=cold["active"])
+        assert warm["path"] == QP_PATH_WARM
+        np.testing.assert_allclose(warm["x"], cold["x"], rtol=1e-12, atol=1e-12)
+
+
+def test_batch_matches_scalar():
+    n_prob, n_cons = 300, 6
+    rng = np.random.default_rng(7)
+    A = rng.normal(size=(n_prob, n_cons, 2))
+    b = rng.normal(size=(n_prob, n_cons)) - 0.3
+    u_des = rng.normal(size=(n_prob, 2))
+    mask = rng.random((n_prob, n_cons)) < 0.8
+    x, feasible = solve_qp_2d_batch(A, b, u_des, mask)
+    for i in range(n_prob):
+        sol = solve_qp_2d(A[i][mask[i]], b[i][mask[i]], u_des[i])
+        assert feasible[i] == (sol["status"] == QP_OPTIMAL)
+        if feasible[i]:
+            np.testing.assert_allclose(x[i], sol["x"], rtol=1e-9, atol=1e-9)
+
+
+def test_batch_sends_large_problems_to_scalar_solver():
+    rng = np.random.default_rng(11)
+    n_cons = qp_solver.MAX_ACTIVE_SET_CONSTRAINTS + 10
+    problems = list(random_problems(12, 4, n_cons))
+    A = np.array([p[0] for p in problems])
+    b = np.array([p[1] for p in problems])
+    u_des = np.array([p[2] for p in problems])
+    mask = np.ones(b.shape, dtype=bool)
+    mask[:2, 20:] = False  # two small problems, batched
+    x, feasible = solve_qp_2d_batch(A, b, u_des, mask)
+    for i in range(len(problems)):
+        sol = solve_qp_2d(A[i][mask[i]], b[i][mask[i]], u_des[i])
+        assert feasible[i] and sol["status"] == QP_OPTIMAL
+        np.testing.assert_allclose(x[i], sol["x"], rtol=1e-9, atol=1e-9)
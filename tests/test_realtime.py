@@ -0,0 +1,151 @@
+import asyncio
+import selectors
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+import ecbf_control
+import profiling
+import realtime
+from realtime import RealTimeRuntime, StubActuator, StubSensor
+
+PERIOD = 0.01  # s, 100 Hz
+
+
+@pytest.fixture(autouse=True)
+def quiet_sim(monkeypatch, capsys):
+    monkeypatch.setattr(ecbf_control, "is_crash", False)
+
+
+class FakeClockSelector(selectors.DefaultSelector):
+    """Selector that, instead of waiting for a timeout, advances the loop's clock by it."""
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        if timeout is not None and timeout > 0:
+            self.loop.now += timeout
+            timeout = 0
+        return super().select(timeout)
+
+
+class FakeClockLoop(asyncio.SelectorEventLoop):
+    """Event loop on a virtual clock: sleeps take no wall time, and code run in
+    the loop takes none unless it advances loop.now."""
+    def __init__(self):
+        self.now = 0.0
+        super().__init__(FakeClockSelector(self))
+
+    def time(self):
+        return self.now
+
+
+class FakeExecutor():
+    """Runs each solve at once, but completes its future solve_times[k] (s) of
+    loop time after the k-th submit."""
+    def __init__(self, loop, solve_times):
+        self.loop = loop
+        self.solve_times = list(solve_times)
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        result = fn(*args)
+        self.submitted.append((self.loop.time(), result))
+        self.loop.call_at(self.loop.time() + self.solve_times.pop(0), future.set_result, result)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def make_robots(n):
+    return [ecbf_control.Robot_Sim(np.array([x, y, 10.0]), np.array([[-x], [-y]]), i, hist_maxlen=1)
+            for i, (x, y) in enumerate([(4, 1), (-4, -1)][:n])]
+
+
+def run_fake_clock(runtime, n_cycles):
+    loop = FakeClockLoop()
+    try:
+        with profiling.profile() as prof:
+            summ = loop.run_until_complete(runtime.run(n_cycles=n_cycles))
+    finally:
+        loop.close()
+    return summ, prof
+
+
+def test_deadline_misses_and_skipped_releases():
+    robots = make_robots(1)
+    runtime = RealTimeRuntime(robots, StubSensor(robots), StubActuator(), rate=1 / PERIOD)
+    solve_times = [0.002, 0.015, 0.002, 0.034, 0.002, 0.002]
+    solve = runtime._solve
+    clock = []
+
+    def slow_solve(robot, reading):
+        loop = asyncio.get_running_loop()
+        loop.now += solve_times[len(clock)]
+        clock.append(loop.now)
+        return solve(robot, reading)
+
+    runtime._solve = slow_solve
+    summ, prof = run_fake_clock(runtime, len(solve_times))
+
+    # releases 0, 1, 3, 4, 8, 9: cycle 1 ends at 25 ms (release 2 skipped), cycle 4 at 74 ms (5, 6, 7 skipped)
+    releases = PERIOD * np.array([0, 1, 3, 4, 8, 9])
+    np.testing.assert_allclose(clock, releases + solve_times)
+    stats = runtime.stats[0]
+    assert (stats.n_cycles, stats.deadline_misses, stats.skipped, stats.fallbacks) == (6, 2, 4, 0)
+    np.testing.assert_allclose(np.asarray(stats.latency), solve_times)
+    np.testing.assert_allclose(np.asarray(stats.jitter), 0, atol=1e-12)
+    assert summ["total"]["deadline_misses"] == 2 and summ["total"]["skipped"] == 4
+    assert prof.counters["rt.deadline_misses"] == 2 and "rt.fallbacks" not in prof.counters
+
+
+def test_solve_budget_falls_back_to_last_safe_control(monkeypatch):
+    robots = make_robots(1)
+    runtime = RealTimeRuntime(robots, StubSensor(robots), StubActuator(), rate=1 / PERIOD, solve_budget=0.5)
+    executors = []
+
+    def make_executor(max_workers):
+        executors.append(FakeExecutor(asyncio.get_running_loop(), [0.002, 0.012, 0.002]))
+        return executors[-1]
+
+    sent = []
+    send = realtime.go_to_acceleration
+
+    def go_to_acceleration(state, u_hat_acc, param_dict):
+        sent.append((asyncio.get_running_loop().time(), u_hat_acc.copy()))
+        return send(state, u_hat_acc, param_dict)
+
+    monkeypatch.setattr(realtime, "ThreadPoolExecutor", make_executor)
+    monkeypatch.setattr(realtime, "go_to_acceleration", go_to_acceleration)
+    summ, prof = run_fake_clock(runtime, 4)
+
+    # cycle 1's solve overruns its 5 ms budget: it sends cycle 0's control, and cycle 2 picks
+    # up the late result instead of starting a new solve
+    submitted = executors[0].submitted
+    np.testing.assert_allclose([t for t, _ in submitted], PERIOD * np.array([0, 1, 3]))
+    times = [t for t, _ in sent]
+    np.testing.assert_allclose(times, [0.002, 0.015, 0.022, 0.032])
+    assert np.array_equal(sent[0][1], submitted[0][1])
+    assert np.array_equal(sent[1][1], submitted[0][1])
+    assert np.array_equal(sent[2][1], submitted[1][1])
+    assert np.array_equal(sent[3][1], submitted[2][1])
+    assert np.array_equal(runtime.last_u[0], submitted[2][1])
+
+    stats = runtime.stats[0]
+    assert (stats.n_cycles, stats.deadline_misses, stats.skipped, stats.fallbacks) == (4, 0, 0, 1)
+    assert summ["total"]["fallbacks"] == 1
+    assert prof.counters["rt.fallbacks"] == 1 and "rt.deadline_misses" not in prof.counters
+    assert runtime._executor is None and robots[0].ecbf.state is robots[0].state
+
+
+def test_per_robot_rates():
+    robots = make_robots(2)
+    runtime = RealTimeRuntime(robots, StubSensor(robots), StubActuator(), rate=[100, 50])
+    np.testing.assert_allclose(runtime.periods, [0.01, 0.02])
+    summ, _ = run_fake_clock(runtime, 5)
+    assert [row["n_cycles"] for row in summ["robots"]] == [5, 5]
+    assert summ["total"]["deadline_misses"] == 0 and summ["total"]["skipped"] == 0
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import ecbf_control
+import exercises
+import localization_error
+import sim_runner
+import test as test_script
+from recorder import QP_STATUS_CODES, NpyAppender, load_recording
+from checkpoint import load_checkpoint
+from sim_runner import Simulation
+
+
+@pytest.fixture(autouse=True)
+def quiet_sim(monkeypatch, capsys):
+    monkeypatch.setattr(ecbf_control, "is_crash", False)
+
+
+def test_npy_appender_readable_while_growing(tmp_path):
+    path = str(tmp_path / "col.npy")
+    f = NpyAppender(path, (3,), np.int32)
+    f.append(np.arange(6).reshape(2, 3))
+    assert np.array_equal(np.load(path), np.arange(6).reshape(2, 3))
+    f.append(np.arange(6, 9).reshape(1, 3))
+    f.close()
+    assert np.array_equal(np.load(path, mmap_mode="r"), np.arange(9).reshape(3, 3))
+    with pytest.raises(ValueError):
+        NpyAppender(str(tmp_path / "other.npy"), (3,)).append(np.zeros((1, 2)))
+
+
+def test_recording_matches_simulation(tmp_path):
+    robots = [ecbf_control.Robot_Sim(np.array([x, y, 10.0]), np.array([[-x], [-y]]), i)
+              for i, (x, y) in enumerate([(4, 1), (-4, -1), (1, -4)])]
+    obs = np.array([[0.0, 3.0]])
+    sim = Simulation(robots, obs)
+    sim.start_recording(str(tmp_path / "run"), chunk_size=7)  # several chunks and a partial one
+    states, h, status = [], [], []
+    for _ in range(30):
+        sim.step()
+        states.append(sim.states())
+        h.append([np.array(robot.ecbf.h).ravel() for robot in robots])
+        status.append([QP_STATUS_CODES[robot.ecbf.qp_status] for robot in robots])
+    sim.stop_recording()
+
+    rec = load_recording(str(tmp_path / "run"))
+    assert np.array_equal(rec["tick"], np.arange(30))
+    assert np.array_equal(rec["state"], np.array(states))
+    assert np.array_equal(rec["u_safe"], np.array(sim.trajectory.u_safe))
+    assert np.array_equal(rec["u_nom"], np.array(sim.trajectory.u_nom))
+    assert np.array_equal(rec["qp_status"], np.array(status))
+    assert rec["h"].shape == (30, 3, 3)
+    for t in range(30):
+        for r in range(3):
+            n = h[t][r].size
+            assert np.array_equal(rec["h"][t, r, :n], h[t][r])
+            assert np.isnan(rec["h"][t, r, n:]).all()
+    assert np.array_equal(rec["obs"], obs)
+    assert rec["meta"]["n_robots"] == 3 and rec["meta"]["start_tick"] == 0
+
+
+@pytest.mark.parametrize("script", [test_script, exercises, localization_error])
+def test_headless_recording_keeps_no_history(tmp_path, monkeypatch, script):
+    sims = []
+
+    class KeptSimulation(Simulation):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            sims.append(self)
+
+    monkeypatch.setattr(script, "Simulation", KeptSimulation)
+    out = str(tmp_path / "run")
+    assert script.main(headless=True, n_steps=30, record=out, checkpoint=str(tmp_path / "ckpt"),
+                       checkpoint_every=10) is None
+    sim, = sims
+    assert sim.trajectory is None
+    assert all(len(robot.state_hist) == 1 for robot in sim.robots)
+    assert load_recording(out)["tick"].size == 30
+
+    # continued headless from a checkpoint, without the script
+    resumed = sim_runner.Simulation.from_checkpoint(load_checkpoint(str(tmp_path / "ckpt" / "tick_00000010.npz")),
+                                                    record=False)
+    resumed.run(20)
+    assert all(len(robot.state_hist) == 1 for robot in resumed.robots)
+
+    # runs kept in memory keep the full history
+    sims.clear()
+    script.main(headless=True, n_steps=5)
+    assert all(len(robot.state_hist) == 6 for robot in sims[0].robots)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from ecbf_control import PLOT_RANGE, PLOT_RES, SafetyField, compute_plot_z
+
+
+def full_recompute(robot_pos, static_obs):
+    """Average of compute_plot_z over each robot's obstacles, as Renderer drew it."""
+    z = 0
+    for i in range(robot_pos.shape[0]):
+        others = np.delete(robot_pos, i, axis=0)
+        obs = np.vstack((others, static_obs)).T
+        z = z + compute_plot_z(obs)["z"]
+    return z / robot_pos.shape[0]
+
+
+def test_incremental_field_matches_full_recompute():
+    rng = np.random.default_rng(0)
+    static_obs = rng.uniform(-6, 6, (3, 2))
+    field = SafetyField(static_obs)
+    pos = rng.uniform(-6, 6, (5, 2))
+    assert field.update(pos) == 5
+    np.testing.assert_allclose(field.z, full_recompute(pos, static_obs), rtol=1e-12)
+    for step in range(30):
+        moving = rng.random(5) < 0.5
+        pos = pos + moving[:, np.newaxis] * rng.normal(0, 0.3, (5, 2))
+        if step == 10:
+            pos[0] = [20.0, -20.0]  # off the grid
+        if step == 20:
+            pos[1] = -pos[1]  # a long jump
+        moved = np.count_nonzero(np.any(pos != field.robot_pos, axis=1))
+        assert field.update(pos) == moved
+        np.testing.assert_allclose(field.z, full_recompute(pos, static_obs), rtol=1e-12)
+
+    # a robot leaves the run
+    pos = pos[1:]
+    assert field.update(pos) == 4
+    np.testing.assert_allclose(field.z, full_recompute(pos, static_obs), rtol=1e-12)
+
+
+def test_update_counts_moved_robots():
+    field = SafetyField(x_range=PLOT_RANGE, y_range=PLOT_RANGE, res=PLOT_RES)
+    pos = np.array([[0.0, 0.0, 10.0], [1.0, 1.0, 10.0], [-2.0, 3.0, 10.0]])
+    assert field.update(pos) == 3
+    assert field.update(pos) == 0
+    pos[1, 0] += 0.1
+    pos[2, 2] += 1.0  # height is ignored
+    assert field.update(pos) == 1
+    np.testing.assert_allclose(field.z, full_recompute(pos[:, :2], np.zeros((0, 2))), rtol=1e-12)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import ecbf_control
+from sim_runner import Renderer, Simulation
+
+
+@pytest.fixture(autouse=True)
+def quiet_sim(monkeypatch, capsys):
+    monkeypatch.setattr(ecbf_control, "is_crash", False)
+
+
+def make_robots():
+    return [ecbf_control.Robot_Sim(np.array([x, y, 10.0]), np.array([[-x], [-y]]), i)
+            for i, (x, y) in enumerate([(4, 1), (-4, -1)])]
+
+
+def test_trajectory_records_nominal_control_fed_to_qp():
+    robots = make_robots()
+    sim = Simulation(robots)
+    for _ in range(20):
+        sim.step()
+        assert np.array_equal(sim.trajectory.u_nom[-1], np.array([robot.ecbf.u_nom.ravel() for robot in robots]))
+
+
+def test_run_without_trajectory_cannot_render():
+    sim = Simulation(make_robots(), record=False)
+    with pytest.raises(ValueError):
+        sim.run(10, renderer=Renderer(pause=None))
+    sim.run(10)
+    assert sim.tick == 10
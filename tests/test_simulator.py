@@ -0,0 +1,182 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from simulator import (LidarSimulator, Map, convert_map, distance_transform, load_map, read_binary_map,
+                       write_binary_map)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DATA_MAPS = sorted(glob.glob(os.path.join(DATA_DIR, "*.dat")))
+
+
+@pytest.fixture(autouse=True)
+def quiet_map(capsys):
+    """Map prints its size when loaded."""
+
+
+def free_positions(map1, n, seed=0):
+    """n random points in free cells of map1."""
+    rng = np.random.default_rng(seed)
+    free = np.argwhere(~map1.occupied)
+    cells = free[rng.choice(len(free), n, replace=False)]
+    return cells[:, ::-1] + rng.uniform(0, 1, (n, 2))
+
+
+def write_map(path, occupied):
+    """Write occupied (rows as in Map.map) as a text .dat map, return its path."""
+    np.savetxt(str(path), np.flipud(occupied).astype(int), fmt="%d")
+    return str(path)
+
+
+def brute_force_distance(occupied):
+    oy, ox = np.nonzero(occupied)
+    yy, xx = np.mgrid[0:occupied.shape[0], 0:occupied.shape[1]]
+    return np.sqrt(np.min((xx[..., np.newaxis] - ox) ** 2 + (yy[..., np.newaxis] - oy) ** 2, axis=-1))
+
+
+def test_distance_transform_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        height, width = rng.integers(1, 25, 2)
+        occupied = rng.random((height, width)) < rng.choice([0.01, 0.1, 0.5])
+        dist, nearest = distance_transform(occupied)
+        if not occupied.any():
+            assert np.isinf(dist).all() and (nearest == -1).all()
+            continue
+        assert np.array_equal(dist, brute_force_distance(occupied))
+        yy, xx = np.mgrid[0:height, 0:width]
+        assert occupied[nearest[..., 1], nearest[..., 0]].all()
+        assert np.array_equal(np.hypot(nearest[..., 0] - xx, nearest[..., 1] - yy), dist)
+
+
+@pytest.mark.parametrize("path", DATA_MAPS)
+def test_nearest_obstacle(path):
+    map1 = Map(path)
+    pos = free_positions(map1, 50)
+    near = map1.nearest_obstacle(pos)
+    assert map1.occupied[near["points"][:, 1], near["points"][:, 0]].all()
+    np.testing.assert_allclose(near["dist"], np.linalg.norm(near["points"] - pos, axis=1))
+    cells = np.floor(pos).astype(int)
+    np.testing.assert_array_equal(np.linalg.norm(near["points"] - cells, axis=1), map1.dist[cells[:, 1], cells[:, 0]])
+
+    single = map1.nearest_obstacle(pos[0])
+    assert np.array_equal(single["points"], near["points"][0])
+
+
+@pytest.mark.parametrize("path", DATA_MAPS)
+def test_cast_rays_matches_bresenham_on_straight_beams(path):
+    # along the axes, DDA and the baseline Bresenham line visit the same cells. The origin is
+    # off the cell center so that Bresenham's rounded end point stays in the same row / column
+    map1 = Map(path)
+    lidar = LidarSimulator(map1)
+    angles = np.radians([0, 90, 180, 270])
+    for pos in np.floor(free_positions(map1, 30)) + 0.25:
+        rays = lidar.cast_rays(pos, angles)
+        for angle, hit, point in zip(angles, rays["hit"], rays["points"]):
+            expected = lidar.get_closest_obstacle(pos, angle)
+            if hit:
+                np.testing.assert_array_equal(point, expected)
+            else:
+                assert np.isnan(point).all()
+                np.testing.assert_allclose(expected, [1000 * np.cos(angle), 1000 * np.sin(angle)])
+
+
+def test_cast_rays_chunking_and_map_edges(tmp_path):
+    occupied = np.zeros((40, 60), dtype=bool)
+    occupied[10:30, 45] = True
+    map1 = Map(write_map(tmp_path / "wall.dat", occupied))
+    lidar = LidarSimulator(map1)
+    angles = np.radians(np.arange(0, 360, 7.5))
+    expected = lidar.cast_rays((5.5, 20.5), angles, chunk=1)
+    for chunk in (2, 32, 1000):
+        rays = lidar.cast_rays((5.5, 20.5), angles, chunk=chunk)
+        for key in ("hit", "points", "ranges"):
+            np.testing.assert_array_equal(rays[key], expected[key])
+    # only beams towards the wall hit, at its face x = 45
+    assert expected["hit"].any() and (expected["points"][expected["hit"], 0] == 45).all()
+    assert np.isinf(expected["ranges"][~expected["hit"]]).all()
+
+    # beam origin outside the map, pointing into it
+    rays = lidar.cast_rays((-10.5, 20.5), [0.0])
+    np.testing.assert_array_equal(rays["points"], [[45, 20]])
+
+
+@pytest.mark.parametrize("path", DATA_MAPS)
+def test_sphere_trace_matches_cast_rays(path):
+    map1 = Map(path)
+    lidar = LidarSimulator(map1)
+    angles = np.radians(np.arange(0, 360, 360 / 290))
+    for pos in free_positions(map1, 20):
+        expected = lidar.cast_rays(pos, angles)
+        traced = map1.sphere_trace(pos, angles)
+        for key in ("hit", "points", "ranges"):
+            np.testing.assert_array_equal(traced[key], expected[key])
+
+
+@pytest.mark.parametrize("with_dist", [True, False])
+def test_binary_map_round_trip(tmp_path, with_dist):
+    rng = np.random.default_rng(1)
+    grid = (rng.random((37, 53)) < 0.1).astype(int)
+    path = str(tmp_path / "grid.map")
+    write_binary_map(path, grid, with_dist)
+    data = read_binary_map(path)
+    assert np.array_equal(data["map"], grid)
+    assert np.array_equal(data["occupied"], grid > 0)
+    dist, nearest = distance_transform(grid > 0)
+    # the stored field is float32
+    np.testing.assert_allclose(data["dist"], dist, rtol=1e-6)
+    assert np.array_equal(data["nearest"], nearest)
+    for arr in data.values():
+        assert not arr.flags.writeable
+        with pytest.raises(ValueError):
+            arr[(0,) * arr.ndim] = 0
+    if with_dist:
+        assert all(isinstance(data[key], np.memmap) for key in ("map", "dist", "nearest"))
+
+
+def test_binary_map_rejects_bad_input(tmp_path):
+    with pytest.raises(ValueError):
+        write_binary_map(str(tmp_path / "bad.map"), np.full((3, 3), 0.5))
+    path = tmp_path / "junk.map"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        read_binary_map(str(path))
+
+
+@pytest.mark.parametrize("path", DATA_MAPS)
+def test_convert_map_loads_like_text_map(tmp_path, path):
+    text = Map(path)
+    converted = convert_map(path, str(tmp_path / "converted.map"))
+    binary = Map(converted)
+    assert np.array_equal(binary.map, text.map)
+    assert np.array_equal(binary.occupied, text.occupied)
+    np.testing.assert_allclose(binary.dist, text.dist, rtol=1e-6)
+    assert np.array_equal(binary.nearest, text.nearest)
+    angles = np.radians(np.arange(0, 360, 5))
+    pos = free_positions(text, 1)[0]
+    np.testing.assert_array_equal(LidarSimulator(binary).cast_rays(pos, angles)["points"],
+                                  LidarSimulator(text).cast_rays(pos, angles)["points"])
+
+
+def test_convert_map_default_path(tmp_path):
+    src = write_map(tmp_path / "wall.dat", np.eye(5, dtype=bool))
+    assert convert_map(src) == str(tmp_path / "wall.map")
+    assert os.path.exists(str(tmp_path / "wall.map"))
+
+
+def test_map_cache(tmp_path):
+    path = str(tmp_path / "grid.map")
+    write_binary_map(path, np.eye(6, dtype=int))
+    first, second = Map(path), Map(path)
+    assert first.map is second.map and first.dist is second.dist
+    assert load_map(path) is load_map(path)
+
+    # a rewritten file is loaded again
+    write_binary_map(path, np.eye(6, dtype=int)[::-1])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    third = Map(path)
+    assert third.map is not first.map
+    assert np.array_equal(third.map, np.eye(6, dtype=int)[::-1])
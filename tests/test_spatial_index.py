@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from spatial_index import SpatialGrid
+
+
+def brute_force_pairs(points, radius):
+    dist = np.linalg.norm(points[:, np.newaxis, :] - points[np.newaxis, :, :], axis=-1)
+    i, j = np.nonzero((dist < radius) & ~np.eye(points.shape[0], dtype=bool))
+    return i, j, dist[i, j]
+
+
+@pytest.mark.parametrize("cell_size", [0.5, 1.0, 3.0])
+def test_query_pairs_matches_brute_force(cell_size):
+    rng = np.random.default_rng(0)
+    # negative coordinates, and points on cell boundaries
+    points = np.vstack((rng.uniform(-10, 10, (200, 2)), np.array([[0.0, 0.0], [1.0, 1.0], [-1.0, 0.0], [2.0, -3.0]])))
+    grid = SpatialGrid(points, cell_size)
+    for radius in (0.3, 1.0, 2.5):
+        i, j, dist = grid.query_pairs(radius)
+        i0, j0, dist0 = brute_force_pairs(points, radius)
+        assert np.array_equal(i, i0) and np.array_equal(j, j0)
+        np.testing.assert_allclose(dist, dist0)
+
+        query_idx = np.array([3, 200, 17])
+        i, j, _ = grid.query_pairs(radius, query_idx)
+        sel = np.isin(i0, query_idx)
+        assert sorted(zip(i, j)) == sorted(zip(i0[sel], j0[sel]))
+
+
+def test_query_radius_matches_brute_force():
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-5, 5, (100, 2))
+    grid = SpatialGrid(points, 1.0)
+    for point in rng.uniform(-6, 6, (20, 2)):
+        for radius in (0.5, 2.0):
+            expected = np.flatnonzero(np.linalg.norm(points - point, axis=1) < radius)
+            assert np.array_equal(grid.query_radius(point, radius), expected)
+
+
+def test_empty_grid():
+    grid = SpatialGrid(np.zeros((0, 2)), 1.0)
+    assert len(grid) == 0
+    assert grid.query_radius([0, 0], 1.0).size == 0
+    i, j, dist = grid.query_pairs(1.0)
+    assert i.size == j.size == dist.size == 0